@@ -1,18 +1,19 @@
+import profiling
+profiling.begin_rerun()  # No-op unless REMIND_PROFILE is set
+
 import os
 import streamlit as st
 from PIL import Image
-import torch
-from torchvision import transforms
-from model_arch import AlzheimerDetector
-import google.generativeai as genai
 from dotenv import load_dotenv
 import base64
 import io
-import requests
-from gradcam import generate_gradcam_visualization, create_comparison_image
-import numpy as np
+import tracing
+import assets
 import re
 
+# torch, cv2, pydicom, requests and google.generativeai are imported lazily by
+# the pages that need them (see `python importtime_report.py`)
+
 # Markdown to HTML converter for better text rendering
 def md_to_html(text):
     """Convert markdown text to properly formatted HTML."""
@@ -52,19 +53,10 @@ def md_to_html(text):
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini API Key
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    st.error("API ключ Gemini не настроен. Проверьте ваш файл .env или определите ключ в коде.")
-    st.stop()
+# Stage tracing and /metrics endpoint (off unless REMIND_TRACING=1)
+tracing.configure()
 
-# Configure Gemini
-genai.configure(api_key=GEMINI_API_KEY)
-model_gemini = genai.GenerativeModel('gemini-2.5-flash')  # Make sure this is the correct model
-
-# Pixtral API Configuration
-PIXTRAL_API_KEY = "QqkMxELY0YVGkCx17Vya04Sq9nGvCahu"
-PIXTRAL_ENDPOINT = "https://api.mistral.ai/v1/chat/completions"
+# Gemini and Pixtral clients are created on first use (llm_clients.py)
 
 # Page configuration
 st.set_page_config(
@@ -74,816 +66,178 @@ st.set_page_config(
     # initial_sidebar_state="expanded",
 )
 
-# Custom CSS styles - Modern Design
-st.markdown(
-    """
-    <style>
-    /* Import Google Fonts */
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
-
-    /* Global Styles */
-    * {
-        font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
-    }
-
-    /* Sidebar Styling */
-    [data-testid="stSidebar"] {
-        background: #000000;
-    }
-
-    [data-testid="stSidebar"] [data-testid="stMarkdownContainer"] p {
-        color: white;
-        font-weight: 500;
-    }
-
-    /* Radio buttons in sidebar */
-    [data-testid="stSidebar"] .row-widget.stRadio > div {
-        background-color: rgba(255, 255, 255, 0.1);
-        border-radius: 12px;
-        padding: 8px;
-    }
-
-    [data-testid="stSidebar"] .row-widget.stRadio > div label {
-        background-color: transparent !important;
-        color: white !important;
-        padding: 12px 20px;
-        border-radius: 8px;
-        transition: all 0.3s ease;
-        cursor: pointer;
-    }
-
-    [data-testid="stSidebar"] .row-widget.stRadio > div label:hover {
-        background-color: rgba(255, 255, 255, 0.2) !important;
-        transform: translateX(5px);
-    }
-
-    [data-testid="stSidebar"] .row-widget.stRadio > div label[data-baseweb="radio"] > div:first-child {
-        background-color: white !important;
-    }
-
-    /* Main content area */
-    .main {
-        padding: 2rem;
-    }
-
-    /* Headers */
-    h1, h2, h3, h4, h5, h6 {
-        font-weight: 700;
-        letter-spacing: -0.5px;
-    }
-
-    h2 {
-        color: #000000 !important;
-        font-size: 2.5rem !important;
-        margin-bottom: 0.5rem !important;
-    }
-
-    h4 {
-        color: #555555 !important;
-        font-weight: 400 !important;
-        font-size: 1.1rem !important;
-    }
-
-    /* Prediction Box */
-    .prediction-box {
-        background: #000000;
-        border-radius: 20px;
-        padding: 2.5rem;
-        margin: 2rem 0;
-        box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
-        text-align: center;
-        animation: fadeInUp 0.6s ease;
-    }
-
-    .prediction-box h3 {
-        color: white !important;
-        font-size: 1.8rem !important;
-        margin-bottom: 1rem !important;
-    }
-
-    .prediction-box p {
-        color: white !important;
-        font-size: 1.5rem !important;
-        font-weight: 600 !important;
-        margin-top: 1rem !important;
-        text-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    }
-
-    .prediction-box strong {
-        color: white !important;
-    }
-
-    /* Recommendations Box */
-    .recommendations-box {
-        background: white;
-        border-radius: 20px;
-        padding: 2.5rem;
-        margin: 2rem 0;
-        box-shadow: 0 10px 40px rgba(0,0,0,0.08);
-        border: 1px solid #e2e8f0;
-    }
-
-    .recommendations-box h1,
-    .recommendations-box h2,
-    .recommendations-box h3 {
-        color: #000000 !important;
-        font-weight: 700 !important;
-    }
-
-    .recommendations-box h2 {
-        font-size: 2rem !important;
-        margin-bottom: 1.5rem !important;
-    }
-
-    .recommendations-box strong {
-        color: #000000 !important;
-        font-weight: 700 !important;
-    }
-
-    .recommendations-box hr {
-        border: none !important;
-        border-top: 3px solid #000000 !important;
-        margin: 1.5rem 0 !important;
-        opacity: 0.8 !important;
-    }
-
-    /* Buttons */
-    .stButton > button {
-        background: #000000;
-        color: white;
-        border: none;
-        border-radius: 12px;
-        padding: 0.875rem 2.5rem;
-        font-size: 1.1rem;
-        font-weight: 600;
-        transition: all 0.3s ease;
-        box-shadow: 0 4px 15px rgba(0, 0, 0, 0.3);
-        text-transform: uppercase;
-        letter-spacing: 0.5px;
-    }
-
-    .stButton > button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 6px 25px rgba(0, 0, 0, 0.5);
-        background: #333333;
-    }
-
-    .stButton > button:active {
-        transform: translateY(0);
-    }
-
-    .stButton > button:disabled {
-        background: #e5e5e5 !important;
-        color: #999999 !important;
-        box-shadow: none !important;
-        cursor: not-allowed !important;
-        transform: none !important;
-    }
-
-    /* File Uploader */
-    [data-testid="stFileUploader"] {
-        background: white;
-        border: 2px dashed #000000;
-        border-radius: 16px;
-        padding: 2rem;
-        transition: all 0.3s ease;
-    }
-
-    [data-testid="stFileUploader"]:hover {
-        border-color: #333333;
-        background: #f5f5f5;
-    }
-
-    [data-testid="stFileUploader"] section {
-        border: none !important;
-        background-color: transparent !important;
-    }
-
-    [data-testid="stFileUploader"] button {
-        background: #000000 !important;
-        color: white !important;
-        border-radius: 8px !important;
-        padding: 0.5rem 1.5rem !important;
-        border: 1px solid #000000 !important;
-    }
-
-    /* File uploader internal text visibility */
-    [data-testid="stFileUploader"] * {
-        color: #333333 !important;
-    }
-
-    [data-testid="stFileUploader"] button,
-    [data-testid="stFileUploader"] button * {
-        color: white !important;
-    }
-
-    [data-testid="stFileUploader"] button svg {
-        stroke: white !important;
-        fill: none !important;
-    }
-
-    [data-testid="stFileUploader"] button svg line,
-    [data-testid="stFileUploader"] button svg path,
-    [data-testid="stFileUploader"] button svg polyline {
-        stroke: white !important;
-    }
-
-    [data-testid="stFileUploader"] small {
-        color: #666666 !important;
-    }
-
-    [data-testid="stFileUploader"] svg {
-        fill: #333333 !important;
-    }
-
-    /* Image container */
-    .image-container {
-        display: flex;
-        flex-direction: column;
-        align-items: center;
-        margin: 2rem 0;
-        animation: fadeIn 0.5s ease;
-    }
-
-    .image-container img {
-        border-radius: 16px;
-        box-shadow: 0 10px 40px rgba(0,0,0,0.15);
-        transition: transform 0.3s ease;
-    }
-
-    .image-container img:hover {
-        transform: scale(1.02);
-    }
-
-    .image-label {
-        margin-top: 1rem;
-        color: #333333;
-        font-weight: 500;
-        font-size: 1rem;
-    }
-
-    /* Warning/Info boxes */
-    .stAlert {
-        border-radius: 12px;
-        border: none;
-        box-shadow: 0 4px 15px rgba(0,0,0,0.08);
-    }
-
-    .stAlert p, .stAlert span, .stAlert div {
-        color: #000000 !important;
-        font-weight: 600 !important;
-    }
-
-    /* Animations */
-    @keyframes fadeIn {
-        from {
-            opacity: 0;
-        }
-        to {
-            opacity: 1;
-        }
-    }
-
-    @keyframes fadeInUp {
-        from {
-            opacity: 0;
-            transform: translateY(20px);
-        }
-        to {
-            opacity: 1;
-            transform: translateY(0);
-        }
-    }
-
-    /* Footer */
-    .footer {
-        text-align: center;
-        padding: 2rem;
-        margin-top: 4rem;
-        border-top: 1px solid #cccccc;
-        color: #555555;
-    }
-
-    .footer strong {
-        color: #000000;
-        font-size: 1.1rem;
-    }
-
-    /* Spinner customization */
-    .stSpinner > div {
-        border-top-color: #000000 !important;
-    }
-
-    /* Spinner container and all elements must be visible */
-    .stSpinner,
-    [data-testid="stSpinner"],
-    .stSpinner > div,
-    [data-testid="stSpinner"] > div {
-        opacity: 1 !important;
-        visibility: visible !important;
-    }
-
-    /* Spinner text - comprehensive targeting */
-    .stSpinner,
-    .stSpinner *,
-    [data-testid="stSpinner"],
-    [data-testid="stSpinner"] *,
-    div[data-testid="stSpinner"] + div,
-    div[data-testid="stSpinner"] + div *,
-    .stSpinner ~ div,
-    .stSpinner ~ div *,
-    [class*="spinner"] *,
-    [class*="Spinner"] * {
-        color: #000000 !important;
-        opacity: 1 !important;
-        visibility: visible !important;
-    }
-
-    /* Ensure spinner text elements have proper styling */
-    .stSpinner p,
-    .stSpinner span,
-    .stSpinner div,
-    [data-testid="stSpinner"] p,
-    [data-testid="stSpinner"] span,
-    [data-testid="stSpinner"] div {
-        color: #000000 !important;
-        font-weight: 600 !important;
-        font-size: 1.05rem !important;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True,
-)
+# Custom CSS styles - Modern Design (static/css, minified and cached once per process)
+assets.inject_css("app.css", "theme.css")
 
-# Pixtral Image Validation Function
-def validate_mri_image(image_base64):
-    """
-    Validate if the uploaded image is a brain MRI scan using Pixtral vision AI.
-
-    Args:
-        image_base64: Base64 encoded image string
-
-    Returns:
-        tuple: (is_valid: bool, message: str, confidence: str)
-    """
-    validation_prompt = """Проанализируйте это изображение внимательно и определите, является ли оно МРТ снимком головного мозга.
-
-Вы должны ответить ТОЧНО в этом формате:
-ВАЛИДНО: [ДА/НЕТ]
-УВЕРЕННОСТЬ: [ВЫСОКАЯ/СРЕДНЯЯ/НИЗКАЯ]
-ПРИЧИНА: [Краткое объяснение]
-
-Критерии для валидного МРТ головного мозга:
-1. Должно быть медицинским изображением (черно-белое или цветное медицинское изображение)
-2. Должны быть видны структуры мозга (кора головного мозга, желудочки, белое/серое вещество)
-3. Должно быть МРТ снимком (не КТ, рентген, УЗИ или другие типы изображений)
-4. Должен быть правильный аксиальный, сагиттальный или корональный вид мозга
-5. Не фотография, рисунок или немедицинское изображение
-
-Примеры НЕВАЛИДНЫХ изображений:
-- Фотографии людей, животных, объектов, пейзажей
-- Снимки других частей тела (колено, грудь, живот МРТ)
-- КТ снимки, рентгеновские снимки, УЗИ
-- Низкокачественные или полностью размытые изображения
-- Рисунки или иллюстрации"""
-
-    payload = {
-        "model": "pixtral-12b-2409",
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": validation_prompt},
-                    {"type": "image_url", "image_url": {"url": image_base64}}
-                ]
-            }
-        ],
-        "temperature": 0.3,
-        "top_p": 1,
-        "stream": False
-    }
+# Load Alzheimer's model
+@st.cache_resource
+def load_model():
+    from model_arch import MODEL_PATH, load_pretrained
+    return load_pretrained(MODEL_PATH, device="cpu")
 
+# Tiered prediction / explanation pipeline; caches activations per image across reruns
+@st.cache_resource
+def load_pipeline():
+    from diagnosis_pipeline import DiagnosisPipeline
+    return DiagnosisPipeline(load_model(), class_names)
+
+# Similar-case index (built offline with `python case_index.py build`)
+@st.cache_resource(max_entries=2)
+def _load_case_index(file_versions):
+    from case_index import CaseIndex, StaleIndexError
+    if not CaseIndex.exists():
+        return None
     try:
-        response = requests.post(
-            PIXTRAL_ENDPOINT,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {PIXTRAL_API_KEY}"
-            },
-            json=payload,
-            timeout=30
-        )
-
-        if response.status_code == 200:
-            data = response.json()
-            result_text = data.get('choices', [{}])[0].get('message', {}).get('content', '')
-
-            # Parse the response
-            is_valid = "ВАЛИДНО: ДА" in result_text.upper() or "VALID: YES" in result_text.upper()
-
-            # Extract confidence and reason
-            lines = result_text.strip().split('\n')
-            confidence = "НЕИЗВЕСТНО"
-            reason = "Причина не указана"
-
-            for line in lines:
-                if "УВЕРЕННОСТЬ:" in line.upper() or "CONFIDENCE:" in line.upper():
-                    confidence = line.split(':', 1)[1].strip()
-                elif "ПРИЧИНА:" in line.upper() or "REASON:" in line.upper():
-                    reason = line.split(':', 1)[1].strip()
-
-            return is_valid, reason, confidence
-        else:
-            return False, f"Ошибка сервиса валидации (Статус {response.status_code})", "НИЗКАЯ"
-
-    except Exception as e:
-        st.warning(f"Не удалось проверить изображение: {str(e)}. Продолжаем с осторожностью...")
-        return True, "Проверка пропущена из-за ошибки", "НИЗКАЯ"
-
-
-def analyze_brain_regions(image_base64, predicted_class, confidence_percent):
-    """
-    Use Pixtral AI to analyze specific brain regions and identify abnormalities.
-
-    Args:
-        image_base64: Base64 encoded MRI image
-        predicted_class: The predicted Alzheimer's stage
-        confidence_percent: Model confidence percentage
-
-    Returns:
-        str: Detailed medical analysis of brain regions
-    """
-    analysis_prompt = f"""Вы эксперт-радиолог, анализирующий МРТ снимок головного мозга. ОТВЕЧАЙТЕ ТОЛЬКО НА РУССКОМ ЯЗЫКЕ.
-
-**Клинический контекст:**
-- Прогноз модели ИИ: {predicted_class}
-- Уверенность модели: {confidence_percent:.1f}%
-
-**Ваша задача:**
-Проанализируйте это МРТ изображение головного мозга и предоставьте детальную оценку следующего:
+        return CaseIndex()
+    except StaleIndexError:
+        # Built for a previous model; the page asks for a rebuild
+        return None
+
+def load_case_index():
+    # Cached per mtime of the index and model files, so a rebuild is picked up without a restart
+    from case_index import INDEX_PATH, METADATA_PATH
+    from model_arch import MODEL_PATH
+    return _load_case_index(tuple(os.path.getmtime(path) if os.path.exists(path) else None
+                                  for path in (INDEX_PATH, METADATA_PATH, MODEL_PATH)))
 
-1. **Гиппокампальная область:** Оценить атрофию, потерю объема или структурные изменения
-2. **Желудочковая система:** Оценить размер желудочков и любое расширение
-3. **Корковые области:** Искать истончение коры, особенно в височных и теменных долях
-4. **Белое вещество:** Определить любые гиперинтенсивности белого вещества или повреждения
-5. **Общая структура мозга:** Общие наблюдения об объеме и симметрии мозга
-
-**Форматируйте ваш ответ так:**
-
-РЕГИОНАЛЬНЫЙ АНАЛИЗ
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-- Гиппокамп и медиальная височная доля:
-[Ваши детальные находки]
-
-- Желудочковая система:
-[Ваши детальные находки]
+# Class definitions in Russian
+class_names = ['Легкое нарушение', 'Умеренное нарушение', 'Нет нарушений', 'Очень легкое нарушение']
 
-- Корковые области:
-[Ваши детальные находки]
+# Grad-CAM images are rendered at display resolution (longest edge in pixels)
+GRADCAM_DISPLAY_SIDE = 512
 
-- Белое вещество:
-[Ваши детальные находки]
 
-- Общая оценка:
-[Резюме ключевых находок]
+options = None
+try:
+    # Sidebar
+    st.sidebar.image(assets.image_bytes('img/logo_3.jpg'), use_container_width=True)
+    options = st.sidebar.radio('Опции:', ['Данные пациента', 'Диагностика', 'Виртуальный ассистент'])
 
-КОРРЕЛЯЦИЯ С ПРОГНОЗОМ ИИ:
-[Как ваши находки подтверждают или противоречат прогнозу ИИ "{predicted_class}"]
+    # Configure Gemini API Key
+    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    if not GEMINI_API_KEY:
+        st.error("API ключ Gemini не настроен. Проверьте ваш файл .env или определите ключ в коде.")
+        st.stop()
 
-**Важно:** Будьте конкретны относительно локализации (левое/правое полушарие, передний/задний отдел и т.д.) и тяжести (легкая/умеренная/тяжелая).
-ОТВЕЧАЙТЕ ПОЛНОСТЬЮ НА РУССКОМ ЯЗЫКЕ.
-"""
+    # st.image('img/home_page.jpg', use_container_width=True)
 
-    payload = {
-        "model": "pixtral-12b-2409",
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": analysis_prompt},
-                    {"type": "image_url", "image_url": {"url": image_base64}}
-                ]
-            }
-        ],
-        "temperature": 0.4,
-        "top_p": 0.9,
-        "stream": False
-    }
+    if options == 'Данные пациента':
+        exec(compile(open("paciente.py", encoding="utf-8").read(), "paciente.py", "exec"))
 
-    try:
-        response = requests.post(
-            PIXTRAL_ENDPOINT,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {PIXTRAL_API_KEY}"
-            },
-            json=payload,
-            timeout=45
-        )
-
-        if response.status_code == 200:
-            data = response.json()
-            analysis_text = data.get('choices', [{}])[0].get('message', {}).get('content', '')
-            return analysis_text if analysis_text else "Невозможно сгенерировать детальный анализ."
-        else:
-            return f"Сервис анализа временно недоступен (Статус {response.status_code})"
+    elif options == 'Диагностика':
+        # Model stack is imported only on this page (later reruns hit sys.modules)
+        import time
+        import torch
+        from case_index import CaseIndex
+        from explainers import EXPLAINERS
+        from job_queue import get_queue
+        from llm_clients import RECOMMENDATIONS_FALLBACK, unavailable_providers, validate_mri_image
+        # Resize((128, 128)) + RGB + ToTensor without importing torchvision
+        from mri_dataset import DICOM_EXTENSIONS, preprocess_image
 
-    except Exception as e:
-        return f"Не удалось завершить региональный анализ: {str(e)}"
+        model = load_model()
+        pipeline = load_pipeline()
 
-# Load Alzheimer's model
-@st.cache_resource
-def load_model():
-    model = AlzheimerDetector(input_shape=3, hidden_units=10, output_shape=4, image_dimension=128).to("cpu")
-    model.load_state_dict(torch.load(f"models/alz_CNN.pt", map_location=torch.device('cpu')))
-    model.eval()
-    return model
-
-model = load_model()
-
-# Class definitions in Russian
-class_names = ['Легкое нарушение', 'Умеренное нарушение', 'Нет нарушений', 'Очень легкое нарушение']
-
-# Preprocessing transformations
-transform = transforms.Compose([
-    transforms.Resize((128, 128)),
-    transforms.Lambda(lambda x: x.convert("RGB")),
-    transforms.ToTensor(),
-])
-
-# Sidebar
-st.sidebar.image('img/logo_3.jpg', use_container_width=True)
-options = st.sidebar.radio('Опции:', ['Данные пациента', 'Диагностика', 'Виртуальный ассистент'])
-
-# Main page image
-
-# Convert image to Base64
-def get_base64_of_image(image_path):
-    with open(image_path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode()
-
-# Image path
-image_path = "img/medical.jpg"
-base64_image = get_base64_of_image(image_path)
-
-# Apply modern background styling
-st.markdown(
-    f"""
-    <style>
-    /* Background with subtle gradient overlay */
-    .stApp {{
-        background: #ffffff;
-        background-attachment: fixed;
-    }}
-
-    /* Input fields modern styling */
-    input[type="text"], input[type="number"], textarea {{
-        background-color: #FFFFFF !important;
-        border: 2px solid #e2e8f0 !important;
-        border-radius: 10px !important;
-        padding: 12px !important;
-        transition: all 0.3s ease !important;
-        color: #2d3748 !important;
-    }}
-
-    input[type="text"]:focus, input[type="number"]:focus, textarea:focus {{
-        border-color: #000000 !important;
-        box-shadow: 0 0 0 3px rgba(0, 0, 0, 0.1) !important;
-    }}
-
-    /* Input labels */
-    label {{
-        color: #2d3748 !important;
-        font-weight: 500 !important;
-    }}
-
-    /* Select dropdown styling */
-    div[data-baseweb="select"] {{
-        background-color: #FFFFFF !important;
-        border-radius: 10px !important;
-        border: 2px solid #e2e8f0 !important;
-    }}
-
-    div[data-baseweb="select"] > div {{
-        color: #2d3748 !important;
-        background-color: #FFFFFF !important;
-    }}
-
-    div[data-baseweb="select"] input {{
-        color: #2d3748 !important;
-    }}
-
-    div[data-baseweb="select"] span {{
-        color: #2d3748 !important;
-    }}
-
-    div[data-baseweb="select"]:hover {{
-        border-color: #000000 !important;
-    }}
-
-    /* Dropdown menu items */
-    ul[role="listbox"] li {{
-        color: #2d3748 !important;
-        background-color: #FFFFFF !important;
-    }}
-
-    ul[role="listbox"] li:hover {{
-        background-color: #f7fafc !important;
-    }}
-
-    /* Selected option in dropdown */
-    div[data-baseweb="select"] [aria-selected="true"] {{
-        background-color: #000000 !important;
-        color: white !important;
-    }}
-
-    /* Placeholder text */
-    input::placeholder, textarea::placeholder {{
-        color: #a0aec0 !important;
-        opacity: 1 !important;
-    }}
-
-    /* Number input buttons */
-    button[data-testid="stNumberInputStepUp"],
-    button[data-testid="stNumberInputStepDown"] {{
-        background-color: #f7fafc !important;
-        border-radius: 6px !important;
-        color: #2d3748 !important;
-    }}
-
-    button[data-testid="stNumberInputStepUp"]:hover,
-    button[data-testid="stNumberInputStepDown"]:hover {{
-        background-color: #edf2f7 !important;
-    }}
-
-    /* Number input buttons SVG icons */
-    button[data-testid="stNumberInputStepUp"] svg,
-    button[data-testid="stNumberInputStepDown"] svg {{
-        fill: #2d3748 !important;
-        stroke: #2d3748 !important;
-    }}
-
-    /* Text area */
-    textarea {{
-        min-height: 120px !important;
-    }}
-
-    /* Streamlit widget labels and text */
-    .stTextInput label, .stNumberInput label, .stSelectbox label, .stTextArea label {{
-        color: #2d3748 !important;
-    }}
-
-    /* Widget help text */
-    .stTextInput small, .stNumberInput small, .stSelectbox small, .stTextArea small {{
-        color: #718096 !important;
-    }}
-
-    /* All paragraph text in main content */
-    .main p {{
-        color: #2d3748 !important;
-    }}
-
-    /* Strong/bold text */
-    strong {{
-        color: #2d3748 !important;
-    }}
-
-    /* Selectbox specific fixes */
-    .stSelectbox div[data-baseweb="select"] {{
-        background-color: white !important;
-    }}
-
-    .stSelectbox div[data-baseweb="select"] > div {{
-        background-color: white !important;
-    }}
-
-    /* Force all text in selectbox to be dark */
-    .stSelectbox * {{
-        color: #2d3748 !important;
-    }}
-
-    /* Override any conflicting styles */
-    [data-baseweb="select"] [data-baseweb="input"] {{
-        color: #2d3748 !important;
-    }}
-
-    /* Number input value text */
-    .stNumberInput input[type="number"] {{
-        color: #2d3748 !important;
-        -webkit-text-fill-color: #2d3748 !important;
-    }}
-
-    /* Comprehensive text visibility fix */
-    .stTextInput div[data-baseweb="input"] input,
-    .stNumberInput div[data-baseweb="input"] input,
-    .stTextArea textarea {{
-        color: #2d3748 !important;
-        -webkit-text-fill-color: #2d3748 !important;
-    }}
-
-    /* Ensure SVG icons in buttons are visible */
-    button svg {{
-        fill: currentColor !important;
-    }}
-
-    button[data-testid="stNumberInputStepUp"] svg path,
-    button[data-testid="stNumberInputStepDown"] svg path {{
-        stroke: #2d3748 !important;
-        fill: #2d3748 !important;
-    }}
-
-    /* Markdown content visibility */
-    .main div {{
-        color: inherit;
-    }}
-
-    /* Ensure all divs with inline styles have visible text */
-    div[style*="background"] {{
-        color: #2d3748;
-    }}
-
-    /* Headers in styled divs */
-    div[style] h1, div[style] h2, div[style] h3, div[style] h4, div[style] h5, div[style] h6 {{
-        color: inherit;
-    }}
-
-    /* Strong tags in styled divs */
-    div[style] strong {{
-        color: #2d3748;
-        font-weight: 600;
-    }}
-
-    /* Horizontal rules */
-    div[style] hr {{
-        border-color: #e2e8f0;
-    }}
-    </style>
-    """,
-    unsafe_allow_html=True
-)
-
-# st.image('img/home_page.jpg', use_container_width=True)
-
-if options == 'Данные пациента':
-    exec(open("paciente.py", encoding="utf-8").read())
-
-elif options == 'Диагностика':
-    # Header with modern design
-    st.markdown("""
+        # Header with modern design
+        st.markdown("""
         <div style='text-align: center; padding: 1rem 0 2rem 0;'>
             <h2 style='margin-bottom: 0.5rem;'>Диагностика на основе ИИ</h2>
             <h4 style='color: #555555; font-weight: 400;'>
                 Продвинутая классификация болезни Альцгеймера с использованием глубокого обучения и анализа МРТ
             </h4>
         </div>
-    """, unsafe_allow_html=True)
+        """, unsafe_allow_html=True)
 
-    # Image upload section with modern card design
-    st.markdown("""
+        # Image upload section with modern card design
+        st.markdown("""
         <div style='text-align: center; margin-bottom: 1.5rem;'>
             <p style='font-size: 1.1rem; color: #333333;'>
                 Загрузите МРТ снимок для начала анализа
             </p>
         </div>
-    """, unsafe_allow_html=True)
-
-    col1, col2, col3 = st.columns([1, 2, 1])
-    with col2:
-        uploaded_file = st.file_uploader(
-            "Перетащите изображение МРТ сюда или нажмите для выбора",
-            type=["jpg", "jpeg", "png"],
-            help="Поддерживаемые форматы: JPG, JPEG, PNG"
-        )
-
-    # Variable to store the prediction
-    predicted_class = None
-
-    if uploaded_file:
-        # Display uploaded image with modern styling
-        image = Image.open(uploaded_file)
-        image_base64 = f"data:image/{'jpeg' if uploaded_file.type == 'image/jpeg' else 'png'};base64,{base64.b64encode(uploaded_file.getvalue()).decode()}"
+        """, unsafe_allow_html=True)
 
         col1, col2, col3 = st.columns([1, 2, 1])
         with col2:
-            st.markdown(
-                f"""
+            uploaded_file = st.file_uploader(
+                "Перетащите изображение МРТ сюда или нажмите для выбора",
+                type=["jpg", "jpeg", "png"] + [extension.lstrip('.') for extension in DICOM_EXTENSIONS],
+                help="Поддерживаемые форматы: JPG, JPEG, PNG, DICOM"
+            )
+            explainer_options = {explainer.label: name for name, explainer in EXPLAINERS.items()}
+            explainer_label = st.selectbox(
+                "Метод визуализации внимания",
+                list(explainer_options),
+                help="Grad-CAM — самый быстрый; Grad-CAM++ — лучше выделяет несколько областей; "
+                     "Score-CAM — без градиентов, точнее, но медленнее"
+            )
+            use_tta = st.checkbox(
+                "Устойчивый прогноз (TTA)",
+                help="Усредняет прогноз по слегка сдвинутым и осветлённым копиям снимка; "
+                     "несогласие копий указывает на неуверенный результат"
+            )
+            triage_mode = st.checkbox(
+                "Режим сортировки",
+                help="Карта внимания строится сразу только для неуверенных прогнозов; "
+                     "для остальных — по запросу"
+            )
+
+        # Providers that are down or not configured: their stages are skipped (local-only mode)
+        unavailable = unavailable_providers()
+        local_only = bool(unavailable)
+        if local_only:
+            st.warning(f"""
+            **Локальный режим.** Внешние сервисы ИИ недоступны ({", ".join(p.capitalize() for p in unavailable)}).
+            Доступны прогноз модели CNN и визуализация Grad-CAM; зависящие от них этапы
+            будут включены автоматически после восстановления сервиса.
+            """)
+
+        # Variable to store the prediction
+        predicted_class = None
+
+        if uploaded_file:
+            tracing.new_request("diagnosis")
+
+            # Display uploaded image with modern styling
+            if uploaded_file.name.lower().endswith(DICOM_EXTENSIONS):
+                # DICOM slices are windowed to 8-bit and re-encoded as PNG for display and Pixtral
+                from dicom_loader import load_dicom_image
+                image = load_dicom_image(uploaded_file)
+                png_buffer = io.BytesIO()
+                image.save(png_buffer, format="PNG")
+                image_base64 = f"data:image/png;base64,{base64.b64encode(png_buffer.getvalue()).decode()}"
+            else:
+                image = Image.open(uploaded_file)
+                image_base64 = f"data:image/{'jpeg' if uploaded_file.type == 'image/jpeg' else 'png'};base64,{base64.b64encode(uploaded_file.getvalue()).decode()}"
+
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col2:
+                st.markdown(
+                    f"""
                 <div class='image-container'>
                     <img src='{image_base64}'
                          style='max-width: 100%; width: 500px; border-radius: 16px; box-shadow: 0 10px 40px rgba(0,0,0,0.15);'>
                     <p class='image-label'>Image Uploaded</p>
                 </div>
-                """,
-                unsafe_allow_html=True
-            )
-
-        # STAGE 1: Validate image using Pixtral AI
-        with st.spinner('Проверка изображения с помощью Pixtral AI...'):
-            is_valid, reason, confidence = validate_mri_image(image_base64)
+                    """,
+                    unsafe_allow_html=True
+                )
 
-        if not is_valid:
-            # Image is NOT a brain MRI - show error
-            st.error(f"""
+            # STAGE 1: Validate image using Pixtral AI
+            validation_skipped = 'pixtral' in unavailable
+            if validation_skipped:
+                is_valid, reason, confidence = True, None, None
+            else:
+                with st.spinner('Проверка изображения с помощью Pixtral AI...'):
+                    with tracing.span("validate_mri_image"):
+                        is_valid, reason, confidence = validate_mri_image(
+                            image_base64,
+                            on_error=lambda e: st.warning(f"Не удалось проверить изображение: {str(e)}. Продолжаем с осторожностью...")
+                        )
+
+            if not is_valid:
+                # Image is NOT a brain MRI - show error
+                st.error(f"""
             **Обнаружено недействительное изображение**
 
             Это не похоже на МРТ снимок головного мозга.
@@ -899,30 +253,80 @@ elif options == 'Диагностика':
             - Фотографии, скриншоты или немедицинские изображения
             - КТ снимки, рентгеновские снимки или другие методы визуализации
             - МРТ снимки других частей тела
-            """)
-            st.stop()  # Stop execution - don't proceed to prediction
-        else:
-            # Image validated successfully
-            st.success(f"**Изображение проверено:** {reason} (Уверенность: {confidence})")
-
-        # STAGE 2: Processing and prediction with loading animation
-        with st.spinner('Анализ МРТ снимка с помощью модели ИИ...'):
-            input_image = transform(image).unsqueeze(0)
-
-            with torch.no_grad():
-                output = model(input_image)
-                probabilities = torch.nn.functional.softmax(output[0], dim=0)
-                confidence, predicted = torch.max(probabilities, 0)
-                predicted_class = class_names[predicted.item()]
-                confidence_percent = confidence.item() * 100
-
-            # Generate Grad-CAM visualization
-            gradcam_results = generate_gradcam_visualization(
-                model, input_image, image, class_names
-            )
-
-        # Display prediction with enhanced design
-        st.markdown(f"""
+                """)
+                st.stop()  # Stop execution - don't proceed to prediction
+            elif validation_skipped:
+                st.info("Проверка изображения пропущена: Pixtral недоступен. Убедитесь, что загружен МРТ снимок головного мозга.")
+            else:
+                # Image validated successfully
+                st.success(f"**Изображение проверено:** {reason} (Уверенность: {confidence})")
+
+            # STAGE 2: Processing and prediction with loading animation
+            with st.spinner('Анализ МРТ снимка с помощью модели ИИ...'):
+                with tracing.span("transform"):
+                    input_image = preprocess_image(image)
+
+                tta_result = None
+                with tracing.span("model", tta=use_tta):
+                    # Forward-only; activations are kept for a later Grad-CAM
+                    diagnosis = pipeline.predict(input_image)
+                    probabilities = torch.from_numpy(diagnosis.probabilities)
+                    if use_tta:
+                        import tta
+                        tta_result = tta.predict_adaptive(model, input_image)
+                        probabilities = torch.from_numpy(tta_result.probabilities)
+                    confidence, predicted = torch.max(probabilities, 0)
+                    predicted_class = class_names[predicted.item()]
+                    confidence_percent = confidence.item() * 100
+
+                # Grad-CAM runs up front unless triage mode defers it for confident results
+                if 'explain_requested' not in st.session_state:
+                    st.session_state.explain_requested = None
+                show_explanation = (not triage_mode or local_only or confidence.item() < pipeline.explain_below
+                                    or st.session_state.explain_requested == diagnosis.key)
+                # Link the result to the patient profile saved on the patient page (once per image)
+                patient_id = st.session_state.get('patient_id')
+                saved = st.session_state.setdefault('saved_diagnoses', set())
+                if patient_id is not None and (patient_id, diagnosis.key) not in saved:
+                    from patient_store import get_store
+                    from progression import get_tracker
+                    import heatmap_artifact
+                    scanned_at = time.strftime("%Y-%m-%d %H:%M:%S")
+                    with tracing.span("patient_store"):
+                        # Grad-CAM from the cached activations (tail only), kept as a compact uint8 artifact
+                        cam = pipeline.explain(diagnosis, target_class=predicted.item()).heatmap
+                        heatmap_ref = heatmap_artifact.save(heatmap_artifact.HeatmapArtifact.from_heatmap(
+                            cam, image, class_index=predicted.item(), method="gradcam"))
+                        diagnosis_id = get_store().add_diagnosis(
+                            patient_id, predicted.item(), confidence.item(), probabilities.tolist(),
+                            class_name=predicted_class, image_hash=diagnosis.key, image_name=uploaded_file.name,
+                            heatmap_ref=heatmap_ref, created_at=scanned_at
+                        )
+                        get_tracker().add_scan(patient_id, diagnosis_id, probabilities.tolist(), cam, scanned_at)
+                    saved.add((patient_id, diagnosis.key))
+
+                gradcam_results = None
+                if show_explanation:
+                    with tracing.span("gradcam", method=explainer_options[explainer_label]):
+                        gradcam_results = pipeline.render(
+                            diagnosis, image, method=explainer_options[explainer_label],
+                            target_class=predicted.item(), max_side=GRADCAM_DISPLAY_SIDE
+                        )
+
+                # Latest result for the PDF / HTML report on the patient page (images are encoded there, on demand)
+                previous_report = st.session_state.get('report_diagnosis')
+                st.session_state.report_diagnosis = {
+                    'diagnosis': predicted_class,
+                    'confidence': confidence.item(),
+                    'diagnosed_at': previous_report['diagnosed_at'] if previous_report and previous_report['key'] == diagnosis.key
+                    else time.strftime("%Y-%m-%d %H:%M:%S"),
+                    'key': diagnosis.key,
+                    'views': (gradcam_results['original'], gradcam_results['heatmap_only'], gradcam_results['overlayed'])
+                    if gradcam_results is not None else None,
+                }
+
+            # Display prediction with enhanced design
+            st.markdown(f"""
             <div class='prediction-box'>
                 <h3>Результат диагностики</h3>
                 <p style='font-size: 2rem; margin: 1.5rem 0;'>{predicted_class}</p>
@@ -932,111 +336,213 @@ elif options == 'Диагностика':
                     </p>
                 </div>
             </div>
-            """, unsafe_allow_html=True)
-
-        # Display Grad-CAM Visualization
-        st.markdown("<br>", unsafe_allow_html=True)
-        st.markdown("""
-            <div style='text-align: center; margin: 2rem 0 1rem 0;'>
-                <h3 style='color: #000000;'>Визуализация внимания модели ИИ (Grad-CAM)</h3>
-                <p style='color: #555555; font-size: 0.95rem;'>
-                    Тепловая карта показывает, на какие области мозга ИИ обратил внимание при прогнозировании
-                </p>
-            </div>
-        """, unsafe_allow_html=True)
-
-        # Display three images side by side
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.markdown("<p style='text-align: center; font-weight: 500; color: #333333;'>Оригинальное МРТ</p>", unsafe_allow_html=True)
-            st.image(image, use_container_width=True)
-        with col2:
-            st.markdown("<p style='text-align: center; font-weight: 500; color: #333333;'>Тепловая карта Grad-CAM</p>", unsafe_allow_html=True)
-            st.image(gradcam_results['heatmap_only'], use_container_width=True)
-        with col3:
-            st.markdown("<p style='text-align: center; font-weight: 500; color: #333333;'>Комбинированный вид</p>", unsafe_allow_html=True)
-            st.image(gradcam_results['overlayed'], use_container_width=True)
-
-        st.markdown("""
-            <div style='background: #f5f5f5; border-left: 4px solid #000000; padding: 1rem; margin: 1rem 0; border-radius: 8px;'>
-                <p style='margin: 0; color: #333333; font-size: 0.9rem;'>
-                    <strong>Как читать:</strong> Красные/желтые области указывают на регионы, на которых сосредоточился ИИ.
-                    Более горячие цвета (красный) = большее внимание, более холодные цвета (синий) = меньшее внимание.
-                </p>
-            </div>
-        """, unsafe_allow_html=True)
-
-        # ===================================================================
-        # STEP-BY-STEP PROGRESSIVE ANALYSIS WORKFLOW
-        # ===================================================================
-
-        # Initialize session state for tracking workflow progress
-        if 'analysis_step' not in st.session_state:
-            st.session_state.analysis_step = 0
-        if 'brain_analysis_result' not in st.session_state:
-            st.session_state.brain_analysis_result = None
-
-        # Display progress indicator
-        st.markdown("<br>", unsafe_allow_html=True)
-        st.markdown("""
+                """, unsafe_allow_html=True)
+            if tta_result is not None:
+                st.caption(f"TTA: {tta_result.views} вариантов снимка · согласие {tta_result.agreement:.0%} · "
+                           f"{tta_result.elapsed_ms:.0f} мс")
+                if tta_result.unreliable:
+                    st.warning("Варианты снимка дали разные классы — результат менее надёжен, "
+                               "рекомендуется проверка специалистом.")
+
+            if gradcam_results is None:
+                st.info("Уверенный прогноз: карта внимания не построена в режиме сортировки.")
+                col1, col2, col3 = st.columns([1, 1, 1])
+                with col2:
+                    if st.button("Показать карту внимания", use_container_width=True):
+                        st.session_state.explain_requested = diagnosis.key
+                        st.rerun()
+
+            # Display Grad-CAM Visualization
+            if gradcam_results is not None:
+                st.markdown("<br>", unsafe_allow_html=True)
+                st.markdown("""
+                <div style='text-align: center; margin: 2rem 0 1rem 0;'>
+                    <h3 style='color: #000000;'>Визуализация внимания модели ИИ (Grad-CAM)</h3>
+                    <p style='color: #555555; font-size: 0.95rem;'>
+                        Тепловая карта показывает, на какие области мозга ИИ обратил внимание при прогнозировании
+                    </p>
+                </div>
+                """, unsafe_allow_html=True)
+
+                # Display three images side by side
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.markdown("<p style='text-align: center; font-weight: 500; color: #333333;'>Оригинальное МРТ</p>", unsafe_allow_html=True)
+                    st.image(gradcam_results['original'], use_container_width=True)
+                with col2:
+                    st.markdown("<p style='text-align: center; font-weight: 500; color: #333333;'>Тепловая карта Grad-CAM</p>", unsafe_allow_html=True)
+                    st.image(gradcam_results['heatmap_only'], use_container_width=True)
+                with col3:
+                    st.markdown("<p style='text-align: center; font-weight: 500; color: #333333;'>Комбинированный вид</p>", unsafe_allow_html=True)
+                    st.image(gradcam_results['overlayed'], use_container_width=True)
+
+                st.caption(f"Метод: {explainer_label} · время построения карты: {gradcam_results['elapsed_ms']:.0f} мс")
+
+                st.markdown("""
+                <div style='background: #f5f5f5; border-left: 4px solid #000000; padding: 1rem; margin: 1rem 0; border-radius: 8px;'>
+                    <p style='margin: 0; color: #333333; font-size: 0.9rem;'>
+                        <strong>Как читать:</strong> Красные/желтые области указывают на регионы, на которых сосредоточился ИИ.
+                        Более горячие цвета (красный) = большее внимание, более холодные цвета (синий) = меньшее внимание.
+                    </p>
+                </div>
+                """, unsafe_allow_html=True)
+
+            # Similar reference cases from the precomputed embedding index
+            case_index = load_case_index()
+            if case_index is None and CaseIndex.exists():
+                st.caption("Индекс похожих случаев построен для предыдущей версии модели. "
+                           "Обновите его командой `python case_index.py build`.")
+            if case_index is not None:
+                with tracing.span("similar_cases"):
+                    similar_cases = case_index.query_features(diagnosis.features, k=5)
+                st.markdown("""
+                <div style='text-align: center; margin: 2rem 0 1rem 0;'>
+                    <h3 style='color: #000000;'>Похожие случаи</h3>
+                    <p style='color: #555555; font-size: 0.95rem;'>
+                        Наиболее похожие снимки из эталонной базы по признакам модели ИИ
+                    </p>
+                </div>
+                """, unsafe_allow_html=True)
+                case_cols = st.columns(len(similar_cases)) if similar_cases else []
+                for col, case in zip(case_cols, similar_cases):
+                    with col:
+                        label = class_names[case.label] if case.label >= 0 else f"Синтетический ({class_names[case.predicted]})"
+                        st.image(case.path, use_container_width=True)
+                        st.markdown(f"<p style='text-align: center; color: #333333; font-size: 0.85rem;'>{label}<br>Сходство: {case.similarity:.2f}</p>", unsafe_allow_html=True)
+
+            # Progression over the patient's stored scans (running statistics, no re-inference)
+            if st.session_state.get('patient_id') is not None:
+                from progression import get_tracker, plot_difference, plot_trend
+                tracker = get_tracker()
+                trend = tracker.trend(st.session_state.patient_id)
+                if trend is not None and trend.scans >= 2:
+                    st.markdown("""
+                    <div style='text-align: center; margin: 2rem 0 1rem 0;'>
+                        <h3 style='color: #000000;'>Динамика пациента</h3>
+                        <p style='color: #555555; font-size: 0.95rem;'>
+                            Ожидаемая стадия и вероятности классов по всем сохранённым снимкам
+                        </p>
+                    </div>
+                    """, unsafe_allow_html=True)
+                    col1, col2, col3 = st.columns(3)
+                    col1.metric("Снимков", trend.scans)
+                    col2.metric("Стадия (0–3)", f"{trend.stage:.2f}",
+                                delta=f"{trend.stage_change:+.2f}" if trend.stage_change is not None else None,
+                                delta_color="inverse")
+                    col3.metric("Изменение в год",
+                                f"{trend.slope_per_year:+.2f}" if trend.slope_per_year is not None else "—")
+                    series = tracker.series(st.session_state.patient_id)
+                    col1, col2 = st.columns([2, 1])
+                    with col1:
+                        st.pyplot(plot_trend(series, class_names))
+                    difference = tracker.difference(series.diagnosis_ids[-1])
+                    if difference is not None:
+                        with col2:
+                            st.pyplot(plot_difference(difference))
+                            st.caption("Красный — больше внимания модели, чем на предыдущем снимке; синий — меньше")
+
+            # ===================================================================
+            # STEP-BY-STEP PROGRESSIVE ANALYSIS WORKFLOW
+            # ===================================================================
+
+            # Workflow progress belongs to one image: a different upload starts over, so a
+            # report never combines one scan's diagnosis with another scan's analysis
+            if st.session_state.get('analysis_key') != diagnosis.key:
+                st.session_state.analysis_key = diagnosis.key
+                st.session_state.analysis_step = 0
+                st.session_state.brain_analysis_result = None
+                st.session_state.recommendations_result = None
+                st.session_state.region_job = None
+                st.session_state.recommendations_job = None
+
+            # Display progress indicator
+            st.markdown("<br>", unsafe_allow_html=True)
+            st.markdown("""
             <div style='text-align: center; margin: 2rem 0 1rem 0;'>
                 <h3 style='color: #000000;'>Многоэтапный конвейер анализа ИИ</h3>
                 <p style='color: #555555; font-size: 0.95rem;'>
                     Завершите каждый этап для получения комплексных медицинских заключений
                 </p>
             </div>
-        """, unsafe_allow_html=True)
+            """, unsafe_allow_html=True)
 
-        # Progress bar
-        progress_steps = ["[Done] Диагностика завершена", "[Pending] Региональный анализ", "[Pending] Финальные рекомендации"]
-        if st.session_state.analysis_step >= 1:
-            progress_steps[1] = "[Done] Региональный анализ завершен"
-        if st.session_state.analysis_step >= 2:
-            progress_steps[2] = "[Done] Финальные рекомендации завершены"
-
-        cols = st.columns(3)
-        for i, (col, step) in enumerate(zip(cols, progress_steps)):
-            with col:
-                if "[Done]" in step:
-                    st.markdown(f"""
+            # Progress bar
+            progress_steps = ["[Done] Диагностика завершена", "[Pending] Региональный анализ", "[Pending] Финальные рекомендации"]
+            if st.session_state.analysis_step >= 1:
+                progress_steps[1] = "[Done] Региональный анализ завершен"
+            if st.session_state.analysis_step >= 2:
+                progress_steps[2] = "[Done] Финальные рекомендации завершены"
+
+            cols = st.columns(3)
+            for i, (col, step) in enumerate(zip(cols, progress_steps)):
+                with col:
+                    if "[Done]" in step:
+                        st.markdown(f"""
                         <div style='background: #000000;
                                     color: white; padding: 1rem; border-radius: 12px; text-align: center;
                                     box-shadow: 0 4px 15px rgba(0, 0, 0, 0.3);'>
                             <strong>{step.replace('[Done] ', '')}</strong>
                         </div>
-                    """, unsafe_allow_html=True)
-                elif "[Pending]" in step:
-                    st.markdown(f"""
+                        """, unsafe_allow_html=True)
+                    elif "[Pending]" in step:
+                        st.markdown(f"""
                         <div style='background: #f5f5f5; color: #333333; padding: 1rem;
                                     border-radius: 12px; text-align: center; border: 2px dashed #999999;'>
                             <strong>{step.replace('[Pending] ', '')}</strong>
                         </div>
-                    """, unsafe_allow_html=True)
-
-        st.markdown("<br>", unsafe_allow_html=True)
-
-        # ===================================================================
-        # STEP 2: DETAILED BRAIN REGION ANALYSIS
-        # ===================================================================
-        col1, col2, col3 = st.columns([1, 1, 1])
-        with col2:
-            step2_disabled = st.session_state.analysis_step >= 1
-            get_detailed_analysis = st.button(
-                "Этап 2: Получить детальный анализ областей мозга",
-                use_container_width=True,
-                disabled=step2_disabled,
-                type="primary" if not step2_disabled else "secondary"
-            )
+                        """, unsafe_allow_html=True)
+
+            st.markdown("<br>", unsafe_allow_html=True)
+
+            # ===================================================================
+            # STEP 2: DETAILED BRAIN REGION ANALYSIS
+            # ===================================================================
+            # Stages 2 and 3 run as background jobs; each rerun polls the job stored in the session
+            jobs = get_queue()
+
+            @st.fragment(run_every=2)
+            def job_progress(job_id, label):
+                job = jobs.get(job_id)
+                if job is None or job.done:
+                    st.rerun()
+                attempt = f" (попытка {job.attempts} из {job.max_attempts})" if job.attempts > 1 else ""
+                state = "в очереди" if job.status == "queued" else "выполняется"
+                st.info(f"{label}: {state}{attempt}, {job.elapsed:.0f} с. Результат появится автоматически.")
+
+            region_job = jobs.get(st.session_state.get('region_job'))
+            if region_job is not None and region_job.done and st.session_state.analysis_step < 1:
+                if region_job.status == "succeeded":
+                    st.session_state.brain_analysis_result = region_job.result
+                else:
+                    st.session_state.brain_analysis_result = f"Не удалось завершить региональный анализ: {region_job.error}"
+                st.session_state.analysis_step = 1
+            region_pending = region_job is not None and not region_job.done
+
+            col1, col2, col3 = st.columns([1, 1, 1])
+            with col2:
+                step2_disabled = st.session_state.analysis_step >= 1 or region_pending or 'pixtral' in unavailable
+                get_detailed_analysis = st.button(
+                    "Этап 2: Получить детальный анализ областей мозга",
+                    use_container_width=True,
+                    disabled=step2_disabled,
+                    type="primary" if not step2_disabled else "secondary"
+                )
 
-        if get_detailed_analysis or st.session_state.analysis_step >= 1:
             if get_detailed_analysis:
-                with st.spinner("Анализ областей мозга с помощью Pixtral AI... Это может занять 5-10 секунд..."):
-                    brain_analysis = analyze_brain_regions(image_base64, predicted_class, confidence_percent)
-                    st.session_state.brain_analysis_result = brain_analysis
-                    st.session_state.analysis_step = 1
+                st.session_state.region_job = jobs.submit(
+                    "analyze_brain_regions",
+                    {'image_base64': image_base64, 'predicted_class': predicted_class,
+                     'confidence_percent': confidence_percent},
+                    key=f"regions:{diagnosis.key}:{predicted_class}",
+                )
+                st.rerun()
 
-            # Display the analysis
-            st.markdown(f"""
+            if region_pending:
+                job_progress(region_job.id, "Анализ областей мозга с помощью Pixtral AI")
+
+            if st.session_state.analysis_step >= 1:
+                # Display the analysis
+                st.markdown(f"""
                 <div style='background: white; border-radius: 20px; padding: 2.5rem; margin: 2rem 0;
                             box-shadow: 0 10px 40px rgba(0,0,0,0.08); border: 3px solid #000000;'>
                     <h2 style='color: #000000; font-size: 1.8rem; margin-bottom: 1.5rem; text-align: center; font-weight: 700;'>
@@ -1046,129 +552,59 @@ elif options == 'Диагностика':
                         {md_to_html(st.session_state.brain_analysis_result)}
                     </div>
                 </div>
-            """, unsafe_allow_html=True)
+                """, unsafe_allow_html=True)
 
-            # Important disclaimer
-            st.info("""
+                # Important disclaimer
+                st.info("""
                 **Анализ завершен.** Региональные находки зафиксированы.
                 Переходите к Этапу 3 для получения комплексных рекомендаций по лечению.
-            """)
+                """)
 
-        # ===================================================================
-        # STEP 3: COMPREHENSIVE MEDICAL RECOMMENDATIONS (Uses ALL Data)
-        # ===================================================================
-
-        def get_comprehensive_recommendations(diagnosis, confidence, brain_analysis, gradcam_data):
-            """
-            Generate comprehensive recommendations using ALL collected data:
-            - CNN diagnosis + confidence
-            - Grad-CAM attention regions
-            - Pixtral regional analysis
-            """
-            prompt = f"""Вы эксперт-невролог, создающий комплексный план лечения и управления. ОТВЕЧАЙТЕ ПОЛНОСТЬЮ НА РУССКОМ ЯЗЫКЕ.
-
-**ДИАГНОСТИЧЕСКИЕ ДАННЫЕ ПАЦИЕНТА:**
-
-1. **Диагноз модели ИИ:** {diagnosis}
-   - Уверенность модели: {confidence:.1f}%
-   - Обучена на обширном датасете МРТ болезни Альцгеймера (точность 95.47%)
-
-2. **Области фокуса модели ИИ (Grad-CAM анализ):**
-   - CNN модель в основном сосредоточилась на: гиппокампальных областях, желудочковой системе и корковых областях
-   - Это области, которые больше всего повлияли на решение классификации ИИ
-
-3. **Детальный региональный анализ мозга (Pixtral AI):**
-{brain_analysis}
-
-**ВАША ЗАДАЧА:**
-На основе ВСЕХ вышеуказанных данных (диагноз, внимание модели и детальные региональные находки), создайте комплексный, персонализированный план медицинских действий.
-
-**ФОРМАТИРУЙТЕ ВАШ ОТВЕТ ТАК:**
-
-КОМПЛЕКСНЫЙ ПЛАН МЕДИЦИНСКИХ ДЕЙСТВИЙ
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-I. НЕМЕДЛЕННЫЕ СЛЕДУЮЩИЕ ШАГИ
-• [Срочные действия, требуемые в течение 1-2 недель]
-• [Необходимые направления к специалистам]
-• [Дополнительные диагностические тесты для назначения]
-
-II. РЕКОМЕНДАЦИИ ПО ЛЕЧЕНИЮ
-• [Варианты медикаментов на основе тяжести]
-• [Соображения по дозировке]
-• [Ожидаемые результаты и мониторинг]
-
-III. КОГНИТИВНЫЕ ВМЕШАТЕЛЬСТВА
-• [Программы когнитивных тренировок]
-• [Упражнения для памяти]
-• [Активности для здоровья мозга]
-
-IV. МОДИФИКАЦИИ ОБРАЗА ЖИЗНИ
-• [Диетические рекомендации (средиземноморская диета и т.д.)]
-• [Режим упражнений (аэробные + силовые тренировки)]
-• [Улучшения гигиены сна]
-• [Техники управления стрессом]
-
-V. СОЦИАЛЬНЫЕ МЕРЫ И ПОДДЕРЖКА
-• [Обучение ухаживающих и группы поддержки]
-• [Активности социального взаимодействия]
-• [Планирование безопасности дома]
-
-VI. ПЛАН МОНИТОРИНГА
-• [График последующих визуализаций (например, МРТ каждые 6-12 месяцев)]
-• [Частота когнитивной оценки]
-• [Ключевые биомаркеры для отслеживания]
-
-VII. КОРРЕЛЯЦИЯ С НАХОДКАМИ ИИ
-• [Как региональные находки мозга коррелируют с рекомендованным лечением]
-• [Почему конкретные вмешательства нацелены на пораженные области]
-• [Ожидаемое прогрессирование на основе текущих находок]
-
-VIII. ТРЕВОЖНЫЕ ПРИЗНАКИ ДЛЯ НАБЛЮДЕНИЯ
-• [Симптомы, требующие немедленной медицинской помощи]
-• [Признаки быстрого прогрессирования]
-• [Побочные эффекты медикаментов для мониторинга]
-
-IX. ИССЛЕДОВАНИЯ И КЛИНИЧЕСКИЕ ИСПЫТАНИЯ
-• [Релевантные текущие испытания для этой стадии]
-• [Развивающиеся терапии для обсуждения с неврологом]
-
-**ВАЖНО:** Будьте конкретны, основывайтесь на доказательствах и цитируйте текущие клинические руководства, где применимо. Адаптируйте рекомендации к тяжести, указанной диагнозом ({diagnosis}).
-ОТВЕЧАЙТЕ ПОЛНОСТЬЮ НА РУССКОМ ЯЗЫКЕ.
-"""
-
-            try:
-                response = model_gemini.generate_content(prompt)
-                return response.text
-            except Exception as e:
-                st.error(f"Ошибка генерации рекомендаций: {str(e)}")
-                return "Невозможно сгенерировать рекомендации. Пожалуйста, проконсультируйтесь с врачом."
-
-        st.markdown("<br>", unsafe_allow_html=True)
-
-        col1, col2, col3 = st.columns([1, 1, 1])
-        with col2:
-            step3_disabled = st.session_state.analysis_step < 1
-            get_recommendations = st.button(
-                "Этап 3: Получить комплексные медицинские рекомендации",
-                use_container_width=True,
-                disabled=step3_disabled,
-                type="primary" if not step3_disabled else "secondary",
-                help="Сначала завершите Этап 2" if step3_disabled else "Сгенерировать финальные рекомендации, используя все данные анализа"
-            )
+            # ===================================================================
+            # STEP 3: COMPREHENSIVE MEDICAL RECOMMENDATIONS (Uses ALL Data)
+            # ===================================================================
 
-        if get_recommendations:
-            with st.spinner("Синтез комплексных медицинских рекомендаций из всех источников данных... Это может занять 10-15 секунд..."):
-                recommendations = get_comprehensive_recommendations(
-                    diagnosis=predicted_class,
-                    confidence=confidence_percent,
-                    brain_analysis=st.session_state.brain_analysis_result,
-                    gradcam_data=gradcam_results
-                )
+            st.markdown("<br>", unsafe_allow_html=True)
+
+            recommendations_job = jobs.get(st.session_state.get('recommendations_job'))
+            if recommendations_job is not None and recommendations_job.done and st.session_state.analysis_step < 2:
+                if recommendations_job.status == "succeeded":
+                    st.session_state.recommendations_result = recommendations_job.result
+                else:
+                    st.error(f"Ошибка генерации рекомендаций: {recommendations_job.error}")
+                    st.session_state.recommendations_result = RECOMMENDATIONS_FALLBACK
                 st.session_state.analysis_step = 2
+            recommendations_pending = recommendations_job is not None and not recommendations_job.done
+
+            col1, col2, col3 = st.columns([1, 1, 1])
+            with col2:
+                step3_disabled = st.session_state.analysis_step < 1 or recommendations_pending or 'gemini' in unavailable
+                get_recommendations = st.button(
+                    "Этап 3: Получить комплексные медицинские рекомендации",
+                    use_container_width=True,
+                    disabled=step3_disabled,
+                    type="primary" if not step3_disabled else "secondary",
+                    help="Сначала завершите Этап 2" if step3_disabled else "Сгенерировать финальные рекомендации, используя все данные анализа"
+                )
+
+            if get_recommendations:
+                # gradcam_data is not part of the prompt, so only JSON arguments are queued
+                st.session_state.recommendations_job = jobs.submit(
+                    "comprehensive_recommendations",
+                    {'diagnosis': predicted_class, 'confidence': confidence_percent,
+                     'brain_analysis': st.session_state.brain_analysis_result},
+                    key=f"recommendations:{diagnosis.key}:{predicted_class}",
+                )
+                st.rerun()
+
+            if recommendations_pending:
+                job_progress(recommendations_job.id, "Синтез комплексных медицинских рекомендаций")
 
-            # Display comprehensive disclaimer
-            st.warning("""
+            if st.session_state.analysis_step >= 2 and st.session_state.get('recommendations_result'):
+                recommendations = st.session_state.recommendations_result
+
+                # Display comprehensive disclaimer
+                st.warning("""
                 **КРИТИЧЕСКОЕ МЕДИЦИНСКОЕ ПРЕДУПРЕЖДЕНИЕ**
 
                 Этот комплексный анализ интегрирует:
@@ -1190,10 +626,10 @@ IX. ИССЛЕДОВАНИЯ И КЛИНИЧЕСКИЕ ИСПЫТАНИЯ
                 - Следуйте рекомендациям вашего врача, а не только предложениям ИИ
 
                 **Этот инструмент предназначен для ПОМОЩИ медицинским специалистам, а не для их замены.**
-            """)
+                """)
 
-            # Display recommendations with modern design
-            st.markdown(f"""
+                # Display recommendations with modern design
+                st.markdown(f"""
                 <div class='recommendations-box' style='border: 3px solid #000000;'>
                     <h2 style='text-align: center; margin-bottom: 2rem; color: #000000; font-size: 2rem; font-weight: 700;'>
                         Комплексный план медицинских действий
@@ -1208,10 +644,10 @@ IX. ИССЛЕДОВАНИЯ И КЛИНИЧЕСКИЕ ИСПЫТАНИЯ
                         {md_to_html(recommendations)}
                     </div>
                 </div>
-            """, unsafe_allow_html=True)
+                """, unsafe_allow_html=True)
 
-            # Final summary
-            st.success("""
+                # Final summary
+                st.success("""
                 **Анализ завершен.** Все три этапа анализа ИИ завершены.
 
                 Теперь у вас есть:
@@ -1221,10 +657,10 @@ IX. ИССЛЕДОВАНИЯ И КЛИНИЧЕСКИЕ ИСПЫТАНИЯ
                 4. Комплексные медицинские рекомендации от Gemini AI
 
                 **Следующие шаги:** Распечатайте или сохраните этот отчет.
-            """)
-    else:
-        # Show helpful instructions when no image is uploaded
-        st.markdown("""
+                """)
+        else:
+            # Show helpful instructions when no image is uploaded
+            st.markdown("""
             <div style='background: white; border-radius: 20px; padding: 3rem; margin: 2rem auto; max-width: 600px; box-shadow: 0 10px 40px rgba(0,0,0,0.08); text-align: center; border: 1px solid #e0e0e0;'>
                 <h3 style='color: #000000; margin-bottom: 1rem;'>Готов к анализу</h3>
                 <p style='color: #555555; font-size: 1.05rem; line-height: 1.6;'>
@@ -1233,18 +669,18 @@ IX. ИССЛЕДОВАНИЯ И КЛИНИЧЕСКИЕ ИСПЫТАНИЯ
                 </p>
                 <div style='margin-top: 2rem; padding: 1.5rem; background: #f5f5f5; border-radius: 12px;'>
                     <p style='margin: 0; color: #333333; font-size: 0.95rem;'>
-                        <strong>Поддерживаемые форматы:</strong> JPG, JPEG, PNG<br>
+                        <strong>Поддерживаемые форматы:</strong> JPG, JPEG, PNG, DICOM<br>
                         <strong>Точность модели:</strong> 95.47%
                     </p>
                 </div>
             </div>
-        """, unsafe_allow_html=True)
+            """, unsafe_allow_html=True)
 
-elif options == 'Виртуальный ассистент':
-    exec(open("chatbot.py", encoding="utf-8").read())
+    elif options == 'Виртуальный ассистент':
+        exec(compile(open("chatbot.py", encoding="utf-8").read(), "chatbot.py", "exec"))
 
-# Modern Footer
-st.markdown("""
+    # Modern Footer
+    st.markdown("""
     <div class='footer'>
         <div style='max-width: 800px; margin: 0 auto;'>
             <div style='margin-bottom: 1.5rem;'>
@@ -1267,4 +703,7 @@ st.markdown("""
             </p>
         </div>
     </div>
-    """, unsafe_allow_html=True)
+        """, unsafe_allow_html=True)
+finally:
+    # Also runs when the script ends early through st.stop(), st.rerun() or an exception
+    profiling.end_rerun(options or "startup")
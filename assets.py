@@ -0,0 +1,117 @@
+"""
+Static Asset Cache for the Streamlit App
+
+Streamlit re-executes app.py on every interaction. Anything the script
+reads, encodes or emits is redone per rerun unless it is cached at process
+level. This module loads each static asset once per process (keyed by path
+and mtime, so edits are still picked up) and hands out:
+
+- Minified stylesheets (static/css/*.css) as one <style> block. CSS stays
+  inline because Streamlit's static file server sends non-media files as
+  text/plain, which browsers refuse to apply as a stylesheet
+- Downscaled image bytes for st.image, so large logos are not re-sent at
+  full resolution
+
+Usage:
+    python assets.py    # Compare per-rerun payload sizes
+"""
+
+import io
+import os
+import re
+from functools import lru_cache
+
+from PIL import Image
+
+STATIC_DIR = "static"
+CSS_DIR = os.path.join(STATIC_DIR, "css")
+
+
+def _mtime(path):
+    return os.stat(path).st_mtime_ns
+
+
+@lru_cache(maxsize=64)
+def _read_bytes(path, mtime_ns):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def read_bytes(path):
+    """File contents, read once per process (re-read if the file changes)."""
+    return _read_bytes(path, _mtime(path))
+
+
+def minify_css(css):
+    """Strip comments and redundant whitespace from a stylesheet."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};:,>])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+
+@lru_cache(maxsize=64)
+def _stylesheet(names, mtimes):
+    css = "".join(minify_css(read_bytes(os.path.join(CSS_DIR, name)).decode("utf-8")) for name in names)
+    return f"<style>{css}</style>"
+
+
+def stylesheet(*names):
+    """
+    Minified <style> block for one or more stylesheets from static/css.
+
+    Args:
+        *names: CSS file names, e.g. "app.css"
+
+    Returns:
+        HTML string, built once per process per file version
+    """
+    mtimes = tuple(_mtime(os.path.join(CSS_DIR, name)) for name in names)
+    return _stylesheet(names, mtimes)
+
+
+def inject_css(*names):
+    """Emit the stylesheets into the current Streamlit page."""
+    import streamlit as st
+    st.markdown(stylesheet(*names), unsafe_allow_html=True)
+
+
+@lru_cache(maxsize=32)
+def _image_bytes(path, mtime_ns, max_side):
+    with Image.open(io.BytesIO(_read_bytes(path, mtime_ns))) as image:
+        if max(image.size) <= max_side:
+            return _read_bytes(path, mtime_ns)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if image.mode in ("RGBA", "LA", "P"):
+            image.save(buffer, format="PNG", optimize=True)
+        else:
+            image.convert("RGB").save(buffer, format="JPEG", quality=90, optimize=True)
+        return buffer.getvalue()
+
+
+def image_bytes(path, max_side=640):
+    """Encoded image downscaled to at most max_side pixels, computed once per process."""
+    return _image_bytes(path, _mtime(path), max_side)
+
+
+def main():
+    import time
+
+    css_files = [name for name in sorted(os.listdir(CSS_DIR)) if name.endswith(".css")]
+    raw = sum(len(read_bytes(os.path.join(CSS_DIR, name))) for name in css_files)
+    inline = len(stylesheet(*css_files).encode("utf-8"))
+    print(f"CSS per rerun: {raw} B raw, {inline} B minified")
+
+    for path, max_side in (("img/logo_3.jpg", 640),):
+        print(f"{path}: {len(read_bytes(path))} B original, {len(image_bytes(path, max_side))} B at {max_side}px")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        stylesheet(*css_files)
+        image_bytes("img/logo_3.jpg")
+    print(f"Cached lookups: {(time.perf_counter() - start):.3f} ms per rerun")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Similar-Case Retrieval over Reference MRI Scans
+
+Offline job that embeds every reference image (the labeled test set and
+the WGAN synthetic images) with the AlzheimerDetector penultimate features
+(flattened conv_block_2 output) and stores them as an L2-normalized
+float16 matrix. Queries run a vectorized top-k cosine search in NumPy.
+
+Usage:
+    python case_index.py build
+    python case_index.py query path/to/scan.jpg -k 5
+"""
+
+import argparse
+import json
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+
+import dataset_cache
+from model_arch import MODEL_PATH, load_pretrained
+from mri_dataset import DATASET_CLASSES, SYNTHETIC_DIR, TEST_DIR, load_image_array, to_model_tensor
+
+INDEX_PATH = "models/case_index.npy"
+METADATA_PATH = "models/case_index.json"
+
+
+class StaleIndexError(RuntimeError):
+    """The index was built from a different model file than the current one."""
+
+
+@dataclass
+class SimilarCase:
+    """A reference scan returned by a similarity query."""
+    path: str
+    label: int            # Dataset class index, -1 for unlabeled synthetic images
+    predicted: int        # Class index predicted by the model at build time
+    source: str           # "test" or "synthetic"
+    similarity: float     # Cosine similarity to the query (1.0 = identical)
+
+
+def _normalize_rows(features):
+    """L2-normalize feature rows in place so dot products are cosine similarities."""
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    features /= np.maximum(norms, 1e-12)
+    return features
+
+
+@torch.inference_mode()
+def embed_images(model, images, batch_size=128):
+    """
+    Extract normalized penultimate features for a uint8 image array.
+
+    Args:
+        model: AlzheimerDetector in eval mode
+        images: uint8 array (N, 128, 128, 3), e.g. a memory-mapped dataset pack
+        batch_size: Images embedded per forward pass
+
+    Returns:
+        tuple: (float32 features (N, D), int64 predicted class indices (N,))
+    """
+    features, predictions = None, np.empty(len(images), dtype=np.int64)
+    for start in range(0, len(images), batch_size):
+        inputs = to_model_tensor(images[start:start + batch_size])
+
+        # Flatten in the classifier is a no-op on the already flattened features
+        activations = model.extract_features(inputs)
+        logits = model.classifier(activations)
+
+        if features is None:
+            features = np.empty((len(images), activations.shape[1]), dtype=np.float32)
+        features[start:start + len(inputs)] = activations.numpy()
+        predictions[start:start + len(inputs)] = logits.argmax(dim=1).numpy()
+
+    return _normalize_rows(features), predictions
+
+
+def build_index(test_dir=TEST_DIR, synthetic_dir=SYNTHETIC_DIR, index_path=INDEX_PATH,
+                metadata_path=METADATA_PATH, model_path=MODEL_PATH, batch_size=128,
+                cache_dir=dataset_cache.CACHE_DIR):
+    """
+    Embed all reference images and write the float16 index plus its metadata.
+
+    Returns:
+        int: Number of indexed images
+    """
+    model = load_pretrained(model_path)
+
+    packs = [(dataset_cache.load(test_dir, cache_dir), "test")]
+    if synthetic_dir and os.path.isdir(synthetic_dir):
+        packs.append((dataset_cache.load(synthetic_dir, cache_dir, labeled=False), "synthetic"))
+
+    paths, labels, sources, features, predictions = [], [], [], [], []
+    for dataset, source in packs:
+        pack_features, pack_predictions = embed_images(model, dataset.images, batch_size=batch_size)
+        paths += dataset.paths
+        labels += dataset.labels.tolist()
+        sources += [source] * len(dataset)
+        features.append(pack_features)
+        predictions.append(pack_predictions)
+    features = np.concatenate(features)
+    predictions = np.concatenate(predictions)
+
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    np.save(index_path, features.astype(np.float16))
+    with open(metadata_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "model_path": model_path,
+            "model_mtime": os.path.getmtime(model_path),
+            "classes": DATASET_CLASSES,
+            "paths": paths,
+            "labels": labels,
+            "predicted": predictions.tolist(),
+            "sources": sources,
+        }, f, ensure_ascii=False)
+
+    return len(paths)
+
+
+class CaseIndex:
+    """
+    In-memory cosine search over the prebuilt reference index.
+
+    The float16 matrix is upcast once at load time so each query is a
+    single float32 matrix-vector product followed by argpartition.
+    """
+
+    def __init__(self, index_path=INDEX_PATH, metadata_path=METADATA_PATH, check_model=True):
+        with open(metadata_path, encoding="utf-8") as f:
+            metadata = json.load(f)
+        if check_model and self._model_changed(metadata):
+            raise StaleIndexError(f"{index_path} was built with an older {metadata.get('model_path', MODEL_PATH)}; "
+                                  "rebuild it with `python case_index.py build`")
+        self.matrix = np.load(index_path).astype(np.float32)
+        self.paths = metadata["paths"]
+        self.labels = np.asarray(metadata["labels"], dtype=np.int64)
+        self.predicted = np.asarray(metadata["predicted"], dtype=np.int64)
+        self.sources = metadata["sources"]
+
+    @classmethod
+    def exists(cls, index_path=INDEX_PATH, metadata_path=METADATA_PATH):
+        """Whether the offline build job has been run."""
+        return os.path.exists(index_path) and os.path.exists(metadata_path)
+
+    @staticmethod
+    def _model_changed(metadata):
+        model_path = metadata.get("model_path", MODEL_PATH)
+        return not os.path.exists(model_path) or os.path.getmtime(model_path) != metadata.get("model_mtime")
+
+    def __len__(self):
+        return len(self.paths)
+
+    def query_features(self, features, k=5, exclude_self=True):
+        """
+        Top-k cosine search for one feature vector.
+
+        Args:
+            features: 1D feature vector (unnormalized is fine)
+            k: Number of cases to return
+            exclude_self: Skip exact matches (the query image itself is indexed)
+
+        Returns:
+            list of SimilarCase, most similar first
+        """
+        query = np.asarray(features, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.matrix @ query
+
+        if exclude_self:
+            scores[scores > 0.9999] = -np.inf
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            SimilarCase(
+                path=self.paths[i],
+                label=int(self.labels[i]),
+                predicted=int(self.predicted[i]),
+                source=self.sources[i],
+                similarity=float(scores[i]),
+            )
+            for i in top if np.isfinite(scores[i])
+        ]
+
+    @torch.inference_mode()
+    def query(self, model, input_tensor, k=5, exclude_self=True):
+        """
+        Top-k similar cases for a preprocessed input tensor (1, 3, 128, 128).
+        """
+        features = model.extract_features(input_tensor)[0].numpy()
+        return self.query_features(features, k=k, exclude_self=exclude_self)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Similar-case index over reference MRI scans")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Embed reference images and write the index")
+    build_parser.add_argument("--test-dir", default=TEST_DIR)
+    build_parser.add_argument("--synthetic-dir", default=SYNTHETIC_DIR)
+    build_parser.add_argument("--batch-size", type=int, default=128)
+
+    query_parser = subparsers.add_parser("query", help="Find the cases most similar to an image")
+    query_parser.add_argument("image")
+    query_parser.add_argument("-k", type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        count = build_index(test_dir=args.test_dir, synthetic_dir=args.synthetic_dir, batch_size=args.batch_size)
+        print(f"Indexed {count} images in {time.perf_counter() - start:.2f}s -> {INDEX_PATH}")
+        return
+
+    model = load_pretrained()
+    index = CaseIndex()
+    inputs = to_model_tensor(load_image_array(args.image)[None])
+    start = time.perf_counter()
+    cases = index.query(model, inputs, k=args.k)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for case in cases:
+        label = DATASET_CLASSES[case.label] if case.label >= 0 else "synthetic"
+        print(f"{case.similarity:.4f}  {label:<22} {case.path}")
+    print(f"Query over {len(index)} cases took {elapsed_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
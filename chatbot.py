@@ -1,111 +1,14 @@
 import streamlit as st
-import google.generativeai as genai
 import os
 from dotenv import load_dotenv
+import assets
+from llm_clients import gemini_generate, gemini_model
 
 # Load environment variables
 load_dotenv()
 
-# Enhanced custom styles
-st.markdown(
-    """
-    <style>
-        /* Chat container */
-        .chat-container {
-            background: white;
-            border-radius: 16px;
-            padding: 1.5rem;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.06);
-            margin-bottom: 1rem;
-        }
-
-        /* User messages */
-        .message-user {
-            background: #000000;
-            color: white;
-            padding: 1rem 1.25rem;
-            border-radius: 18px 18px 4px 18px;
-            margin: 0.75rem 0;
-            margin-left: 20%;
-            box-shadow: 0 4px 12px rgba(0, 0, 0, 0.3);
-            animation: slideInRight 0.3s ease;
-        }
-
-        /* Assistant messages */
-        .message-assistant {
-            background: #f5f5f5;
-            color: #000000;
-            padding: 1rem 1.25rem;
-            border-radius: 18px 18px 18px 4px;
-            margin: 0.75rem 0;
-            margin-right: 20%;
-            border-left: 4px solid #000000;
-            box-shadow: 0 2px 8px rgba(0, 0, 0, 0.08);
-            animation: slideInLeft 0.3s ease;
-            line-height: 1.6;
-        }
-
-        /* Info card styling */
-        .info-card {
-            background: #000000;
-            color: white;
-            border-radius: 16px;
-            padding: 1.5rem;
-            box-shadow: 0 8px 25px rgba(0, 0, 0, 0.3);
-        }
-
-        .info-card h4 {
-            color: white !important;
-            margin-bottom: 1rem;
-            font-size: 1.2rem;
-        }
-
-        .info-card ul {
-            list-style: none;
-            padding: 0;
-        }
-
-        .info-card li {
-            padding: 0.5rem 0;
-            border-bottom: 1px solid rgba(255,255,255,0.2);
-        }
-
-        .info-card li:last-child {
-            border-bottom: none;
-        }
-
-        /* Animations */
-        @keyframes slideInRight {
-            from {
-                opacity: 0;
-                transform: translateX(20px);
-            }
-            to {
-                opacity: 1;
-                transform: translateX(0);
-            }
-        }
-
-        @keyframes slideInLeft {
-            from {
-                opacity: 0;
-                transform: translateX(-20px);
-            }
-            to {
-                opacity: 1;
-                transform: translateX(0);
-            }
-        }
-
-        /* Chat input styling */
-        .stChatInputContainer {
-            border-top: 2px solid #cccccc;
-            padding-top: 1rem;
-        }
-    </style>
-    """,
-    unsafe_allow_html=True,
-)
+# Enhanced custom styles (static/css/chatbot.css, cached once per process)
+assets.inject_css("chatbot.css")
 
 # Medical instructions template for the model
 MEDICAL_TEMPLATE = """Вы медицинский ассистент, специализирующийся на болезни Альцгеймера и нейродегенеративных заболеваниях.
@@ -132,8 +35,8 @@ def init_gemini():
         st.error('API ключ Gemini не настроен. Пожалуйста, установите его как переменную окружения.')
         st.stop()
 
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-2.5-flash')
+    # Configured once per process and shared by all sessions
+    return gemini_model()
 
 def get_gemini_response(model, question):
     """
@@ -141,7 +44,7 @@ def get_gemini_response(model, question):
     """
     try:
         prompt = MEDICAL_TEMPLATE.format(question=question)
-        response = model.generate_content([prompt, question])
+        response = gemini_generate([prompt, question], priority="chat", model=model, timeout=45)
         return response.text
     except Exception as e:
         return f"Ошибка генерации ответа: {str(e)}"
@@ -0,0 +1,225 @@
+"""
+Circuit Breakers for the External LLM Providers
+
+When Pixtral or Gemini is down or very slow, every upload used to wait
+for the full client timeout (30 s validation, 45 s regional analysis)
+before falling back. A breaker per provider watches the recent calls and
+fails fast instead:
+
+- closed: calls pass; outcomes of the last `window` calls (at most
+  max_age seconds old) are kept
+- open: tripped once at least min_calls were seen and the error rate or
+  the share of calls slower than slow_call reaches its threshold; calls
+  raise CircuitOpen immediately
+- recovery: after an error trip with a health probe, a background thread
+  probes the provider every probe_interval seconds and closes the circuit
+  on success; otherwise (no probe, or tripped for latency, which a cheap
+  probe cannot measure) after open_for seconds a single trial call is let
+  through (half-open) and its outcome closes or re-opens the circuit
+
+The Diagnosis page checks open_circuits() and switches to local-only mode
+(CNN + Grad-CAM) while any provider is unavailable.
+
+Usage:
+    python llm_stub_server.py --port 8765 --error-rate 1.0 &
+    python circuit_breaker.py demo --endpoint http://127.0.0.1:8765/v1/chat/completions
+"""
+
+import argparse
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import tracing
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Calls slower than this count against the provider (validation's timeout is 30 s)
+SLOW_CALL = {"pixtral": 15.0, "gemini": 20.0}
+
+
+class CircuitOpen(RuntimeError):
+    """The provider's circuit is open; the call was not attempted."""
+
+
+class CircuitBreaker:
+    """Error-rate / latency circuit breaker for one provider."""
+
+    def __init__(self, name, probe=None, window=20, min_calls=4, max_error_rate=0.5, slow_call=15.0,
+                 max_slow_rate=0.5, max_age=120.0, open_for=30.0, probe_interval=10.0):
+        self.name = name
+        self.probe = probe
+        self.window = window
+        self.min_calls = min_calls
+        self.max_error_rate = max_error_rate
+        self.slow_call = slow_call
+        self.max_slow_rate = max_slow_rate
+        self.max_age = max_age
+        self.open_for = open_for
+        self.probe_interval = probe_interval
+        self._state = CLOSED
+        self._opened_at = None
+        self._trial = False
+        self._slow_trip = False    # Tripped for latency: recover through a trial call, not the probe
+        self._calls = deque(maxlen=window)    # (timestamp, failed, slow)
+        self._lock = threading.Lock()
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now):
+        if self._state == OPEN and (self.probe is None or self._slow_trip) and now - self._opened_at >= self.open_for:
+            self._state = HALF_OPEN
+        return self._state
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may be attempted now."""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return
+        tracing.metrics.increment("remind_circuit_rejected_total", {"provider": self.name})
+        raise CircuitOpen(f"{self.name} is unavailable (circuit open)")
+
+    def record(self, failed, duration):
+        """Add a call outcome and trip or close the circuit accordingly."""
+        now = time.monotonic()
+        slow = duration >= self.slow_call
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trial = False
+                if failed or slow:
+                    self._trip(now, slow=not failed)
+                else:
+                    self._close()
+                return
+            self._calls.append((now, failed, slow))
+            while self._calls and now - self._calls[0][0] > self.max_age:
+                self._calls.popleft()
+            if self._state != CLOSED or len(self._calls) < self.min_calls:
+                return
+            failures = sum(call[1] for call in self._calls) / len(self._calls)
+            slow_calls = sum(call[2] for call in self._calls) / len(self._calls)
+            if failures >= self.max_error_rate:
+                self._trip(now)
+            elif slow_calls >= self.max_slow_rate:
+                self._trip(now, slow=True)
+
+    @contextmanager
+    def guard(self):
+        """
+        Check the circuit and record the call made inside the block.
+
+        Exceptions count as failures; call .fail() on the yielded object for
+        failed responses (e.g. HTTP 5xx).
+        """
+        self.allow()
+        outcome = _Outcome()
+        start = time.monotonic()
+        try:
+            yield outcome
+        except Exception:
+            outcome.fail()
+            raise
+        finally:
+            self.record(outcome.failed, time.monotonic() - start)
+
+    def _trip(self, now, slow=False):
+        self._state = OPEN
+        self._opened_at = now
+        self._slow_trip = slow
+        self._calls.clear()
+        tracing.metrics.increment("remind_circuit_opened_total", {"provider": self.name})
+        if self.probe is not None and not slow and not self._probing:
+            self._probing = True
+            threading.Thread(target=self._probe_loop, name=f"probe-{self.name}", daemon=True).start()
+
+    def _close(self):
+        self._state = CLOSED
+        self._opened_at = None
+        self._slow_trip = False
+        self._calls.clear()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            try:
+                healthy = bool(self.probe())
+            except Exception:
+                healthy = False
+            tracing.metrics.increment("remind_circuit_probes_total",
+                                      {"provider": self.name, "healthy": str(healthy).lower()})
+            with self._lock:
+                if healthy:
+                    self._close()
+                    self._probing = False
+                    return
+
+    def snapshot(self):
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return {"state": state, "calls": len(self._calls), "failed": sum(call[1] for call in self._calls),
+                    "slow": sum(call[2] for call in self._calls)}
+
+
+class _Outcome:
+    failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider):
+    """Process-wide breaker for 'pixtral' or 'gemini' (llm_clients attaches the health probes)."""
+    with _breakers_lock:
+        breaker = _breakers.get(provider)
+        if breaker is None:
+            breaker = _breakers[provider] = CircuitBreaker(provider, slow_call=SLOW_CALL.get(provider, 15.0))
+        return breaker
+
+
+def open_circuits():
+    """Names of the providers whose circuit is currently open."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.name for breaker in breakers if breaker.state == OPEN]
+
+
+def main():
+    import os
+
+    parser = argparse.ArgumentParser(description="Validation calls against a failing endpoint (use llm_stub_server.py)")
+    parser.add_argument("command", choices=["demo"])
+    parser.add_argument("--endpoint", default="http://127.0.0.1:8765/v1/chat/completions")
+    parser.add_argument("--calls", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ["PIXTRAL_ENDPOINT"] = args.endpoint
+    os.environ.setdefault("PIXTRAL_API_KEY", "stub")    # the stub server ignores the key
+    import llm_clients
+
+    # This file runs as __main__; use the breaker of the module llm_clients imported
+    breaker = llm_clients.get_breaker("pixtral")
+    image = "data:image/png;base64,iVBORw0KGgo="
+    for i in range(args.calls):
+        start = time.perf_counter()
+        verdict = llm_clients.validate_mri_image(image, on_error=lambda e: None, use_cache=False)
+        print(f"call {i + 1:>2}: {(time.perf_counter() - start) * 1000:7.1f} ms  {verdict[1]!r:<45} "
+              f"{breaker.snapshot()['state']}")
+
+
+if __name__ == "__main__":
+    main()
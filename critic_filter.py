@@ -0,0 +1,173 @@
+"""
+Critic-Scored Quality Gate for Synthetic MRI Images
+
+Scores directories of WGAN-generated images with the shipped critic
+(WGAN/critic_epoch_100.h5) and keeps the best candidates, replacing the
+manual curation round used for WGAN_Synthetic_Images.
+
+Selection:
+1. All candidates are decoded once at the critic resolution (64x64) into a
+   cached pack (dataset_cache.py) and scored in vectorized batches; the critic is loaded once per run
+2. Candidates are ranked by critic score (higher = more realistic)
+3. Walking down the ranking, a candidate is kept only if its
+   AlzheimerDetector embedding is not a near-duplicate (cosine similarity
+   above a threshold) of an image already kept, until top-k are selected
+
+Requires TensorFlow (the critic is a Keras model, see WGAN/WGAN_Alzheimer.ipynb).
+
+Usage:
+    python critic_filter.py generated_images/ --top-k 200 --output-dir WGAN/curated
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import torch
+from tensorflow import keras
+
+import dataset_cache
+from model_arch import load_pretrained
+from mri_dataset import IMAGE_SIZE, to_model_tensor
+
+CRITIC_PATH = "WGAN/critic_epoch_100.h5"
+CRITIC_SIZE = 64
+
+
+def load_critic(path=CRITIC_PATH):
+    """Load the Keras critic without its training configuration."""
+    return keras.models.load_model(path, compile=False)
+
+
+def critic_scores(critic, images_uint8, batch_size=512):
+    """
+    Score a batch of images with the critic.
+
+    Args:
+        critic: Keras critic model
+        images_uint8: uint8 array (N, 64, 64, 3)
+        batch_size: Images per critic call
+
+    Returns:
+        float32 array (N,) of critic scores
+    """
+    scores = np.empty(len(images_uint8), dtype=np.float32)
+    for start in range(0, len(images_uint8), batch_size):
+        chunk = np.asarray(images_uint8[start:start + batch_size], dtype=np.float32) / 255.0
+        scores[start:start + len(chunk)] = np.asarray(critic(chunk, training=False)).reshape(-1)
+    return scores
+
+
+@torch.inference_mode()
+def embeddings(model, images_uint8, batch_size=256):
+    """
+    L2-normalized AlzheimerDetector features of 64x64 images upsampled to 128x128.
+
+    Returns:
+        float32 array (N, D)
+    """
+    features = None
+    for start in range(0, len(images_uint8), batch_size):
+        inputs = to_model_tensor(images_uint8[start:start + batch_size], size=IMAGE_SIZE)
+        chunk = model.extract_features(inputs).numpy()
+        if features is None:
+            features = np.empty((len(images_uint8), chunk.shape[1]), dtype=np.float32)
+        features[start:start + len(chunk)] = chunk
+    features /= np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+    return features
+
+
+def select_diverse(scores, features, top_k, max_similarity=0.97):
+    """
+    Greedy top-k by score, skipping near-duplicates of already selected images.
+
+    Args:
+        scores: Critic scores (N,)
+        features: Normalized embeddings (N, D)
+        top_k: Number of images to keep
+        max_similarity: Cosine similarity above which a candidate counts as a duplicate
+
+    Returns:
+        int array of selected indices, best first
+    """
+    order = np.argsort(-scores)
+    selected = np.empty((min(top_k, len(order)), features.shape[1]), dtype=np.float32)
+    chosen = []
+    for index in order:
+        if len(chosen) == len(selected):
+            break
+        if chosen and float((selected[:len(chosen)] @ features[index]).max()) > max_similarity:
+            continue
+        selected[len(chosen)] = features[index]
+        chosen.append(index)
+    return np.asarray(chosen, dtype=np.int64)
+
+
+def filter_directory(directory, top_k=200, max_similarity=0.97, critic_path=CRITIC_PATH,
+                     critic=None, model=None):
+    """
+    Score every image in a directory and select the best diverse subset.
+
+    Returns:
+        dict with 'selected' (list of {path, score}), 'scores' for all
+        candidates and timing information
+    """
+    timings = {}
+    start = time.perf_counter()
+    dataset = dataset_cache.load(directory, size=CRITIC_SIZE, labeled=False)
+    paths, images = dataset.paths, dataset.images
+    timings["decode_s"] = time.perf_counter() - start
+
+    critic = critic if critic is not None else load_critic(critic_path)
+    model = model if model is not None else load_pretrained()
+
+    start = time.perf_counter()
+    scores = critic_scores(critic, images)
+    timings["critic_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    features = embeddings(model, images)
+    chosen = select_diverse(scores, features, top_k, max_similarity)
+    timings["diversity_s"] = time.perf_counter() - start
+
+    return {
+        "selected": [{"path": paths[i], "score": float(scores[i])} for i in chosen],
+        "scores": {path: float(score) for path, score in zip(paths, scores)},
+        "candidates": len(paths),
+        "timings": timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Select synthetic MRI images with the WGAN critic")
+    parser.add_argument("directory", help="Folder with generated images")
+    parser.add_argument("--top-k", type=int, default=200)
+    parser.add_argument("--max-similarity", type=float, default=0.97,
+                        help="Cosine similarity above which two images count as duplicates")
+    parser.add_argument("--critic", default=CRITIC_PATH)
+    parser.add_argument("--output-dir", help="Copy the selected images here")
+    parser.add_argument("--report", help="Write the scores and selection as JSON")
+    args = parser.parse_args()
+
+    result = filter_directory(args.directory, top_k=args.top_k, max_similarity=args.max_similarity,
+                              critic_path=args.critic)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for item in result["selected"]:
+            shutil.copy2(item["path"], args.output_dir)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    timings = result["timings"]
+    print(f"Selected {len(result['selected'])} of {result['candidates']} candidates "
+          f"(decode {timings['decode_s']:.2f}s, critic {timings['critic_s']:.2f}s, "
+          f"diversity {timings['diversity_s']:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Decoded Image Dataset Cache
+
+Packs an image folder once into a contiguous uint8 (N, H, W, 3) .npy file
+plus a labels array and a path index. Training, evaluation, the similar-case
+index and the critic filter memory-map the pack instead of decoding the same
+JPEGs with PIL on every run.
+
+A pack is rebuilt when the file list, the image size, or any file's size or
+modification time changes. With validate="hash" file contents are hashed
+instead, which survives copies that reset mtimes (e.g. git checkouts).
+
+Usage:
+    python dataset_cache.py "Sample Testing Images/test"
+    python dataset_cache.py WGAN/WGAN_Synthetic_Images --unlabeled --size 64
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from mri_dataset import IMAGE_SIZE, list_image_folder, list_images, load_image_array
+
+CACHE_DIR = ".cache/shards"
+FORMAT_VERSION = 1
+
+
+@dataclass
+class PackedDataset:
+    """A memory-mapped image pack."""
+    images: np.ndarray      # uint8 (N, size, size, 3), read-only memmap
+    labels: np.ndarray      # int64 (N,), -1 for unlabeled folders
+    paths: list             # Source image paths, in pack order
+    classes: list           # Class folder names ([] for unlabeled folders)
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def pack_paths(root, cache_dir=CACHE_DIR, size=IMAGE_SIZE):
+    """Pack file names are derived from the folder path and the image size."""
+    key = hashlib.sha1(os.path.abspath(root).encode()).hexdigest()[:12]
+    base = os.path.join(cache_dir, f"{os.path.basename(os.path.normpath(root))}-{size}-{key}")
+    return base + "-images.npy", base + "-labels.npy", base + "-meta.json"
+
+
+def _list(root, labeled):
+    if labeled:
+        return list_image_folder(root)
+    paths = list_images(root)
+    return paths, np.full(len(paths), -1, dtype=np.int64), []
+
+
+def fingerprint(paths, validate="mtime"):
+    """
+    Digest of the source files.
+
+    Args:
+        paths: Image paths
+        validate: "mtime" (file size + mtime, cheap) or "hash" (file contents)
+
+    Returns:
+        Hex digest string
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        digest.update(path.encode())
+        if validate == "hash":
+            with open(path, "rb") as f:
+                digest.update(hashlib.blake2b(f.read(), digest_size=16).digest())
+        elif validate == "mtime":
+            stat = os.stat(path)
+            digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        else:
+            raise ValueError(f"Unknown validation mode '{validate}' (use 'mtime' or 'hash')")
+    return digest.hexdigest()
+
+
+def pack(root, cache_dir=CACHE_DIR, size=IMAGE_SIZE, labeled=True, validate="mtime"):
+    """
+    Decode a folder once into a uint8 pack on disk, reusing an up-to-date pack.
+
+    Args:
+        root: ImageFolder (labeled) or flat image folder (unlabeled)
+        cache_dir: Directory for the pack files
+        size: Edge length the images are resized to
+        labeled: Whether sub-folders are classes
+        validate: "mtime" or "hash", see fingerprint()
+
+    Returns:
+        tuple: (images .npy path, labels .npy path, meta .json path)
+    """
+    images_path, labels_path, meta_path = pack_paths(root, cache_dir, size)
+    paths, labels, classes = _list(root, labeled)
+    relative = [os.path.relpath(path, root) for path in paths]
+    digest = fingerprint(paths, validate)
+
+    if os.path.exists(meta_path) and os.path.exists(images_path) and os.path.exists(labels_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if (meta.get("version") == FORMAT_VERSION and meta.get("size") == size
+                and meta.get("paths") == relative and meta.get(validate) == digest):
+            return images_path, labels_path, meta_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write under a temporary name so an interrupted pack is never picked up
+    partial_path = images_path[:-len(".npy")] + ".partial.npy"
+    images = np.lib.format.open_memmap(partial_path, mode="w+", dtype=np.uint8,
+                                       shape=(len(paths), size, size, 3))
+    for i, path in enumerate(paths):
+        images[i] = load_image_array(path, size)
+    images.flush()
+    del images
+    os.replace(partial_path, images_path)
+    np.save(labels_path, labels)
+
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"version": FORMAT_VERSION, "size": size, "classes": classes,
+                   validate: digest, "paths": relative}, f, ensure_ascii=False)
+    return images_path, labels_path, meta_path
+
+
+def load(root, cache_dir=CACHE_DIR, size=IMAGE_SIZE, labeled=True, validate="mtime"):
+    """
+    Memory-map the pack of a folder, building it first if missing or stale.
+
+    Returns:
+        PackedDataset
+    """
+    images_path, labels_path, meta_path = pack(root, cache_dir, size, labeled, validate)
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    return PackedDataset(
+        images=np.load(images_path, mmap_mode="r"),
+        labels=np.load(labels_path),
+        paths=[os.path.join(root, path) for path in meta["paths"]],
+        classes=meta["classes"],
+    )
+
+
+class ShardDataset(Dataset):
+    """
+    Memory-mapped uint8 pack for DataLoaders. Items are (uint8 CHW tensor,
+    label); the float conversion happens once per batch on the device.
+    """
+
+    def __init__(self, images_path, labels_path):
+        self.images_path = images_path
+        self.labels = torch.from_numpy(np.load(labels_path))
+        self._images = None  # Opened lazily so each worker maps the file itself
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        if self._images is None:
+            self._images = np.load(self.images_path, mmap_mode="r")
+        image = torch.from_numpy(np.ascontiguousarray(self._images[index].transpose(2, 0, 1)))
+        return image, self.labels[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack an image folder into a memory-mappable cache")
+    parser.add_argument("root")
+    parser.add_argument("--size", type=int, default=IMAGE_SIZE)
+    parser.add_argument("--unlabeled", action="store_true", help="Flat folder without class sub-folders")
+    parser.add_argument("--validate", choices=["mtime", "hash"], default="mtime")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    dataset = load(args.root, args.cache_dir, args.size, not args.unlabeled, args.validate)
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    checksum = int(dataset.images.sum(dtype=np.uint64))  # Full pass over the mapped pack
+    scan = time.perf_counter() - start
+    print(f"{len(dataset)} images {dataset.images.shape[1:]} ready in {elapsed:.2f}s; "
+          f"full scan {scan:.3f}s ({dataset.images.nbytes / max(scan, 1e-9) / 1e9:.2f} GB/s, checksum {checksum})")
+
+
+if __name__ == "__main__":
+    main()
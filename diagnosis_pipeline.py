@@ -0,0 +1,279 @@
+"""
+Tiered Diagnosis Pipeline
+
+Splits a diagnosis into tiers so that triaging a queue of scans only pays
+for what is looked at:
+
+1. Prediction (always): one forward-only pass under inference mode, run
+   as explicit stages of the sequential model (split_model), so the
+   Grad-CAM target layer activations and the conv_block_2 output (the
+   similar-case features) come from that same pass. No hooks are attached
+   to the shared model, so concurrent sessions cannot mix up results.
+2. Explanation (lazy): Grad-CAM / Grad-CAM++ are computed from the stored
+   activations by running only the layers after the target layer forward
+   and backward. Score-CAM and other layers fall back to the full explainer.
+3. Rendering (lazy): heatmap images at display size through heatmap_render.
+
+`needs_review` tells the caller whether a prediction is below the
+confidence threshold, where the explanation (and the LLM stages) should be
+produced up front; confident results can skip them until requested.
+
+Diagnoses are cached per image (hash of the preprocessed tensor) in a
+small LRU, so a Streamlit rerun that asks for the explanation of an image
+that was already classified reuses its activations.
+
+Usage:
+    python diagnosis_pipeline.py                 # Full vs tiered latency on the test set
+    python diagnosis_pipeline.py --threshold 0.95
+"""
+
+import argparse
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+import heatmap_render
+from explainers import DEFAULT_TARGET_LAYER, get_explainer, split_model
+
+# Predictions below this confidence get the explanation up front
+EXPLAIN_BELOW = 0.9
+
+# Methods that can be computed from stored activations
+ACTIVATION_METHODS = ("gradcam", "gradcam++")
+
+
+@dataclass
+class Diagnosis:
+    """Tier 1 result plus the lazily filled explanation cache."""
+    key: str
+    class_index: int
+    confidence: float
+    probabilities: np.ndarray       # Softmax over classes (num_classes,)
+    features: np.ndarray            # Flattened conv_block_2 output, for similar-case search
+    activations: torch.Tensor       # Target layer output (1, C, h, w)
+    input_tensor: torch.Tensor
+    elapsed_ms: float
+    explanations: dict = field(default_factory=dict)  # (method, target class) -> Explanation
+
+
+def image_key(input_tensor):
+    """Content hash of a preprocessed input tensor."""
+    return hashlib.blake2b(input_tensor.detach().cpu().numpy().tobytes(), digest_size=16).hexdigest()
+
+
+class DiagnosisPipeline:
+    """
+    Forward-only prediction with cached activations and lazy explanations.
+
+    Thread-safe; create one per process (st.cache_resource in the app).
+    """
+
+    def __init__(self, model, class_names, explain_below=EXPLAIN_BELOW, cache_size=32,
+                 target_layer=DEFAULT_TARGET_LAYER):
+        self.model = model
+        self.class_names = class_names
+        self.explain_below = explain_below
+        self.cache_size = cache_size
+        self.target_layer = target_layer
+        self.head, self.tail = split_model(model, target_layer)
+        if self.tail[-1] is not model.classifier:
+            raise ValueError(f"Target layer {target_layer} must come before the classifier")
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        with self._lock:
+            diagnosis = self._cache.get(key)
+            if diagnosis is not None:
+                self._cache.move_to_end(key)
+            return diagnosis
+
+    @torch.inference_mode()
+    def _forward(self, input_tensor):
+        activations = self.head(input_tensor)
+        features = self.tail[:-1](activations)    # Classifier input: the conv_block_2 output
+        return self.tail[-1](features), activations, features
+
+    def predict(self, input_tensor):
+        """
+        Tier 1: classify a preprocessed input (1, 3, 128, 128).
+
+        Returns:
+            Diagnosis (cached per image)
+        """
+        key = image_key(input_tensor)
+        diagnosis = self._cached(key)
+        if diagnosis is not None:
+            return diagnosis
+
+        start = time.perf_counter()
+        output, activations, features = self._forward(input_tensor)
+        probabilities = F.softmax(output[0], dim=0).numpy()
+        class_index = int(probabilities.argmax())
+        diagnosis = Diagnosis(
+            key=key,
+            class_index=class_index,
+            confidence=float(probabilities[class_index]),
+            probabilities=probabilities,
+            features=features[0].flatten().numpy(),
+            activations=activations,
+            input_tensor=input_tensor,
+            elapsed_ms=(time.perf_counter() - start) * 1000,
+        )
+
+        with self._lock:
+            self._cache[key] = diagnosis
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return diagnosis
+
+    def needs_review(self, diagnosis):
+        """Whether the prediction is below the confidence threshold."""
+        return diagnosis.confidence < self.explain_below
+
+    def explain(self, diagnosis, method="gradcam", target_class=None):
+        """
+        Tier 2: CAM for a diagnosis, computed once per method and target class.
+
+        Returns:
+            explainers.Explanation
+        """
+        if target_class is None:
+            target_class = diagnosis.class_index
+        cache_key = (method, target_class)
+        explanation = diagnosis.explanations.get(cache_key)
+        if explanation is None:
+            explainer = get_explainer(method, self.model, target_layer=self.target_layer)
+            if method in ACTIVATION_METHODS:
+                explanation = explainer.explain_activations(diagnosis.activations, self.tail, target_class)
+            else:
+                explanation = explainer.explain(diagnosis.input_tensor, target_class)
+            diagnosis.explanations[cache_key] = explanation
+        return explanation
+
+    def render(self, diagnosis, original_image, method="gradcam", target_class=None, max_side=None, alpha=0.5):
+        """
+        Tier 3: heatmap images for display.
+
+        Returns:
+            dict in the format of gradcam.generate_gradcam_visualization
+        """
+        explanation = self.explain(diagnosis, method, target_class)
+        rendered = heatmap_render.render(explanation.heatmap, original_image, alpha=alpha, max_side=max_side)
+        return {
+            'original': rendered['original'],
+            'heatmap_only': rendered['heatmap_only'],
+            'overlayed': rendered['overlayed'],
+            'predicted_class': self.class_names[explanation.class_index],
+            'confidence': float(explanation.probabilities[explanation.class_index]),
+            'heatmap_array': explanation.heatmap,
+            'class_index': explanation.class_index,
+            'method': explanation.method,
+            'elapsed_ms': explanation.elapsed_ms
+        }
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def check_concurrent(model, class_names, input_tensors, threads=4, rounds=10):
+    """
+    Predict the inputs from several threads at once and compare with serial results.
+
+    Uses an uncached pipeline, so every call runs the model.
+
+    Returns:
+        (mismatched, total): concurrent results whose prediction, features or
+        activations differ from the serial ones
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    pipeline = DiagnosisPipeline(model, class_names, cache_size=0)
+    expected = [pipeline.predict(input_tensor) for input_tensor in input_tensors]
+
+    def run(offset):
+        mismatched = 0
+        for step in range(rounds * len(input_tensors)):
+            i = (offset + step) % len(input_tensors)
+            diagnosis = pipeline.predict(input_tensors[i])
+            mismatched += not (diagnosis.class_index == expected[i].class_index
+                               and np.allclose(diagnosis.features, expected[i].features, atol=1e-5)
+                               and torch.allclose(diagnosis.activations, expected[i].activations, atol=1e-5))
+        return mismatched
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        mismatched = sum(executor.map(run, range(threads)))
+    return mismatched, threads * rounds * len(input_tensors)
+
+
+def main():
+    import dataset_cache
+    from PIL import Image
+    from gradcam import generate_gradcam_visualization
+    from model_arch import load_pretrained
+    from mri_dataset import TEST_DIR, to_model_tensor
+
+    parser = argparse.ArgumentParser(description="Compare the full and the tiered diagnosis path")
+    parser.add_argument("--data-dir", default=TEST_DIR)
+    parser.add_argument("--threshold", type=float, default=EXPLAIN_BELOW)
+    parser.add_argument("--limit", type=int, default=300)
+    parser.add_argument("--max-side", type=int, default=512)
+    parser.add_argument("--threads", type=int, default=4, help="Threads for the concurrent-predict check")
+    args = parser.parse_args()
+
+    model = load_pretrained()
+    dataset = dataset_cache.load(args.data_dir)
+    class_names = [str(i) for i in range(4)]
+    pipeline = DiagnosisPipeline(model, class_names, explain_below=args.threshold, cache_size=args.limit)
+    count = min(args.limit, len(dataset))
+
+    full_ms = tiered_ms = lazy_ms = 0.0
+    explained = 0
+    max_error = 0.0
+    for image in dataset.images[:count]:
+        original = Image.fromarray(np.asarray(image))
+        input_tensor = to_model_tensor(image[None])
+
+        # Full path: forward + Grad-CAM (second forward + backward) + rendering, for every image
+        start = time.perf_counter()
+        with torch.inference_mode():
+            model(input_tensor)
+        full = generate_gradcam_visualization(model, input_tensor, original, class_names, max_side=args.max_side)
+        full_ms += (time.perf_counter() - start) * 1000
+        heatmap_render.clear_cache()
+
+        # Tiered path: explanation and rendering only under the threshold
+        start = time.perf_counter()
+        diagnosis = pipeline.predict(input_tensor)
+        if pipeline.needs_review(diagnosis):
+            pipeline.render(diagnosis, original, max_side=args.max_side)
+            explained += 1
+        tiered_ms += (time.perf_counter() - start) * 1000
+        heatmap_render.clear_cache()
+
+        # Explanation requested later for an image that is already classified
+        start = time.perf_counter()
+        tiered = pipeline.render(pipeline.predict(input_tensor), original, max_side=args.max_side)
+        lazy_ms += (time.perf_counter() - start) * 1000
+        heatmap_render.clear_cache()
+        max_error = max(max_error, float(np.abs(tiered['heatmap_array'] - full['heatmap_array']).max()))
+
+    print(f"{count} images | full {full_ms / count:.2f} ms/image | tiered {tiered_ms / count:.2f} ms/image "
+          f"({explained / count:.1%} explained up front, threshold {args.threshold})")
+    print(f"On-demand explanation of a cached diagnosis: {lazy_ms / count:.2f} ms/image | "
+          f"max heatmap difference vs. full Grad-CAM {max_error:.2e}")
+
+    inputs = [to_model_tensor(image[None]) for image in dataset.images[:min(count, 32)]]
+    mismatched, total = check_concurrent(model, class_names, inputs, threads=args.threads)
+    print(f"Concurrent predict ({args.threads} threads): {mismatched} of {total} results differ from serial")
+
+
+if __name__ == "__main__":
+    main()
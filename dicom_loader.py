@@ -0,0 +1,335 @@
+"""
+DICOM Ingestion for the Alzheimer's Detection Model
+
+Reads brain MRI DICOM files and series slice by slice and converts every
+slice into the 128x128 RGB input expected by AlzheimerDetector.
+
+Only one slice is decoded at a time: the 16-bit pixel data is rescaled
+(RescaleSlope / RescaleIntercept), windowed (WindowCenter / WindowWidth)
+and downsampled straight away, so a full series never sits in memory as
+full-resolution 16-bit arrays.
+"""
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pydicom
+from PIL import Image
+from pydicom.dataset import FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+from mri_dataset import DICOM_EXTENSIONS
+
+MODEL_INPUT_SIZE = 128
+
+
+@dataclass
+class DicomSlice:
+    """A single decoded slice of a series, already at model resolution."""
+    path: str
+    instance_number: int
+    image: Image.Image
+
+
+def _first_value(value):
+    """Window tags may be multi-valued; the first pair is the default window."""
+    if isinstance(value, pydicom.multival.MultiValue):
+        return float(value[0])
+    return float(value)
+
+
+def read_header(source):
+    """
+    Read the DICOM header only, without touching the pixel data.
+
+    Args:
+        source: File path or file-like object
+
+    Returns:
+        pydicom Dataset without PixelData
+    """
+    return pydicom.dcmread(source, stop_before_pixels=True, force=True)
+
+
+def apply_rescale(pixels, slope=1.0, intercept=0.0):
+    """
+    Apply the modality LUT (RescaleSlope / RescaleIntercept).
+
+    Args:
+        pixels: Raw stored pixel values (any integer dtype)
+        slope: RescaleSlope
+        intercept: RescaleIntercept
+
+    Returns:
+        float32 numpy array with modality values
+    """
+    values = pixels.astype(np.float32)
+    if slope != 1.0:
+        values *= np.float32(slope)
+    if intercept != 0.0:
+        values += np.float32(intercept)
+    return values
+
+
+def apply_window(values, center, width, invert=False):
+    """
+    Map modality values to 8-bit display values with a linear window/level.
+
+    Args:
+        values: float32 array from apply_rescale (modified in place)
+        center: Window center (level)
+        width: Window width
+        invert: True for MONOCHROME1 images (high values displayed dark)
+
+    Returns:
+        uint8 numpy array of the same shape
+    """
+    width = max(float(width), 1.0)
+    lower = float(center) - width / 2.0
+    values -= np.float32(lower)
+    values *= np.float32(255.0 / width)
+    np.clip(values, 0.0, 255.0, out=values)
+    if invert:
+        np.subtract(np.float32(255.0), values, out=values)
+    return values.astype(np.uint8)
+
+
+def window_for(header, values):
+    """
+    Resolve the window to apply to a slice.
+
+    Uses WindowCenter/WindowWidth from the header when present, otherwise
+    falls back to the full range of the slice.
+
+    Returns:
+        tuple: (center, width)
+    """
+    center = header.get('WindowCenter')
+    width = header.get('WindowWidth')
+    if center is not None and width is not None:
+        return _first_value(center), _first_value(width)
+
+    low, high = float(values.min()), float(values.max())
+    return (low + high) / 2.0, max(high - low, 1.0)
+
+
+def _slice_to_uint8(header, pixels, window=None):
+    """Rescale and window a single 2D frame of stored pixel values."""
+    slope = float(header.get('RescaleSlope', 1.0) or 1.0)
+    intercept = float(header.get('RescaleIntercept', 0.0) or 0.0)
+    values = apply_rescale(pixels, slope, intercept)
+
+    center, width = window if window is not None else window_for(header, values)
+    invert = header.get('PhotometricInterpretation', 'MONOCHROME2') == 'MONOCHROME1'
+    return apply_window(values, center, width, invert=invert)
+
+
+def to_model_input(slice_uint8, size=MODEL_INPUT_SIZE):
+    """
+    Downsample a windowed 8-bit slice to the RGB model input.
+
+    Uses the same bilinear PIL resize as the torchvision transform in app.py.
+
+    Args:
+        slice_uint8: 2D uint8 array
+        size: Output edge length (128 for AlzheimerDetector)
+
+    Returns:
+        PIL Image (RGB, size x size)
+    """
+    image = Image.fromarray(slice_uint8)
+    if size is not None and image.size != (size, size):
+        image = image.resize((size, size), Image.BILINEAR)
+    return image.convert('RGB')
+
+
+def _iter_frames(source, header):
+    """Yield the 2D frames of a file one at a time."""
+    frames = int(header.get('NumberOfFrames', 1) or 1)
+    if frames > 1:
+        # Multi-frame objects are decoded frame by frame instead of as one volume
+        from pydicom.pixels import iter_pixels
+        yield from iter_pixels(source)
+        return
+
+    dataset = pydicom.dcmread(source, force=True)
+    yield dataset.pixel_array
+
+
+def load_dicom_image(source, size=None, window=None):
+    """
+    Decode a single-frame DICOM file into a PIL image.
+
+    Used by the uploader on the Diagnosis page, where the native resolution
+    is kept for display and Grad-CAM overlays.
+
+    Args:
+        source: File path or file-like object (e.g. Streamlit UploadedFile)
+        size: Optional square output size; None keeps the native resolution
+        window: Optional (center, width) overriding the header window
+
+    Returns:
+        PIL Image (RGB)
+    """
+    dataset = pydicom.dcmread(source, force=True)
+    pixels = dataset.pixel_array
+    if pixels.ndim == 3 and dataset.get('SamplesPerPixel', 1) == 1:
+        pixels = pixels[len(pixels) // 2]  # Middle frame of a multi-frame file
+    return to_model_input(_slice_to_uint8(dataset, pixels, window), size=size)
+
+
+def list_series(directory):
+    """
+    List the DICOM files of a series ordered by slice position.
+
+    Only headers are read. Ordering uses InstanceNumber, then the slice
+    location, then the file name.
+
+    Args:
+        directory: Folder containing the series files
+
+    Returns:
+        list of (path, header) tuples
+    """
+    entries = []
+    for file_name in os.listdir(directory):
+        if not file_name.lower().endswith(DICOM_EXTENSIONS):
+            continue
+        path = os.path.join(directory, file_name)
+        entries.append((path, read_header(path)))
+
+    def sort_key(entry):
+        path, header = entry
+        position = header.get('ImagePositionPatient')
+        location = float(position[2]) if position else float(header.get('SliceLocation', 0.0) or 0.0)
+        return int(header.get('InstanceNumber', 0) or 0), location, os.path.basename(path)
+
+    entries.sort(key=sort_key)
+    return entries
+
+
+def _decode_entries(entries, size, window):
+    """Decode (path, header) entries frame by frame."""
+    for path, header in entries:
+        instance_number = int(header.get('InstanceNumber', 0) or 0)
+        for pixels in _iter_frames(path, header):
+            image = to_model_input(_slice_to_uint8(header, pixels, window), size=size)
+            yield DicomSlice(path=path, instance_number=instance_number, image=image)
+
+
+def iter_series(directory, size=MODEL_INPUT_SIZE, window=None):
+    """
+    Stream a DICOM series as model-ready slices.
+
+    Args:
+        directory: Folder containing the series files
+        size: Output edge length (128 for AlzheimerDetector)
+        window: Optional (center, width) applied to every slice
+
+    Yields:
+        DicomSlice objects in slice order
+    """
+    yield from _decode_entries(list_series(directory), size, window)
+
+
+def series_to_batch(directory, size=MODEL_INPUT_SIZE, window=None):
+    """
+    Decode a whole series into one preallocated uint8 batch.
+
+    The batch is sized from the headers before any pixel data is read, and
+    each slice is written into it as soon as it has been downsampled.
+
+    Args:
+        directory: Folder containing the series files
+        size: Output edge length
+        window: Optional (center, width) applied to every slice
+
+    Returns:
+        tuple: (uint8 array (N, 3, size, size), list of DicomSlice metadata)
+    """
+    entries = list_series(directory)
+    total = sum(int(header.get('NumberOfFrames', 1) or 1) for _, header in entries)
+    batch = np.empty((total, 3, size, size), dtype=np.uint8)
+
+    slices = []
+    for i, item in enumerate(_decode_entries(entries, size, window)):
+        batch[i] = np.asarray(item.image).transpose(2, 0, 1)
+        slices.append(item)
+    return batch, slices
+
+
+def write_synthetic_series(directory, num_slices=8, rows=256, columns=256,
+                           slope=2.0, intercept=-1024.0, window=(40.0, 400.0), seed=0):
+    """
+    Write a small synthetic 16-bit MR series for local testing.
+
+    Each slice holds an elliptical "brain" with a darker ventricle region on a
+    noisy background, stored with a non-trivial rescale slope/intercept.
+
+    Args:
+        directory: Output folder (created if missing)
+        num_slices: Number of slices to write
+        rows, columns: Slice resolution
+        slope, intercept: RescaleSlope / RescaleIntercept stored in the header
+        window: (center, width) stored in the header, or None to omit it
+        seed: Random seed for the background noise
+
+    Returns:
+        list of written file paths in slice order
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    series_uid = generate_uid()
+    study_uid = generate_uid()
+
+    yy, xx = np.mgrid[0:rows, 0:columns].astype(np.float32)
+    cy, cx = rows / 2.0, columns / 2.0
+
+    paths = []
+    for index in range(num_slices):
+        scale = 0.6 + 0.3 * np.sin(np.pi * (index + 1) / (num_slices + 1))
+        brain = ((yy - cy) / (0.45 * rows * scale)) ** 2 + ((xx - cx) / (0.38 * columns * scale)) ** 2 <= 1.0
+        ventricle = ((yy - cy) / (0.12 * rows)) ** 2 + ((xx - cx) / (0.06 * columns)) ** 2 <= 1.0
+
+        hu = np.full((rows, columns), -1000.0, dtype=np.float32)
+        hu[brain] = 35.0
+        hu[brain & ventricle] = 5.0
+        hu += rng.normal(0.0, 5.0, size=hu.shape).astype(np.float32)
+        stored = np.clip(np.round((hu - intercept) / slope), 0, 65535).astype(np.uint16)
+
+        file_meta = FileMetaDataset()
+        file_meta.MediaStorageSOPClassUID = MRImageStorage
+        file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        dataset = pydicom.Dataset()
+        dataset.file_meta = file_meta
+        dataset.SOPClassUID = MRImageStorage
+        dataset.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+        dataset.StudyInstanceUID = study_uid
+        dataset.SeriesInstanceUID = series_uid
+        dataset.Modality = 'MR'
+        dataset.PatientName = 'Synthetic^Series'
+        dataset.InstanceNumber = index + 1
+        dataset.ImagePositionPatient = [0.0, 0.0, float(index) * 5.0]
+        dataset.Rows = rows
+        dataset.Columns = columns
+        dataset.SamplesPerPixel = 1
+        dataset.PhotometricInterpretation = 'MONOCHROME2'
+        dataset.BitsAllocated = 16
+        dataset.BitsStored = 16
+        dataset.HighBit = 15
+        dataset.PixelRepresentation = 0
+        dataset.RescaleSlope = slope
+        dataset.RescaleIntercept = intercept
+        if window is not None:
+            dataset.WindowCenter = window[0]
+            dataset.WindowWidth = window[1]
+        dataset.PixelData = stored.tobytes()
+
+        path = os.path.join(directory, f"slice_{index + 1:04d}.dcm")
+        dataset.save_as(path, enforce_file_format=True)
+        paths.append(path)
+
+    return paths
@@ -0,0 +1,296 @@
+"""
+Evaluation Harness for the Alzheimer's Detection Model
+
+Replaces the per-batch accuracy_fn / .item() loops of the notebooks and the
+ad-hoc confusion matrix cells. The model runs once over the cached pack of
+an ImageFolder (dataset_cache.py) in inference mode and writes its logits into one preallocated array; every
+metric is then computed from that array with vectorized NumPy:
+
+- Accuracy, per-class precision / recall / F1 and the confusion matrix
+- Expected calibration error (ECE) with a reliability diagram
+- Bootstrap confidence intervals for accuracy, macro F1 and ECE, with all
+  resamples evaluated at once through a single bincount
+
+Results are written as JSON plus PNG figures (default: outputs/).
+
+Usage:
+    python evaluate.py --data-dir "Sample Testing Images/test"
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+import dataset_cache
+from model_arch import MODEL_PATH, load_pretrained
+from mri_dataset import TEST_DIR, to_model_tensor
+
+OUTPUT_DIR = "outputs"
+
+
+@torch.inference_mode()
+def compute_logits(model, images, batch_size=256):
+    """
+    Run the model over a uint8 image array.
+
+    Args:
+        model: AlzheimerDetector in eval mode
+        images: uint8 array (N, 128, 128, 3), e.g. a memory-mapped dataset pack
+        batch_size: Images per forward pass
+
+    Returns:
+        float32 array (N, num_classes) of logits
+    """
+    logits = None
+    for start in range(0, len(images), batch_size):
+        output = model(to_model_tensor(images[start:start + batch_size])).numpy()
+        if logits is None:
+            logits = np.empty((len(images), output.shape[1]), dtype=np.float32)
+        logits[start:start + len(output)] = output
+    return logits
+
+
+def softmax(logits):
+    """Row-wise softmax of a logits array."""
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    np.exp(shifted, out=shifted)
+    shifted /= shifted.sum(axis=1, keepdims=True)
+    return shifted
+
+
+def _confusion(labels, predictions, num_classes, groups=None, num_groups=1):
+    """
+    Confusion matrices (rows = true class, columns = predicted class).
+
+    With `groups`, one matrix per group index is built in the same bincount,
+    which is how all bootstrap resamples are evaluated at once.
+    """
+    flat = labels * num_classes + predictions
+    if groups is not None:
+        flat = groups * num_classes * num_classes + flat
+    counts = np.bincount(flat.reshape(-1), minlength=num_groups * num_classes * num_classes)
+    return counts.reshape(num_groups, num_classes, num_classes)
+
+
+def _per_class(confusion):
+    """Precision, recall and F1 per class for (..., C, C) confusion matrices."""
+    true_positive = np.diagonal(confusion, axis1=-2, axis2=-1).astype(np.float64)
+    predicted = confusion.sum(axis=-2)
+    actual = confusion.sum(axis=-1)
+    precision = np.divide(true_positive, predicted, out=np.zeros_like(true_positive), where=predicted > 0)
+    recall = np.divide(true_positive, actual, out=np.zeros_like(true_positive), where=actual > 0)
+    total = precision + recall
+    f1 = np.divide(2 * precision * recall, total, out=np.zeros_like(total), where=total > 0)
+    return precision, recall, f1
+
+
+def _ece(confidence, correct, bins, groups=None, num_groups=1):
+    """
+    Expected calibration error over equal-width confidence bins.
+
+    Returns:
+        (ece per group, per-bin counts, per-bin accuracy, per-bin confidence)
+    """
+    bin_index = np.minimum((confidence * bins).astype(np.int64), bins - 1)
+    if groups is not None:
+        bin_index = groups * bins + bin_index
+    size = num_groups * bins
+    flat_index = bin_index.reshape(-1)
+    counts = np.bincount(flat_index, minlength=size).reshape(num_groups, bins)
+    correct_sum = np.bincount(flat_index, weights=correct.reshape(-1), minlength=size).reshape(num_groups, bins)
+    confidence_sum = np.bincount(flat_index, weights=confidence.reshape(-1), minlength=size).reshape(num_groups, bins)
+
+    safe = np.maximum(counts, 1)
+    gap = np.abs(correct_sum - confidence_sum) / safe
+    ece = (gap * counts).sum(axis=1) / np.maximum(counts.sum(axis=1), 1)
+    return ece, counts, correct_sum / safe, confidence_sum / safe
+
+
+def _interval(values, level):
+    low, high = np.quantile(values, [(1 - level) / 2, (1 + level) / 2])
+    return [float(low), float(high)]
+
+
+def compute_metrics(logits, labels, class_names, bins=15, n_bootstrap=1000, ci_level=0.95, seed=0):
+    """
+    All evaluation metrics from a logits array.
+
+    Args:
+        logits: float array (N, C)
+        labels: int array (N,)
+        class_names: Names of the C classes
+        bins: Number of confidence bins for the ECE
+        n_bootstrap: Bootstrap resamples (0 disables the intervals)
+        ci_level: Confidence level of the bootstrap intervals
+        seed: Random seed of the resampling
+
+    Returns:
+        dict of JSON-serializable metrics
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    num_classes = len(class_names)
+    probabilities = softmax(np.asarray(logits, dtype=np.float64))
+    predictions = probabilities.argmax(axis=1)
+    confidence = probabilities.max(axis=1)
+    correct = (predictions == labels).astype(np.float64)
+
+    confusion = _confusion(labels, predictions, num_classes)[0]
+    precision, recall, f1 = _per_class(confusion)
+    ece, bin_counts, bin_accuracy, bin_confidence = _ece(confidence, correct, bins)
+
+    metrics = {
+        "images": int(len(labels)),
+        "accuracy": float(correct.mean()),
+        "macro_f1": float(f1.mean()),
+        "ece": float(ece[0]),
+        "per_class": {
+            name: {
+                "precision": float(precision[i]),
+                "recall": float(recall[i]),
+                "f1": float(f1[i]),
+                "support": int(confusion[i].sum()),
+            }
+            for i, name in enumerate(class_names)
+        },
+        "confusion_matrix": confusion.tolist(),
+        "calibration": {
+            "bins": bins,
+            "counts": bin_counts[0].astype(int).tolist(),
+            "accuracy": bin_accuracy[0].tolist(),
+            "confidence": bin_confidence[0].tolist(),
+        },
+    }
+
+    if n_bootstrap > 0:
+        rng = np.random.default_rng(seed)
+        samples = rng.integers(0, len(labels), size=(n_bootstrap, len(labels)))
+        groups = np.broadcast_to(np.arange(n_bootstrap)[:, None], samples.shape)
+
+        boot_accuracy = correct[samples].mean(axis=1)
+        boot_confusion = _confusion(labels[samples], predictions[samples], num_classes, groups, n_bootstrap)
+        boot_f1 = _per_class(boot_confusion)[2].mean(axis=1)
+        boot_ece = _ece(confidence[samples], correct[samples], bins, groups, n_bootstrap)[0]
+
+        metrics["bootstrap"] = {
+            "resamples": n_bootstrap,
+            "level": ci_level,
+            "accuracy": _interval(boot_accuracy, ci_level),
+            "macro_f1": _interval(boot_f1, ci_level),
+            "ece": _interval(boot_ece, ci_level),
+        }
+    return metrics
+
+
+def plot_confusion_matrix(confusion, class_names, path):
+    """Save the confusion matrix as a PNG."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    confusion = np.asarray(confusion)
+    fig, ax = plt.subplots(figsize=(7, 6))
+    ax.imshow(confusion, cmap="Blues")
+    threshold = confusion.max() / 2
+    for (row, column), value in np.ndenumerate(confusion):
+        ax.text(column, row, str(value), ha="center", va="center",
+                color="white" if value > threshold else "black")
+    ax.set_xticks(range(len(class_names)), class_names, rotation=45, ha="right")
+    ax.set_yticks(range(len(class_names)), class_names)
+    ax.set_xlabel("Predicted label")
+    ax.set_ylabel("True label")
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+
+
+def plot_reliability(calibration, ece, path):
+    """Save the reliability diagram (accuracy vs confidence per bin) as a PNG."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    bins = calibration["bins"]
+    centers = (np.arange(bins) + 0.5) / bins
+    counts = np.asarray(calibration["counts"])
+    accuracy = np.where(counts > 0, calibration["accuracy"], 0.0)
+
+    fig, ax = plt.subplots(figsize=(6, 6))
+    ax.bar(centers, accuracy, width=1 / bins, edgecolor="black", label="Accuracy")
+    ax.plot([0, 1], [0, 1], "--", color="gray", label="Perfect calibration")
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1)
+    ax.set_xlabel("Confidence")
+    ax.set_ylabel("Accuracy")
+    ax.set_title(f"Reliability diagram (ECE = {ece:.3f})")
+    ax.legend(loc="upper left")
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+
+
+def evaluate(data_dir=TEST_DIR, model_path=MODEL_PATH, output_dir=OUTPUT_DIR, batch_size=256,
+             bins=15, n_bootstrap=1000, seed=0, model=None, cache_dir=dataset_cache.CACHE_DIR):
+    """
+    Evaluate the model on an ImageFolder and write JSON + PNG reports.
+
+    Returns:
+        dict of metrics (also written to <output_dir>/evaluation.json)
+    """
+    model = model if model is not None else load_pretrained(model_path)
+    start = time.perf_counter()
+    dataset = dataset_cache.load(data_dir, cache_dir)
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    logits = compute_logits(model, dataset.images, batch_size)
+    inference_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    metrics = compute_metrics(logits, dataset.labels, dataset.classes, bins=bins, n_bootstrap=n_bootstrap, seed=seed)
+    metrics["timings"] = {"load_s": load_s, "inference_s": inference_s, "metrics_s": time.perf_counter() - start}
+    metrics["data_dir"] = data_dir
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "evaluation.json"), "w", encoding="utf-8") as f:
+        json.dump(metrics, f, indent=2, ensure_ascii=False)
+    plot_confusion_matrix(metrics["confusion_matrix"], dataset.classes,
+                          os.path.join(output_dir, "eval_confusion_matrix.png"))
+    plot_reliability(metrics["calibration"], metrics["ece"],
+                     os.path.join(output_dir, "eval_reliability.png"))
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the AlzheimerDetector on an image folder")
+    parser.add_argument("--data-dir", default=TEST_DIR)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--bins", type=int, default=15, help="Confidence bins for the ECE")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap resamples (0 to disable)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-dir", default=dataset_cache.CACHE_DIR)
+    args = parser.parse_args()
+
+    metrics = evaluate(args.data_dir, args.model, args.output_dir, batch_size=args.batch_size,
+                       bins=args.bins, n_bootstrap=args.bootstrap, seed=args.seed, cache_dir=args.cache_dir)
+
+    print(f"Images: {metrics['images']}  Accuracy: {metrics['accuracy']:.4f}  "
+          f"Macro F1: {metrics['macro_f1']:.4f}  ECE: {metrics['ece']:.4f}")
+    if "bootstrap" in metrics:
+        ci = metrics["bootstrap"]
+        print(f"{ci['level']:.0%} CI  accuracy {ci['accuracy']}  macro F1 {ci['macro_f1']}  ECE {ci['ece']}")
+    for name, scores in metrics["per_class"].items():
+        print(f"  {name:<22} P={scores['precision']:.3f} R={scores['recall']:.3f} "
+              f"F1={scores['f1']:.3f} n={scores['support']}")
+    timings = metrics["timings"]
+    print(f"Load {timings['load_s']:.2f}s, inference {timings['inference_s']:.2f}s, "
+          f"metrics {timings['metrics_s']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
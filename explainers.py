@@ -0,0 +1,349 @@
+"""
+Pluggable CAM Explainers for the Alzheimer's Detection Model
+
+Implements three class activation map methods behind one interface:
+
+- Grad-CAM: one forward + one backward pass (cheapest)
+- Grad-CAM++: same cost as Grad-CAM, higher-order gradient weights that
+  localize multiple regions better
+- Score-CAM: gradient-free; every activation channel is upsampled into a
+  mask and all masked inputs are scored in a single batched forward pass
+
+Every explanation reports its wall-clock time and the number of forward /
+backward passes, so the quality/latency tradeoff can be chosen per request.
+
+References:
+Selvaraju et al. "Grad-CAM" (2017)
+Chattopadhay et al. "Grad-CAM++" (2018)
+Wang et al. "Score-CAM" (2020)
+"""
+
+import argparse
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# Last Conv2d of conv_block_2 (index -2 would be the ReLU)
+DEFAULT_TARGET_LAYER = "conv_block_2.2"
+
+
+@dataclass
+class Explanation:
+    """Heatmap plus the prediction and cost of the method that produced it."""
+    method: str
+    heatmap: np.ndarray          # (h, w) float32, values 0-1
+    class_index: int
+    probabilities: np.ndarray    # Softmax over classes for the unmasked input
+    elapsed_ms: float
+    forward_passes: int
+    backward_passes: int
+
+
+def resolve_layer(model, target_layer=None):
+    """
+    Resolve a target layer given as a module or a dotted name (e.g. "conv_block_2.2").
+    """
+    if target_layer is None:
+        target_layer = DEFAULT_TARGET_LAYER
+    if isinstance(target_layer, torch.nn.Module):
+        return target_layer
+    return model.get_submodule(target_layer)
+
+
+def layer_name(model, target_layer=None):
+    """Dotted name of a target layer given as a module or a name (default: DEFAULT_TARGET_LAYER)."""
+    if target_layer is None:
+        return DEFAULT_TARGET_LAYER
+    if isinstance(target_layer, torch.nn.Module):
+        for name, module in model.named_modules():
+            if module is target_layer:
+                return name
+        raise ValueError("Target layer is not part of the model")
+    return target_layer
+
+
+def split_model(model, target_layer=None):
+    """
+    Split the model at a layer into head (input -> layer output) and tail
+    (layer output -> logits).
+
+    Running head then tail replaces forward hooks, which would be shared by
+    every thread using the cached model. Assumes the model's forward is the
+    sequential composition of its top-level children, as in AlzheimerDetector.
+
+    Returns:
+        (head, tail) as torch.nn.Sequential sharing the model's modules
+    """
+    block_name, _, index = layer_name(model, target_layer).partition(".")
+    children = list(model.named_children())
+    position = [name for name, _ in children].index(block_name)
+    before = [module for _, module in children[:position]]
+    block = children[position][1]
+    after = [module for _, module in children[position + 1:]]
+    if not index:
+        return torch.nn.Sequential(*before, block), torch.nn.Sequential(*after)
+    return (torch.nn.Sequential(*before, *block[:int(index) + 1]),
+            torch.nn.Sequential(*block[int(index) + 1:], *after))
+
+
+def _normalize(cam):
+    """Min-max normalize a (h, w) tensor to 0-1 and return it as numpy."""
+    cam = cam.detach().cpu().numpy().astype(np.float32)
+    cam -= cam.min()
+    cam /= cam.max() + 1e-8
+    return cam
+
+
+class CAMExplainer:
+    """
+    Base class for CAM methods.
+
+    Subclasses implement `_compute(input_tensor, target_class)` returning
+    (cam tensor (h, w), class index, probabilities, forward passes, backward passes).
+    The target layer activations come from running the model split at that
+    layer (split_model) rather than from hooks, so concurrent calls on the
+    cached model cannot read each other's activations.
+    """
+
+    name = None
+    label = None
+
+    def __init__(self, model, target_layer=None):
+        self.model = model
+        self.target_layer = resolve_layer(model, target_layer)
+        self.head, self.tail = split_model(model, self.target_layer)
+
+    def _forward(self, input_tensor):
+        """Forward pass returning the logits and the target layer activations."""
+        activations = self.head(input_tensor)
+        return self.tail(activations), activations
+
+    def explain(self, input_tensor, target_class=None):
+        """
+        Generate a heatmap for a single preprocessed image.
+
+        Args:
+            input_tensor: Input tensor (1, C, H, W)
+            target_class: Target class index (if None, uses predicted class)
+
+        Returns:
+            Explanation
+        """
+        self.model.eval()
+        start = time.perf_counter()
+        cam, class_index, probabilities, forwards, backwards = self._compute(input_tensor, target_class)
+        heatmap = _normalize(cam)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        return Explanation(
+            method=self.name,
+            heatmap=heatmap,
+            class_index=class_index,
+            probabilities=probabilities,
+            elapsed_ms=elapsed_ms,
+            forward_passes=forwards,
+            backward_passes=backwards,
+        )
+
+    def _compute(self, input_tensor, target_class):
+        raise NotImplementedError
+
+
+class _GradientExplainer(CAMExplainer):
+    """Shared forward/backward logic of the gradient-based methods."""
+
+    def _gradients(self, input_tensor, target_class):
+        if input_tensor.is_inference():
+            # Inference tensors cannot be saved for backward
+            input_tensor = input_tensor.clone()
+        with torch.enable_grad():
+            output, activations = self._forward(input_tensor)
+            if target_class is None:
+                target_class = output.argmax(dim=1).item()
+            # Gradients w.r.t. the activations only; parameter .grad stays untouched
+            gradients, = torch.autograd.grad(output[0, target_class], activations)
+
+        probabilities = F.softmax(output[0].detach(), dim=0).cpu().numpy()
+        return activations.detach(), gradients, target_class, probabilities
+
+    def _weights(self, activations, gradients):
+        raise NotImplementedError
+
+    def _cam(self, activations, gradients):
+        return F.relu((self._weights(activations, gradients) * activations).sum(dim=1))[0]
+
+    def _compute(self, input_tensor, target_class):
+        activations, gradients, target_class, probabilities = self._gradients(input_tensor, target_class)
+        return self._cam(activations, gradients), target_class, probabilities, 1, 1
+
+    def explain_activations(self, activations, tail, target_class=None):
+        """
+        Generate a heatmap from stored target layer activations.
+
+        Only `tail` (the layers between the target layer and the logits) is
+        run forward and backward, so an image that was already classified
+        does not go through the convolutional stack again.
+
+        Args:
+            activations: Target layer output (1, C, h, w) from an earlier forward pass
+            tail: Module mapping the activations to the logits
+            target_class: Target class index (if None, uses predicted class)
+
+        Returns:
+            Explanation (forward_passes counts full passes, so it is 0)
+        """
+        self.model.eval()
+        start = time.perf_counter()
+        with torch.inference_mode(False), torch.enable_grad():
+            # A clone made outside inference mode is a normal tensor that can require grad
+            activations = activations.clone().requires_grad_()
+            output = tail(activations)
+            if target_class is None:
+                target_class = output.argmax(dim=1).item()
+            gradients, = torch.autograd.grad(output[0, target_class], activations)
+
+        heatmap = _normalize(self._cam(activations.detach(), gradients))
+        return Explanation(
+            method=self.name,
+            heatmap=heatmap,
+            class_index=target_class,
+            probabilities=F.softmax(output[0].detach(), dim=0).cpu().numpy(),
+            elapsed_ms=(time.perf_counter() - start) * 1000,
+            forward_passes=0,
+            backward_passes=1,
+        )
+
+
+class GradCAMExplainer(_GradientExplainer):
+    """Grad-CAM: channel weights are the spatially averaged gradients."""
+
+    name = "gradcam"
+    label = "Grad-CAM"
+
+    def _weights(self, activations, gradients):
+        return gradients.mean(dim=(2, 3), keepdim=True)
+
+
+class GradCAMPlusPlusExplainer(_GradientExplainer):
+    """Grad-CAM++: per-pixel weights from second and third order gradient terms."""
+
+    name = "gradcam++"
+    label = "Grad-CAM++"
+
+    def _weights(self, activations, gradients):
+        grads_2 = gradients.pow(2)
+        grads_3 = grads_2 * gradients
+        sum_activations = activations.sum(dim=(2, 3), keepdim=True)
+        denominator = 2 * grads_2 + sum_activations * grads_3
+        alpha = grads_2 / torch.where(denominator != 0, denominator, torch.ones_like(denominator))
+        return (alpha * F.relu(gradients)).sum(dim=(2, 3), keepdim=True)
+
+
+class ScoreCAMExplainer(CAMExplainer):
+    """
+    Score-CAM: channel weights are the class scores of the input masked by
+    each upsampled activation map. All masks are scored in one batched
+    forward pass (or in chunks of `batch_size` to bound memory).
+    """
+
+    name = "scorecam"
+    label = "Score-CAM"
+
+    def __init__(self, model, target_layer=None, batch_size=None):
+        super().__init__(model, target_layer)
+        self.batch_size = batch_size
+
+    @torch.inference_mode()
+    def _compute(self, input_tensor, target_class):
+        output, activations = self._forward(input_tensor)
+        if target_class is None:
+            target_class = output.argmax(dim=1).item()
+        probabilities = F.softmax(output[0], dim=0).cpu().numpy()
+
+        # (C, 1, H, W) masks normalized to 0-1 per channel
+        masks = F.interpolate(activations.transpose(0, 1), size=input_tensor.shape[-2:],
+                              mode='bilinear', align_corners=False)
+        flat = masks.flatten(start_dim=1)
+        low = flat.min(dim=1).values.view(-1, 1, 1, 1)
+        high = flat.max(dim=1).values.view(-1, 1, 1, 1)
+        masks = (masks - low) / (high - low).clamp_min(1e-8)
+
+        # Broadcasting builds all masked inputs at once: (C, 3, H, W)
+        masked_inputs = input_tensor * masks
+        batch_size = self.batch_size or len(masked_inputs)
+        scores = torch.cat([
+            F.softmax(self.model(masked_inputs[i:i + batch_size]), dim=1)[:, target_class]
+            for i in range(0, len(masked_inputs), batch_size)
+        ])
+
+        cam = F.relu((scores.view(1, -1, 1, 1) * activations).sum(dim=1))[0]
+        forwards = 1 + -(-len(masked_inputs) // batch_size)
+        return cam, target_class, probabilities, forwards, 0
+
+
+EXPLAINERS = {
+    GradCAMExplainer.name: GradCAMExplainer,
+    GradCAMPlusPlusExplainer.name: GradCAMPlusPlusExplainer,
+    ScoreCAMExplainer.name: ScoreCAMExplainer,
+}
+
+
+def get_explainer(method, model, target_layer=None, **kwargs):
+    """
+    Build an explainer by name.
+
+    Args:
+        method: One of EXPLAINERS ("gradcam", "gradcam++", "scorecam")
+        model: The neural network model
+        target_layer: Module or dotted layer name (default: last conv of conv_block_2)
+        **kwargs: Method-specific options (e.g. batch_size for Score-CAM)
+
+    Returns:
+        CAMExplainer
+    """
+    try:
+        explainer_cls = EXPLAINERS[method]
+    except KeyError:
+        raise ValueError(f"Unknown explainer '{method}'. Available: {', '.join(EXPLAINERS)}") from None
+    return explainer_cls(model, target_layer=target_layer, **kwargs)
+
+
+def benchmark(model, input_tensor, methods=None, target_layer=None, repeats=5):
+    """
+    Measure the median latency of each method on one input.
+
+    Returns:
+        dict: method name -> Explanation of the median run
+    """
+    results = {}
+    for method in methods or EXPLAINERS:
+        explainer = get_explainer(method, model, target_layer=target_layer)
+        explainer.explain(input_tensor)  # Warm-up
+        runs = sorted((explainer.explain(input_tensor) for _ in range(repeats)), key=lambda e: e.elapsed_ms)
+        results[method] = runs[len(runs) // 2]
+    return results
+
+
+def main():
+    from model_arch import load_pretrained
+    from mri_dataset import load_image_array, to_model_tensor
+
+    parser = argparse.ArgumentParser(description="Compare CAM explainer latency on one image")
+    parser.add_argument("image")
+    parser.add_argument("--layer", default=DEFAULT_TARGET_LAYER)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    model = load_pretrained()
+    input_tensor = to_model_tensor(load_image_array(args.image)[None])
+    for method, explanation in benchmark(model, input_tensor, target_layer=args.layer, repeats=args.repeats).items():
+        print(f"{method:<10} {explanation.elapsed_ms:8.2f} ms  "
+              f"forward={explanation.forward_passes} backward={explanation.backward_passes}  "
+              f"class={explanation.class_index}")
+
+
+if __name__ == "__main__":
+    main()
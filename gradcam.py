@@ -10,12 +10,13 @@ Selvaraju et al. "Grad-CAM: Visual Explanations from Deep Networks
 via Gradient-based Localization" (2017)
 """
 
-import torch
 import torch.nn.functional as F
-import numpy as np
 from PIL import Image
 import cv2
 
+import heatmap_render
+from explainers import get_explainer
+
 
 class GradCAM:
     """
@@ -37,7 +38,7 @@ class GradCAM:
 
         # Register hooks
         self.target_layer.register_forward_hook(self.save_activation)
-        self.target_layer.register_backward_hook(self.save_gradient)
+        self.target_layer.register_full_backward_hook(self.save_gradient)
 
     def save_activation(self, module, input, output):
         """Hook to save forward pass activations"""
@@ -100,50 +101,12 @@ class GradCAM:
         Returns:
             PIL Image with heatmap overlay
         """
-        # Convert original image to numpy
-        if isinstance(original_image, Image.Image):
-            original_image = np.array(original_image)
-
-        # Resize heatmap to match original image
-        h, w = original_image.shape[:2]
-        heatmap_resized = cv2.resize(heatmap, (w, h))
-
-        # Apply colormap
-        heatmap_colored = cv2.applyColorMap(
-            np.uint8(255 * heatmap_resized),
-            colormap
-        )
-        heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
-
-        # Convert grayscale to RGB if needed
-        if len(original_image.shape) == 2:
-            original_image = cv2.cvtColor(original_image, cv2.COLOR_GRAY2RGB)
-        elif original_image.shape[2] == 4:  # RGBA
-            original_image = cv2.cvtColor(original_image, cv2.COLOR_RGBA2RGB)
-        elif original_image.shape[2] == 1:
-            original_image = np.repeat(original_image, 3, axis=2)
-
-        # Ensure both images are the same dtype
-        original_image = original_image.astype(np.uint8)
-        heatmap_colored = heatmap_colored.astype(np.uint8)
-
-        # Ensure both images have the same shape
-        if original_image.shape != heatmap_colored.shape:
-            heatmap_colored = cv2.resize(heatmap_colored, (original_image.shape[1], original_image.shape[0]))
-
-        # Overlay
-        overlayed = cv2.addWeighted(
-            original_image,
-            1 - alpha,
-            heatmap_colored,
-            alpha,
-            0
-        )
-
-        return Image.fromarray(overlayed)
-
-
-def generate_gradcam_visualization(model, input_tensor, original_image, class_names):
+        # Colorize through the precomputed LUT and blend at the original resolution
+        return heatmap_render.render(heatmap, original_image, alpha=alpha, colormap=colormap)['overlayed']
+
+
+def generate_gradcam_visualization(model, input_tensor, original_image, class_names, max_side=None,
+                                   method="gradcam", target_layer=None):
     """
     High-level function to generate complete Grad-CAM visualization.
 
@@ -152,52 +115,40 @@ def generate_gradcam_visualization(model, input_tensor, original_image, class_na
         input_tensor: Preprocessed input tensor (1, 3, 128, 128)
         original_image: Original PIL Image
         class_names: List of class names
+        max_side: Render images at display resolution (longest edge); None keeps the original size
+        method: Explainer name ("gradcam", "gradcam++" or "scorecam")
+        target_layer: Module or dotted layer name (default: last Conv2d of conv_block_2)
 
     Returns:
         dict with:
+            - original: PIL Image of the original at the rendered size
             - heatmap_only: PIL Image of just the heatmap
             - overlayed: PIL Image with heatmap overlayed on original
             - predicted_class: Predicted class name
             - confidence: Prediction confidence (0-1)
             - heatmap_array: Raw numpy heatmap array
+            - method: Explainer used
+            - elapsed_ms: Explainer runtime in milliseconds
     """
-    # Get the last convolutional layer (conv_block_2)
-    # Model structure: Conv2d, ReLU, Conv2d, ReLU, MaxPool2d
-    # Index 2 is the last Conv2d layer (index -2 would be ReLU which doesn't work)
-    target_layer = model.conv_block_2[2]  # Last Conv2d layer
-
-    # Create Grad-CAM object
-    gradcam = GradCAM(model, target_layer)
-
-    # Generate heatmap
-    heatmap, predicted_class_idx = gradcam.generate_heatmap(input_tensor)
-
-    # Get prediction confidence
-    with torch.no_grad():
-        output = model(input_tensor)
-        probabilities = F.softmax(output[0], dim=0)
-        confidence = probabilities[predicted_class_idx].item()
-
-    # Create visualizations
-    # 1. Heatmap only (colorized)
-    heatmap_colored = cv2.applyColorMap(
-        np.uint8(255 * heatmap),
-        cv2.COLORMAP_JET
-    )
-    heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
-    heatmap_image = Image.fromarray(heatmap_colored)
-    heatmap_image = heatmap_image.resize(original_image.size, Image.BILINEAR)
+    # Generate heatmap; the explainer's forward pass also provides the confidence
+    explanation = get_explainer(method, model, target_layer=target_layer).explain(input_tensor)
+    heatmap = explanation.heatmap
+    predicted_class_idx = explanation.class_index
+    confidence = float(explanation.probabilities[predicted_class_idx])
 
-    # 2. Overlay on original
-    overlayed_image = gradcam.overlay_heatmap(heatmap, original_image, alpha=0.5)
+    # Create visualizations (heatmap only + overlay) with a single resize to the target size
+    rendered = heatmap_render.render(heatmap, original_image, alpha=0.5, max_side=max_side)
 
     return {
-        'heatmap_only': heatmap_image,
-        'overlayed': overlayed_image,
+        'original': rendered['original'],
+        'heatmap_only': rendered['heatmap_only'],
+        'overlayed': rendered['overlayed'],
         'predicted_class': class_names[predicted_class_idx],
         'confidence': confidence,
         'heatmap_array': heatmap,
-        'class_index': predicted_class_idx
+        'class_index': predicted_class_idx,
+        'method': explanation.method,
+        'elapsed_ms': explanation.elapsed_ms
     }
 
 
@@ -218,9 +169,12 @@ def create_comparison_image(original, heatmap, overlayed):
     aspect_ratio = original.width / original.height
     target_width = int(target_height * aspect_ratio)
 
-    original_resized = original.resize((target_width, target_height), Image.BILINEAR)
-    heatmap_resized = heatmap.resize((target_width, target_height), Image.BILINEAR)
-    overlayed_resized = overlayed.resize((target_width, target_height), Image.BILINEAR)
+    # Images rendered by heatmap_render at this size are pasted without resizing again
+    target_size = (target_width, target_height)
+    original_resized, heatmap_resized, overlayed_resized = (
+        image if image.size == target_size else image.resize(target_size, Image.BILINEAR)
+        for image in (original, heatmap, overlayed)
+    )
 
     # Create combined image
     total_width = target_width * 3 + 40  # 20px padding between images
@@ -0,0 +1,229 @@
+"""
+Compact Heatmap Artifacts
+
+A diagnosis produces a float CAM plus three full-resolution renders
+(original, heatmap only, overlay). Only the CAM is worth keeping: the
+renders are a deterministic function of the CAM and the source image. An
+artifact stores
+
+- the raw CAM at the target layer resolution (64x64 for conv_block_2.2)
+  quantized to uint8 (max error 1/510), zlib-compressed when that helps
+- the content hash of the source image (heatmap_render.image_digest), so
+  an overlay is never drawn on the wrong scan
+- the class index and the explainer method
+
+which is a few kilobytes per diagnosis. Colored maps and overlays are
+regenerated on demand at any display size through heatmap_render; the
+read API never builds a full-resolution image unless asked for one.
+
+File layout (little endian):
+    magic "RCAM" | version u8 | flags u8 | height u16 | width u16 |
+    class index i16 | method 16 bytes | source hash 16 bytes | payload
+
+Usage:
+    python heatmap_artifact.py image.jpg    # Artifact size vs. persisting the renders
+"""
+
+import argparse
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+import heatmap_render
+
+ARTIFACT_DIR = os.path.join("data", "heatmaps")
+SUFFIX = ".rcam"
+
+MAGIC = b"RCAM"
+VERSION = 1
+_HEADER = struct.Struct("<4sBBHHh16s16s")
+_FLAG_ZLIB = 1
+
+
+@dataclass(frozen=True)
+class HeatmapArtifact:
+    """Quantized CAM plus the identity of the image it was computed for."""
+    quantized: np.ndarray      # uint8 (h, w)
+    source_hash: str           # heatmap_render.image_digest of the source image (32 hex chars)
+    class_index: int
+    method: str
+
+    @classmethod
+    def from_heatmap(cls, heatmap, source_image=None, source_hash=None, class_index=-1, method="gradcam"):
+        """
+        Quantize a 0-1 heatmap.
+
+        Args:
+            heatmap: float array (h, w) with values 0-1 (e.g. Explanation.heatmap)
+            source_image: PIL Image or array the heatmap belongs to (hashed here)
+            source_hash: Precomputed image_digest, instead of source_image
+            class_index: Explained class
+            method: Explainer name
+        """
+        if source_hash is None:
+            if source_image is None:
+                raise ValueError("source_image or source_hash is required")
+            source_hash = heatmap_render.image_digest(source_image)
+        quantized = np.rint(np.clip(np.asarray(heatmap, dtype=np.float32), 0.0, 1.0) * 255).astype(np.uint8)
+        return cls(quantized, source_hash, int(class_index), method)
+
+    @property
+    def shape(self):
+        return self.quantized.shape
+
+    def heatmap(self, size=None):
+        """
+        Dequantized heatmap, optionally resized.
+
+        Args:
+            size: Output (width, height), or None for the stored resolution
+
+        Returns:
+            float32 array with values 0-1
+        """
+        heatmap = self.quantized.astype(np.float32) * (1.0 / 255)
+        if size is not None and tuple(size) != heatmap.shape[::-1]:
+            heatmap = cv2.resize(heatmap, tuple(size), interpolation=cv2.INTER_LINEAR)
+        return heatmap
+
+    def colorized(self, size=None, colormap=cv2.COLORMAP_JET):
+        """Heatmap-only RGB array at `size` (width, height); needs no source image."""
+        return heatmap_render.colorize(self.heatmap(), size or self.shape[::-1], colormap)
+
+    def matches(self, image):
+        """Whether `image` is the image this heatmap was computed for."""
+        return heatmap_render.image_digest(image) == self.source_hash
+
+    def render(self, original_image, max_side=None, size=None, alpha=heatmap_render.DEFAULT_ALPHA,
+               verify=True):
+        """
+        Original, heatmap-only and overlay views at display size.
+
+        Args:
+            original_image: The source image (PIL Image or array)
+            max_side: Longest edge of the output (None = the source resolution)
+            size: Explicit output (width, height); overrides max_side
+            alpha: Heatmap weight in the overlay
+            verify: Check the image against the stored source hash
+
+        Returns:
+            dict with PIL Images 'original', 'heatmap_only' and 'overlayed' (cached, read-only)
+        """
+        if verify and not self.matches(original_image):
+            raise ValueError("Image does not match the heatmap's source hash")
+        return heatmap_render.render(self.heatmap(), original_image, alpha=alpha, size=size, max_side=max_side)
+
+    def to_bytes(self, compress=True):
+        payload = np.ascontiguousarray(self.quantized).tobytes()
+        flags = 0
+        if compress:
+            compressed = zlib.compress(payload, 9)
+            if len(compressed) < len(payload):
+                payload, flags = compressed, _FLAG_ZLIB
+        height, width = self.shape
+        header = _HEADER.pack(MAGIC, VERSION, flags, height, width, self.class_index,
+                              self.method.encode("ascii")[:16], bytes.fromhex(self.source_hash))
+        return header + payload
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, flags, height, width, class_index, method, source_hash = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a heatmap artifact (magic {magic!r}, version {version})")
+        payload = data[_HEADER.size:]
+        if flags & _FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        quantized = np.frombuffer(payload, dtype=np.uint8).reshape(height, width)
+        return cls(quantized, source_hash.hex(), class_index, method.rstrip(b"\0").decode("ascii"))
+
+
+def artifact_path(source_hash, method="gradcam", class_index=-1, root=ARTIFACT_DIR):
+    """Content-addressed location: <root>/<hash[:2]>/<hash>-<method>-<class>.rcam"""
+    safe_method = method.replace("+", "p")
+    return os.path.join(root, source_hash[:2], f"{source_hash}-{safe_method}-{class_index}{SUFFIX}")
+
+
+def save(artifact, root=ARTIFACT_DIR):
+    """
+    Write an artifact (atomically; an identical artifact is not rewritten).
+
+    Returns:
+        Path of the artifact file, suitable as a heatmap reference in the patient store
+    """
+    path = artifact_path(artifact.source_hash, artifact.method, artifact.class_index, root)
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.partial"
+    with open(partial, "wb") as f:
+        f.write(artifact.to_bytes())
+    os.replace(partial, path)
+    return path
+
+
+def load(path):
+    with open(path, "rb") as f:
+        return HeatmapArtifact.from_bytes(f.read())
+
+
+def read_header(path):
+    """
+    Metadata of an artifact without decoding the heatmap.
+
+    Returns:
+        dict with shape, class_index, method, source_hash and size_bytes
+    """
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size)
+    magic, version, flags, height, width, class_index, method, source_hash = _HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a heatmap artifact")
+    return {
+        "shape": (height, width),
+        "class_index": class_index,
+        "method": method.rstrip(b"\0").decode("ascii"),
+        "source_hash": source_hash.hex(),
+        "size_bytes": os.path.getsize(path),
+    }
+
+
+def main():
+    import io
+
+    from PIL import Image
+
+    from explainers import get_explainer
+    from model_arch import load_pretrained
+    from mri_dataset import preprocess_image
+
+    parser = argparse.ArgumentParser(description="Compare artifact size with persisting the rendered images")
+    parser.add_argument("image")
+    parser.add_argument("--method", default="gradcam")
+    args = parser.parse_args()
+
+    image = Image.open(args.image).convert("RGB")
+    explanation = get_explainer(args.method, load_pretrained()).explain(preprocess_image(image))
+    artifact = HeatmapArtifact.from_heatmap(explanation.heatmap, image, class_index=explanation.class_index,
+                                            method=explanation.method)
+    data = artifact.to_bytes()
+
+    renders = heatmap_render.render(explanation.heatmap, image)
+    png_bytes = 0
+    for view in renders.values():
+        buffer = io.BytesIO()
+        view.save(buffer, format="PNG")
+        png_bytes += len(buffer.getvalue())
+
+    restored = HeatmapArtifact.from_bytes(data)
+    error = float(np.abs(restored.heatmap() - explanation.heatmap).max())
+    print(f"CAM {explanation.heatmap.shape} float32: {explanation.heatmap.nbytes} B | "
+          f"artifact: {len(data)} B | three PNG renders at {image.size}: {png_bytes} B")
+    print(f"Max quantization error: {error:.4f}")
+
+
+if __name__ == "__main__":
+    main()
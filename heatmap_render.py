@@ -0,0 +1,192 @@
+"""
+Heatmap Rendering for Grad-CAM Visualizations
+
+Colorizes and blends Grad-CAM heatmaps with a precomputed RGB lookup table
+instead of calling cv2.applyColorMap + cvtColor for every image. Each render
+resizes the heatmap and the original exactly once to the target size,
+blends in place in uint8, and can stop at display resolution.
+
+Rendered images are cached per (heatmap hash, image hash, alpha, size),
+so Streamlit reruns reuse the previous result.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from PIL import Image
+
+DEFAULT_ALPHA = 0.5
+CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def colormap_lut(colormap=cv2.COLORMAP_JET):
+    """
+    RGB lookup table for an OpenCV colormap.
+
+    Args:
+        colormap: OpenCV colormap id
+
+    Returns:
+        uint8 numpy array (256, 3), read-only
+    """
+    ramp = np.arange(256, dtype=np.uint8).reshape(256, 1)
+    lut = cv2.applyColorMap(ramp, colormap).reshape(256, 3)[:, ::-1].copy()
+    lut.setflags(write=False)
+    return lut
+
+
+def fit_size(image_size, max_side=None):
+    """
+    Display size for an image, never upscaling.
+
+    Args:
+        image_size: (width, height)
+        max_side: Longest edge of the output, or None to keep the original size
+
+    Returns:
+        (width, height)
+    """
+    width, height = image_size
+    if max_side is None or max(width, height) <= max_side:
+        return width, height
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def to_rgb_array(image):
+    """
+    Convert a PIL image or numpy array to a contiguous uint8 RGB array.
+    """
+    if isinstance(image, Image.Image):
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.asarray(image)
+
+    array = np.asarray(image)
+    if array.dtype != np.uint8:
+        array = array.astype(np.uint8)
+    if array.ndim == 2:
+        return cv2.cvtColor(array, cv2.COLOR_GRAY2RGB)
+    if array.shape[2] == 4:
+        return cv2.cvtColor(array, cv2.COLOR_RGBA2RGB)
+    if array.shape[2] == 1:
+        return np.repeat(array, 3, axis=2)
+    return array
+
+
+def colorize(heatmap, size, colormap=cv2.COLORMAP_JET):
+    """
+    Resize a 0-1 heatmap once and map it through the colormap LUT.
+
+    Args:
+        heatmap: float numpy array (h, w) with values 0-1
+        size: Output (width, height)
+        colormap: OpenCV colormap id
+
+    Returns:
+        uint8 numpy array (height, width, 3)
+    """
+    heatmap = np.asarray(heatmap, dtype=np.float32)
+    if heatmap.shape[::-1] != tuple(size):
+        heatmap = cv2.resize(heatmap, size, interpolation=cv2.INTER_LINEAR)
+    indices = np.clip(heatmap * 255.0, 0, 255).astype(np.uint8)
+    return colormap_lut(colormap)[indices]
+
+
+def blend(base, overlay, alpha, out=None):
+    """
+    Alpha-blend two uint8 RGB arrays of the same shape.
+
+    Args:
+        base: Original image array
+        overlay: Colorized heatmap array
+        alpha: Heatmap weight (0-1)
+        out: Destination array; pass `overlay` to blend in place
+
+    Returns:
+        uint8 numpy array
+    """
+    return cv2.addWeighted(base, 1.0 - alpha, overlay, alpha, 0.0, dst=out)
+
+
+def _digest(array):
+    array = np.ascontiguousarray(array)
+    digest = hashlib.blake2b(array.view(np.uint8).reshape(-1), digest_size=16)
+    digest.update(str((array.shape, array.dtype.str)).encode())
+    return digest.hexdigest()
+
+
+def image_digest(image):
+    """Content hash of a PIL image or array (pixels, mode and size)."""
+    if isinstance(image, Image.Image):
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+        digest.update(f"{image.mode}{image.size}".encode())
+        return digest.hexdigest()
+    return _digest(np.asarray(image))
+
+
+def render(heatmap, original_image, alpha=DEFAULT_ALPHA, size=None, max_side=None,
+           colormap=cv2.COLORMAP_JET):
+    """
+    Render the original, heatmap-only and overlay views at one target size.
+
+    Args:
+        heatmap: Grad-CAM heatmap (h, w) with values 0-1
+        original_image: PIL Image or numpy array
+        alpha: Heatmap weight in the overlay
+        size: Explicit output (width, height); overrides max_side
+        max_side: Longest edge for display-resolution output (None = original size)
+        colormap: OpenCV colormap id
+
+    Returns:
+        dict with PIL Images 'original', 'heatmap_only' and 'overlayed'.
+        Results are shared through the cache and must be treated as read-only.
+    """
+    if isinstance(original_image, Image.Image):
+        source_size = original_image.size
+    else:
+        source_size = (original_image.shape[1], original_image.shape[0])
+    target = tuple(size) if size is not None else fit_size(source_size, max_side)
+
+    key = (_digest(heatmap), image_digest(original_image), round(float(alpha), 4), target, colormap)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+
+    if isinstance(original_image, Image.Image) and original_image.size != target:
+        original_image = original_image.resize(target, Image.BILINEAR)
+    base = to_rgb_array(original_image)
+    if base.shape[1::-1] != target:
+        base = cv2.resize(base, target, interpolation=cv2.INTER_LINEAR)
+
+    colored = colorize(heatmap, target, colormap)
+    # PIL copies 3-channel arrays, so the colorized buffer can be reused for the blend
+    heatmap_only = Image.fromarray(colored)
+    blend(base, colored, alpha, out=colored)
+
+    result = {
+        'original': Image.fromarray(base),
+        'heatmap_only': heatmap_only,
+        'overlayed': Image.fromarray(colored),
+    }
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def clear_cache():
+    """Drop all cached renders."""
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,194 @@
+"""
+Hedged Requests for Latency-Critical External Calls
+
+Pixtral validation sits on the critical path of every upload, and its
+tail latency comes from a few slow responses rather than from a slow
+service. A hedged call sends the request, and if no answer arrived within
+a delay derived from recent latencies (p95 by default) sends one
+duplicate and returns whichever succeeds first:
+
+- The delay adapts from a sliding window of observed call durations,
+  clamped to [min_delay, max_delay]; until min_samples calls were seen,
+  initial_delay is used
+- Extra load is capped: every call earns max_extra of a hedge credit
+  (10% -> at most one duplicate per ten calls, with a small burst), and a
+  hedge is only fired with a full credit
+- The losing request is not cancelled (HTTP requests in flight cannot
+  be), its result is discarded
+- hedges fired / won are counted in tracing.metrics
+  (remind_hedges_total{policy, outcome}) and on the policy itself
+
+Usage:
+    python hedging.py bench --calls 200 --slow-rate 0.05
+"""
+
+import argparse
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+
+import numpy as np
+
+import tracing
+
+
+class HedgePolicy:
+    """Hedge delay from a latency window plus a credit budget for duplicate requests."""
+
+    def __init__(self, name, quantile=0.95, initial_delay=2.0, min_delay=0.05, max_delay=10.0,
+                 max_extra=0.1, burst=3.0, window=200, min_samples=20):
+        self.name = name
+        self.quantile = quantile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_extra = max_extra
+        self.burst = burst
+        self.min_samples = min_samples
+        self.calls = 0
+        self.fired = 0
+        self.won = 0
+        self._latencies = deque(maxlen=window)
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Seconds to wait for the first response before hedging."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.initial_delay
+            delay = float(np.quantile(self._latencies, self.quantile))
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def start_call(self):
+        with self._lock:
+            self.calls += 1
+            self._credit = min(self.burst, self._credit + self.max_extra)
+
+    def take_hedge(self):
+        """Spend a credit for a duplicate request; False when the extra-load budget is used up."""
+        with self._lock:
+            if self._credit < 1.0:
+                return False
+            self._credit -= 1.0
+            self.fired += 1
+        tracing.metrics.increment("remind_hedges_total", {"policy": self.name, "outcome": "fired"})
+        return True
+
+    def record_win(self):
+        with self._lock:
+            self.won += 1
+        tracing.metrics.increment("remind_hedges_total", {"policy": self.name, "outcome": "won"})
+
+    def reset(self):
+        with self._lock:
+            self.calls = self.fired = self.won = 0
+            self._latencies.clear()
+            self._credit = 0.0
+
+    def snapshot(self):
+        return {"calls": self.calls, "fired": self.fired, "won": self.won, "delay_ms": round(self.delay() * 1000, 1)}
+
+
+@lru_cache(maxsize=1)
+def _executor():
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix="remind-hedge")
+
+
+@lru_cache(maxsize=None)
+def get_policy(name):
+    """Process-wide policy per call site (e.g. 'pixtral_validation')."""
+    return HedgePolicy(name)
+
+
+def hedged(fn, policy):
+    """
+    Call fn() with at most one hedge.
+
+    Args:
+        fn: Zero-argument callable doing one request (run on a worker thread,
+            in a copy of the caller's context so tracing spans keep the request ID)
+        policy: HedgePolicy deciding the delay and the budget
+
+    Returns:
+        The first successful result; if both attempts fail, the first error is raised
+    """
+    policy.start_call()
+
+    def timed():
+        start = time.monotonic()
+        try:
+            return fn()
+        finally:
+            policy.observe(time.monotonic() - start)
+
+    primary = _executor().submit(contextvars.copy_context().run, timed)
+    done, _ = wait([primary], timeout=policy.delay())
+    if done or not policy.take_hedge():
+        return primary.result()
+
+    hedge = _executor().submit(contextvars.copy_context().run, timed)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            if future is hedge:
+                policy.record_win()
+            return future.result()
+    raise error
+
+
+def main():
+    import os
+
+    parser = argparse.ArgumentParser(description="Validation latency with and without hedging against the stub server")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=100.0, help="Stub median latency in ms")
+    parser.add_argument("--jitter", type=float, default=30.0)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-ms", type=float, default=2000.0)
+    parser.add_argument("--port", type=int, default=8768)
+    args = parser.parse_args()
+
+    import llm_stub_server
+
+    state = llm_stub_server.StubState(args.latency, args.jitter, args.slow_rate, args.slow_ms)
+    server = llm_stub_server.serve(state, args.port)
+    os.environ["PIXTRAL_ENDPOINT"] = f"http://127.0.0.1:{args.port}/v1/chat/completions"
+    os.environ.setdefault("PIXTRAL_API_KEY", "stub")    # the stub server ignores the key
+    import llm_clients
+
+    # This file runs as __main__; use the policy of the module llm_clients imported
+    policy = llm_clients.validation_hedge_policy()
+    image = "data:image/png;base64,iVBORw0KGgo="
+    print(f"Stub: {args.latency:.0f}±{args.jitter:.0f} ms, {args.slow_rate:.0%} of responses at {args.slow_ms:.0f} ms")
+    for hedge in (False, True):
+        policy.reset()
+        requests_before = state.counts["requests"]
+        latencies = []
+        for _ in range(args.calls):
+            start = time.perf_counter()
+            llm_clients.validate_mri_image(image, hedge=hedge, use_cache=False)
+            latencies.append((time.perf_counter() - start) * 1000)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        sent = state.counts["requests"] - requests_before
+        print(f"  hedging {'on ' if hedge else 'off'}: p50 {p50:6.0f} ms  p95 {p95:6.0f} ms  p99 {p99:6.0f} ms  "
+              f"max {max(latencies):6.0f} ms  requests {sent} (+{sent / args.calls - 1:.1%})"
+              + (f"  {policy.snapshot()}" if hedge else ""))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Import-Time Report for the Streamlit App
+
+Measures what each page of app.py pays in module imports on a cold
+process, using CPython's `-X importtime`. Each page is measured in a fresh
+interpreter that imports the startup modules plus the modules the page
+loads lazily, so the numbers correspond to the first rerun of a new server
+process on that page. "eager" imports everything, plus torchvision, which is
+what app.py did before heavy imports were deferred.
+
+Usage:
+    python importtime_report.py
+    python importtime_report.py --top 15 --json importtime.json
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+
+# Modules imported at the top of app.py on every rerun
+STARTUP_MODULES = ["streamlit", "PIL.Image", "dotenv", "tracing", "assets", "profiling"]
+
+# Modules each page imports on first use
+PAGE_MODULES = {
+    "Данные пациента": ["patient_store"],
+    "Диагностика": ["torch", "model_arch", "mri_dataset", "diagnosis_pipeline", "explainers",
+                    "case_index", "llm_clients", "requests"],
+    "Диагностика (DICOM)": ["torch", "model_arch", "mri_dataset", "diagnosis_pipeline", "explainers",
+                            "case_index", "llm_clients", "requests", "dicom_loader"],
+    "Виртуальный ассистент": ["llm_clients", "google.generativeai"],
+}
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+_IMPORTER = """
+import importlib, sys
+for name in sys.argv[1:]:
+    try:
+        importlib.import_module(name)
+    except Exception as e:
+        print(f"MISSING {name}: {e}", file=sys.stderr)
+"""
+
+
+def measure(modules):
+    """
+    Import modules in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict with total_ms, top-level modules (name -> cumulative ms) and missing modules
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", _IMPORTER, *modules],
+                            capture_output=True, text=True)
+    total_us, top_level, missing = 0, {}, []
+    for line in result.stderr.splitlines():
+        if line.startswith("MISSING "):
+            missing.append(line[len("MISSING "):])
+            continue
+        match = _LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        total_us += int(self_us)
+        if not indent:
+            top_level[name] = int(cumulative_us) / 1000
+    return {"total_ms": total_us / 1000, "modules": top_level, "missing": missing}
+
+
+def report(top=10):
+    """Measure startup, every page and the eager (import everything) baseline."""
+    every = list(dict.fromkeys(STARTUP_MODULES + [m for modules in PAGE_MODULES.values() for m in modules]
+                               + ["torchvision.transforms"]))
+    results = {"startup": measure(STARTUP_MODULES)}
+    for page, modules in PAGE_MODULES.items():
+        results[page] = measure(STARTUP_MODULES + modules)
+    results["eager"] = measure(every)
+
+    for name, result in results.items():
+        result["modules"] = dict(sorted(result["modules"].items(), key=lambda item: -item[1])[:top])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import time per page of the Streamlit app")
+    parser.add_argument("--top", type=int, default=8, help="Slowest top-level imports to list")
+    parser.add_argument("--json", help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    results = report(args.top)
+    for name, result in results.items():
+        print(f"{name}: {result['total_ms']:.0f} ms")
+        for module, ms in result["modules"].items():
+            print(f"    {ms:8.1f} ms  {module}")
+        for missing in result["missing"]:
+            print(f"    not installed: {missing}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+Background Job Queue for Long-Running Analysis Stages
+
+The regional analysis (Pixtral, up to 45 s) and the recommendations
+(Gemini) used to run inline under st.spinner, blocking the session's
+script thread; navigating away lost the work. They now run as jobs:
+
+- An in-process pool of worker threads executes registered handlers
+- Every job has an ID, a status (queued -> running -> succeeded / failed),
+  an attempt counter and its result or error
+- Failed attempts are retried with exponential backoff up to max_attempts
+- Jobs submitted with a key (e.g. stage + image hash) are de-duplicated:
+  resubmitting returns the existing job, so a rerun or a re-upload
+  resumes instead of starting over
+- With a database path, jobs are persisted in SQLite (WAL). Jobs that were
+  queued or running when the process stopped are resumed on start, and
+  finished jobs stay readable by ID; arguments are dropped once a job
+  finishes, so uploaded images do not accumulate in the database
+
+The UI polls a job by ID on each rerun instead of waiting for it.
+
+Environment:
+    REMIND_JOBS_DB=path    Job database (default data/jobs.sqlite3; empty disables persistence)
+
+Usage:
+    python job_queue.py demo
+"""
+
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, replace
+from functools import lru_cache, partial
+
+import tracing
+
+JOBS_DB = os.getenv("REMIND_JOBS_DB", os.path.join("data", "jobs.sqlite3"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           TEXT PRIMARY KEY,
+    kind         TEXT NOT NULL,
+    key          TEXT,
+    args         TEXT,
+    status       TEXT NOT NULL,
+    attempts     INTEGER NOT NULL,
+    max_attempts INTEGER NOT NULL,
+    result       TEXT,
+    error        TEXT,
+    created_at   REAL NOT NULL,
+    started_at   REAL,
+    finished_at  REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs (key);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+"""
+
+_STOP = object()
+
+
+@dataclass
+class Job:
+    """State of one background job. Instances returned by JobQueue are snapshots."""
+    id: str
+    kind: str
+    args: dict
+    key: str = None
+    status: str = QUEUED
+    attempts: int = 0
+    max_attempts: int = 3
+    result: object = None
+    error: str = None
+    created_at: float = field(default_factory=time.time)
+    started_at: float = None
+    finished_at: float = None
+
+    @property
+    def done(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    @property
+    def elapsed(self):
+        """Seconds since submission (until completion once finished)."""
+        return (self.finished_at or time.time()) - self.created_at
+
+
+class JobQueue:
+    """
+    Thread pool executing named handlers with retries and optional persistence.
+
+    Handlers are plain functions called as handler(**job.args); arguments
+    and results must be JSON-serializable when persistence is enabled.
+    """
+
+    def __init__(self, workers=2, db_path=None, retry_delay=2.0, max_attempts=3):
+        self.workers = workers
+        self.db_path = db_path
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self._handlers = {}
+        self._jobs = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._threads = []
+        self._local = threading.local()
+        if db_path:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._db() as connection:
+                connection.executescript(_SCHEMA)
+
+    # Persistence
+
+    def _db(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=10.0)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _save(self, job):
+        if not self.db_path:
+            return
+        args = None if job.done else json.dumps(job.args, ensure_ascii=False)
+        with self._db() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs (id, kind, key, args, status, attempts, max_attempts, result, error, "
+                "created_at, started_at, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.kind, job.key, args, job.status, job.attempts, job.max_attempts,
+                 json.dumps(job.result, ensure_ascii=False) if job.result is not None else None, job.error,
+                 job.created_at, job.started_at, job.finished_at))
+
+    @staticmethod
+    def _from_row(row):
+        return Job(id=row["id"], kind=row["kind"], args=json.loads(row["args"]) if row["args"] else {},
+                   key=row["key"], status=row["status"], attempts=row["attempts"],
+                   max_attempts=row["max_attempts"],
+                   result=json.loads(row["result"]) if row["result"] is not None else None,
+                   error=row["error"], created_at=row["created_at"], started_at=row["started_at"],
+                   finished_at=row["finished_at"])
+
+    def _load(self, where, params):
+        if not self.db_path:
+            return None
+        row = self._db().execute(f"SELECT * FROM jobs WHERE {where} ORDER BY created_at DESC LIMIT 1",
+                                 params).fetchone()
+        return self._from_row(row) if row is not None else None
+
+    # Public API
+
+    def register(self, kind, handler):
+        """Register the function executed for jobs of this kind."""
+        self._handlers[kind] = handler
+        return self
+
+    def start(self):
+        """Start the workers and resume jobs left unfinished by a previous process."""
+        with self._lock:
+            if self._threads:
+                return self
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"remind-jobs-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+        if self.db_path:
+            rows = self._db().execute("SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                                      (QUEUED, RUNNING)).fetchall()
+            for row in rows:
+                job = replace(self._from_row(row), status=QUEUED)
+                with self._lock:
+                    if job.id in self._jobs:
+                        continue
+                    self._jobs[job.id] = job
+                    if job.key:
+                        self._keys[job.key] = job.id
+                self._queue.put(job.id)
+        return self
+
+    def submit(self, kind, args=None, key=None, max_attempts=None):
+        """
+        Queue a job.
+
+        Args:
+            kind: Registered handler name
+            args: Keyword arguments for the handler
+            key: De-duplication key; an existing job with this key that has not
+                failed is returned instead of starting a new one
+            max_attempts: Attempts before the job fails (default: queue setting)
+
+        Returns:
+            The job ID
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+
+        # Lookup and registration under one lock, so concurrent submissions of a key share a job
+        with self._lock:
+            if key is not None:
+                existing = self._find(key)
+                if existing is not None and existing.status != FAILED:
+                    return existing.id
+            job = Job(id=uuid.uuid4().hex, kind=kind, args=args or {}, key=key,
+                      max_attempts=max_attempts or self.max_attempts)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._keys[key] = job.id
+        self._save(job)
+        tracing.metrics.increment("remind_jobs_total", {"kind": kind, "status": "submitted"})
+        self._queue.put(job.id)
+        return job.id
+
+    def get(self, job_id):
+        """Snapshot of a job (also jobs finished by a previous process), or None."""
+        if job_id is None:
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return replace(job)
+        return self._load("id = ?", (job_id,))
+
+    def find(self, key):
+        """Latest job submitted with this key, or None."""
+        with self._lock:
+            return self._find(key)
+
+    def _find(self, key):
+        # Caller holds self._lock
+        job_id = self._keys.get(key)
+        if job_id is not None:
+            return replace(self._jobs[job_id])
+        return self._load("key = ?", (key,))
+
+    def wait(self, job_id, timeout=None, poll=0.05):
+        """Block until the job is finished (for scripts and tests; the UI polls instead)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job.done:
+                return job
+            if deadline is not None and time.monotonic() > deadline:
+                return job
+            time.sleep(poll)
+
+    def stop(self, timeout=5.0):
+        """Stop the workers after their current job."""
+        threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    # Workers
+
+    def _update(self, job_id, **changes):
+        with self._lock:
+            job = self._jobs[job_id]
+            for name, value in changes.items():
+                setattr(job, name, value)
+            snapshot = replace(job)
+        self._save(snapshot)
+        return snapshot
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is _STOP:
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.done:
+                    continue
+                job.attempts += 1
+                job.status = RUNNING
+                if job.started_at is None:
+                    job.started_at = time.time()
+                    tracing.metrics.observe(f"job_wait_{job.kind}", job.started_at - job.created_at)
+                snapshot = replace(job)
+            self._save(snapshot)
+            self._run(snapshot)
+
+    def _run(self, job):
+        handler = self._handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind '{job.kind}'")
+            with tracing.span(f"job_{job.kind}", attempt=job.attempts):
+                result = handler(**job.args)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job.attempts < job.max_attempts and handler is not None:
+                self._update(job.id, status=QUEUED, error=error)
+                delay = self.retry_delay * 2 ** (job.attempts - 1)
+                timer = threading.Timer(delay, self._queue.put, args=(job.id,))
+                timer.daemon = True
+                timer.start()
+                tracing.metrics.increment("remind_jobs_total", {"kind": job.kind, "status": "retried"})
+            else:
+                self._update(job.id, status=FAILED, error=error, finished_at=time.time())
+                tracing.metrics.increment("remind_jobs_total", {"kind": job.kind, "status": FAILED})
+            return
+        self._update(job.id, status=SUCCEEDED, result=result, error=None, finished_at=time.time())
+        tracing.metrics.increment("remind_jobs_total", {"kind": job.kind, "status": SUCCEEDED})
+
+
+def _default_handlers():
+    from llm_clients import analyze_brain_regions, get_comprehensive_recommendations
+
+    return {
+        "analyze_brain_regions": partial(analyze_brain_regions, raise_errors=True),
+        "comprehensive_recommendations": partial(get_comprehensive_recommendations, raise_errors=True),
+    }
+
+
+@lru_cache(maxsize=None)
+def get_queue(db_path=JOBS_DB or None, workers=4):
+    """Shared queue with the analysis handlers registered, started once per process."""
+    jobs = JobQueue(workers=workers, db_path=db_path)
+    for kind, handler in _default_handlers().items():
+        jobs.register(kind, handler)
+    return jobs.start()
+
+
+def main():
+    import random
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Job queue demo with a flaky handler")
+    parser.add_argument("command", choices=["demo"])
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    def flaky_sleep(seconds, fail_rate):
+        time.sleep(seconds)
+        if random.random() < fail_rate:
+            raise ConnectionError("simulated provider error")
+        return {"slept": seconds}
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "jobs.sqlite3")
+        jobs = JobQueue(workers=args.workers, db_path=db_path, retry_delay=0.05).register("sleep", flaky_sleep)
+        jobs.start()
+        start = time.perf_counter()
+        ids = [jobs.submit("sleep", {"seconds": 0.2, "fail_rate": 0.3}, key=f"demo-{i}") for i in range(args.jobs)]
+        assert jobs.submit("sleep", {"seconds": 0.2, "fail_rate": 0.3}, key="demo-0") == ids[0]
+        submitted_ms = (time.perf_counter() - start) * 1000
+        results = [jobs.wait(job_id, timeout=30) for job_id in ids]
+        elapsed = time.perf_counter() - start
+        jobs.stop()
+
+        print(f"{args.jobs} jobs submitted in {submitted_ms:.1f} ms, finished in {elapsed:.2f} s "
+              f"({args.workers} workers, 0.2 s each)")
+        for job in results:
+            print(f"  {job.id[:8]} {job.status:<9} attempts={job.attempts} {job.error or ''}")
+
+        # A new queue on the same database reads the finished jobs back
+        reopened = JobQueue(db_path=db_path)
+        print(f"Reloaded from SQLite: {reopened.get(ids[0]).status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+"""
+LLM Clients for Pixtral (Mistral) and Gemini
+
+The app's calls to external models live here so app.py does not import
+google.generativeai or requests, or configure clients, on every rerun.
+Clients are created on first use and cached for the process:
+
+- gemini_model(): genai.configure + GenerativeModel, once per model name
+- http_session(): one requests.Session, reusing TLS connections to Mistral
+
+Every call goes through the provider's shared limiter (rate_limiter), with
+a priority class: validation before analysis / recommendations before
+chat. Pixtral 429 responses are retried after Retry-After. A circuit
+breaker per provider (circuit_breaker) fails calls fast while the provider
+is down or slow; the probes below close it again. Validation, on the
+upload path, is hedged (hedging): a slow request gets one duplicate.
+API keys come from the environment only (GEMINI_API_KEY, PIXTRAL_API_KEY);
+without PIXTRAL_API_KEY the Pixtral stages are reported unavailable.
+
+The module has no Streamlit dependency; UI feedback is passed in through
+on_error callbacks.
+"""
+
+import os
+import time
+from functools import lru_cache
+
+import mri_validation
+import tracing
+from circuit_breaker import get_breaker, open_circuits
+from hedging import get_policy, hedged
+from rate_limiter import get_limiter
+
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# Pixtral API Configuration
+PIXTRAL_MODEL = "pixtral-12b-2409"
+PIXTRAL_ENDPOINT = os.getenv("PIXTRAL_ENDPOINT", "https://api.mistral.ai/v1/chat/completions")
+THROTTLE_RETRIES = 2
+BATCH_SPLIT_STATUSES = (400, 413)    # Batch too large or too many images: retry as smaller batches
+MIN_REQUEST_TIMEOUT = 1.0    # Request timeout when queueing used up (nearly) the whole deadline
+HEDGE_VALIDATION = os.getenv("REMIND_HEDGE_VALIDATION", "1").strip().lower() not in ("0", "false", "no", "off")
+
+RECOMMENDATIONS_FALLBACK = "Невозможно сгенерировать рекомендации. Пожалуйста, проконсультируйтесь с врачом."
+
+
+@lru_cache(maxsize=None)
+def gemini_model(model_name=GEMINI_MODEL):
+    """Configured Gemini model, created once per process."""
+    import google.generativeai as genai
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise RuntimeError("GEMINI_API_KEY is not set")
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+
+def pixtral_api_key():
+    """Pixtral API key from the environment (PIXTRAL_API_KEY)."""
+    api_key = os.getenv("PIXTRAL_API_KEY")
+    if not api_key:
+        raise RuntimeError("PIXTRAL_API_KEY is not set")
+    return api_key
+
+
+def unavailable_providers():
+    """Providers whose stages are skipped: open circuits, and Pixtral without an API key."""
+    unavailable = open_circuits()
+    if not os.getenv("PIXTRAL_API_KEY") and "pixtral" not in unavailable:
+        unavailable.append("pixtral")
+    return unavailable
+
+
+@lru_cache(maxsize=1)
+def http_session():
+    """Shared requests.Session for the Pixtral endpoint."""
+    import requests
+
+    return requests.Session()
+
+
+def _retry_after(response, attempt):
+    try:
+        return min(float(response.headers.get("Retry-After", "")), 10.0)
+    except ValueError:
+        return 0.5 * 2 ** attempt
+
+
+def post_pixtral(payload, timeout, priority="analysis"):
+    """
+    POST a chat completion payload to Pixtral and return the response.
+
+    `timeout` is one deadline for the whole call: waiting for a slot of the
+    shared Pixtral limiter (rate_limiter.LimiterTimeout when it runs out), the
+    request itself, and retries of throttled (429) responses, up to
+    THROTTLE_RETRIES times while Retry-After still fits before the deadline.
+    Raises circuit_breaker.CircuitOpen without calling while the Pixtral
+    circuit is open, RuntimeError when PIXTRAL_API_KEY is not set.
+    """
+    api_key = pixtral_api_key()
+    limiter = get_limiter("pixtral")
+    breaker = get_breaker("pixtral")
+    deadline = time.monotonic() + timeout
+    for attempt in range(THROTTLE_RETRIES + 1):
+        with limiter.slot(priority, timeout=deadline - time.monotonic()) as slot, breaker.guard() as call:
+            response = http_session().post(
+                PIXTRAL_ENDPOINT,
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {api_key}"
+                },
+                json=payload,
+                timeout=max(deadline - time.monotonic(), MIN_REQUEST_TIMEOUT)
+            )
+            slot.record(response.status_code)
+            if response.status_code >= 500:
+                call.fail()
+        if response.status_code != 429 or attempt == THROTTLE_RETRIES:
+            return response
+        delay = _retry_after(response, attempt)
+        if time.monotonic() + delay >= deadline:
+            return response
+        time.sleep(delay)
+
+
+def gemini_generate(contents, priority, model=None, timeout=60):
+    """
+    generate_content() on a Gemini model (default: gemini_model()) within the
+    shared Gemini limiter; `timeout` bounds queueing and the request together.
+    """
+    deadline = time.monotonic() + timeout
+    with get_limiter("gemini").slot(priority, timeout=timeout), get_breaker("gemini").guard():
+        return (model or gemini_model()).generate_content(
+            contents, request_options={"timeout": max(deadline - time.monotonic(), MIN_REQUEST_TIMEOUT)})
+
+
+def probe_pixtral():
+    """Health probe after error trips: the models listing answers 200 (latency trips use a trial call)."""
+    models_url = PIXTRAL_ENDPOINT.rsplit("/chat/completions", 1)[0] + "/models"
+    response = http_session().get(models_url, headers={"Authorization": f"Bearer {pixtral_api_key()}"}, timeout=5)
+    return response.status_code == 200
+
+
+def probe_gemini():
+    """Health probe after error trips: the model's metadata can be fetched within 5 s."""
+    import google.generativeai as genai
+
+    gemini_model()
+    return genai.get_model(f"models/{GEMINI_MODEL}", request_options={"timeout": 5}) is not None
+
+
+get_breaker("pixtral").probe = probe_pixtral
+get_breaker("gemini").probe = probe_gemini
+
+
+def validation_hedge_policy():
+    return get_policy("pixtral_validation")
+
+
+def validate_mri_image(image_base64, on_error=None, hedge=None, use_cache=True):
+    """
+    Validate if the uploaded image is a brain MRI scan using Pixtral vision AI.
+
+    The answer is a JSON verdict (mri_validation); verdicts are cached per image.
+
+    Args:
+        image_base64: Base64 encoded image string
+        on_error: Optional callback receiving the exception when the service
+            cannot be reached (validation is then skipped)
+        hedge: Send a duplicate request when the first one is slow
+            (default: REMIND_HEDGE_VALIDATION, on)
+        use_cache: Read and store the verdict cache (benchmarks that repeat
+            one image pass False so every call reaches the endpoint)
+
+    Returns:
+        tuple: (is_valid: bool, message: str, confidence: str)
+    """
+    key = mri_validation.image_key(image_base64)
+    verdict = mri_validation.verdicts.get(key) if use_cache else None
+    if verdict is not None:
+        return verdict.as_result()
+
+    payload = mri_validation.validation_payload(image_base64, PIXTRAL_MODEL)
+    try:
+        with tracing.external_call("pixtral", payload, purpose="validation") as call:
+            if HEDGE_VALIDATION if hedge is None else hedge:
+                response = hedged(lambda: post_pixtral(payload, timeout=30, priority="validation"),
+                                  validation_hedge_policy())
+            else:
+                response = post_pixtral(payload, timeout=30, priority="validation")
+            call.set(status=response.status_code)
+
+        if response.status_code != 200:
+            return False, f"Ошибка сервиса валидации (Статус {response.status_code})", "НИЗКАЯ"
+
+        data = response.json()
+        result_text = data.get('choices', [{}])[0].get('message', {}).get('content', '')
+        try:
+            verdict = mri_validation.parse_verdict(result_text)
+        except ValueError:
+            return False, "Не удалось разобрать ответ сервиса валидации", "НИЗКАЯ"
+        if use_cache:
+            mri_validation.verdicts.put(key, verdict)
+        return verdict.as_result()
+
+    except Exception as e:
+        if on_error is not None:
+            on_error(e)
+        return True, "Проверка пропущена из-за ошибки", "НИЗКАЯ"
+
+
+def validate_mri_batch(images_base64, max_images=mri_validation.MAX_BATCH_IMAGES,
+                       max_bytes=mri_validation.BATCH_BYTES, priority="analysis"):
+    """
+    Validate many images with few Pixtral requests (e.g. a folder of slices).
+
+    Images are downscaled and packed into multi-image requests; a batch that
+    is rejected (400 / 413) or answered unreadably or incompletely is split
+    in half and retried, down to single images. When Pixtral itself fails
+    the remaining images are left unvalidated, as are images that cannot be
+    decoded. Verdicts of the thumbnails are cached in
+    mri_validation.batch_verdicts, apart from validate_mri_image's
+    full-resolution ones (which are reused here, but not the other way round).
+
+    Args:
+        images_base64: Base64 encoded image data URLs
+        max_images: Images per request
+        max_bytes: Downscaled base64 payload per request
+        priority: Limiter class; below interactive validation by default
+
+    Returns:
+        list: mri_validation.ValidationVerdict per image, None where validation failed
+    """
+    keys = [mri_validation.image_key(image) for image in images_base64]
+    verdicts = [mri_validation.verdicts.get(key) or mri_validation.batch_verdicts.get(key) for key in keys]
+    small = {}
+    for i, verdict in enumerate(verdicts):
+        if verdict is None:
+            try:
+                small[i] = mri_validation.downscale(images_base64[i])
+            except (OSError, ValueError):
+                pass    # Unreadable image: its slot stays None, the rest of the folder is validated
+    pending = list(small)
+    for batch in mri_validation.pack([small[i] for i in pending], max_images, max_bytes):
+        if not _validate_batch([pending[j] for j in batch], small, keys, verdicts, priority):
+            break
+    return verdicts
+
+
+def _validate_batch(indices, small, keys, verdicts, priority):
+    """
+    Validate one packed batch, splitting it only when the answer is the
+    problem (rejected request, unreadable or incomplete verdicts).
+
+    Returns:
+        False when Pixtral itself failed (connection error, open circuit,
+        limiter timeout, 429 / 5xx): retrying smaller batches would only add
+        calls to a struggling provider, so the remaining images are skipped
+    """
+    images = [small[i] for i in indices]
+    payload = mri_validation.batch_payload(images, PIXTRAL_MODEL)
+    try:
+        with tracing.external_call("pixtral", payload, purpose="batch_validation", images=len(images)) as call:
+            response = post_pixtral(payload, timeout=30 + 5 * len(images), priority=priority)
+            call.set(status=response.status_code)
+    except Exception:
+        return False
+    if response.status_code not in (200, *BATCH_SPLIT_STATUSES):
+        return False
+    try:
+        if response.status_code != 200:
+            raise ValueError(f"Pixtral rejected the batch (status {response.status_code})")
+        text = response.json().get('choices', [{}])[0].get('message', {}).get('content', '')
+        results = mri_validation.parse_batch(text, len(images))
+    except ValueError:
+        if len(indices) == 1:
+            return True
+        tracing.metrics.increment("remind_validation_batch_splits_total", {"images": str(len(indices))})
+        middle = len(indices) // 2
+        return (_validate_batch(indices[:middle], small, keys, verdicts, priority)
+                and _validate_batch(indices[middle:], small, keys, verdicts, priority))
+    for i, verdict in zip(indices, results):
+        verdicts[i] = verdict
+        mri_validation.batch_verdicts.put(keys[i], verdict)
+    return True
+
+
+def analyze_brain_regions(image_base64, predicted_class, confidence_percent, raise_errors=False):
+    """
+    Use Pixtral AI to analyze specific brain regions and identify abnormalities.
+
+    Args:
+        image_base64: Base64 encoded MRI image
+        predicted_class: The predicted Alzheimer's stage
+        confidence_percent: Model confidence percentage
+        raise_errors: Raise on failures instead of returning a message
+            (background jobs retry on exceptions)
+
+    Returns:
+        str: Detailed medical analysis of brain regions
+    """
+    analysis_prompt = f"""Вы эксперт-радиолог, анализирующий МРТ снимок головного мозга. ОТВЕЧАЙТЕ ТОЛЬКО НА РУССКОМ ЯЗЫКЕ.
+
+**Клинический контекст:**
+- Прогноз модели ИИ: {predicted_class}
+- Уверенность модели: {confidence_percent:.1f}%
+
+**Ваша задача:**
+Проанализируйте это МРТ изображение головного мозга и предоставьте детальную оценку следующего:
+
+1. **Гиппокампальная область:** Оценить атрофию, потерю объема или структурные изменения
+2. **Желудочковая система:** Оценить размер желудочков и любое расширение
+3. **Корковые области:** Искать истончение коры, особенно в височных и теменных долях
+4. **Белое вещество:** Определить любые гиперинтенсивности белого вещества или повреждения
+5. **Общая структура мозга:** Общие наблюдения об объеме и симметрии мозга
+
+**Форматируйте ваш ответ так:**
+
+РЕГИОНАЛЬНЫЙ АНАЛИЗ
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+- Гиппокамп и медиальная височная доля:
+[Ваши детальные находки]
+
+- Желудочковая система:
+[Ваши детальные находки]
+
+- Корковые области:
+[Ваши детальные находки]
+
+- Белое вещество:
+[Ваши детальные находки]
+
+- Общая оценка:
+[Резюме ключевых находок]
+
+КОРРЕЛЯЦИЯ С ПРОГНОЗОМ ИИ:
+[Как ваши находки подтверждают или противоречат прогнозу ИИ "{predicted_class}"]
+
+**Важно:** Будьте конкретны относительно локализации (левое/правое полушарие, передний/задний отдел и т.д.) и тяжести (легкая/умеренная/тяжелая).
+ОТВЕЧАЙТЕ ПОЛНОСТЬЮ НА РУССКОМ ЯЗЫКЕ.
+"""
+
+    payload = {
+        "model": PIXTRAL_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": analysis_prompt},
+                    {"type": "image_url", "image_url": {"url": image_base64}}
+                ]
+            }
+        ],
+        "temperature": 0.4,
+        "top_p": 0.9,
+        "stream": False
+    }
+
+    try:
+        with tracing.external_call("pixtral", payload, purpose="region_analysis") as call:
+            response = post_pixtral(payload, timeout=45, priority="analysis")
+            call.set(status=response.status_code)
+
+        if response.status_code == 200:
+            data = response.json()
+            analysis_text = data.get('choices', [{}])[0].get('message', {}).get('content', '')
+            return analysis_text if analysis_text else "Невозможно сгенерировать детальный анализ."
+        if raise_errors:
+            raise RuntimeError(f"Pixtral returned status {response.status_code}")
+        return f"Сервис анализа временно недоступен (Статус {response.status_code})"
+
+    except Exception as e:
+        if raise_errors:
+            raise
+        return f"Не удалось завершить региональный анализ: {str(e)}"
+
+
+def get_comprehensive_recommendations(diagnosis, confidence, brain_analysis, gradcam_data=None, on_error=None,
+                                      raise_errors=False):
+    """
+    Generate comprehensive recommendations using ALL collected data:
+    - CNN diagnosis + confidence
+    - Grad-CAM attention regions
+    - Pixtral regional analysis
+
+    on_error receives the exception if Gemini fails; a fallback text is returned
+    (or the exception is raised with raise_errors=True).
+    """
+    prompt = f"""Вы эксперт-невролог, создающий комплексный план лечения и управления. ОТВЕЧАЙТЕ ПОЛНОСТЬЮ НА РУССКОМ ЯЗЫКЕ.
+
+**ДИАГНОСТИЧЕСКИЕ ДАННЫЕ ПАЦИЕНТА:**
+
+1. **Диагноз модели ИИ:** {diagnosis}
+   - Уверенность модели: {confidence:.1f}%
+   - Обучена на обширном датасете МРТ болезни Альцгеймера (точность 95.47%)
+
+2. **Области фокуса модели ИИ (Grad-CAM анализ):**
+   - CNN модель в основном сосредоточилась на: гиппокампальных областях, желудочковой системе и корковых областях
+   - Это области, которые больше всего повлияли на решение классификации ИИ
+
+3. **Детальный региональный анализ мозга (Pixtral AI):**
+{brain_analysis}
+
+**ВАША ЗАДАЧА:**
+На основе ВСЕХ вышеуказанных данных (диагноз, внимание модели и детальные региональные находки), создайте комплексный, персонализированный план медицинских действий.
+
+**ФОРМАТИРУЙТЕ ВАШ ОТВЕТ ТАК:**
+
+КОМПЛЕКСНЫЙ ПЛАН МЕДИЦИНСКИХ ДЕЙСТВИЙ
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+I. НЕМЕДЛЕННЫЕ СЛЕДУЮЩИЕ ШАГИ
+• [Срочные действия, требуемые в течение 1-2 недель]
+• [Необходимые направления к специалистам]
+• [Дополнительные диагностические тесты для назначения]
+
+II. РЕКОМЕНДАЦИИ ПО ЛЕЧЕНИЮ
+• [Варианты медикаментов на основе тяжести]
+• [Соображения по дозировке]
+• [Ожидаемые результаты и мониторинг]
+
+III. КОГНИТИВНЫЕ ВМЕШАТЕЛЬСТВА
+• [Программы когнитивных тренировок]
+• [Упражнения для памяти]
+• [Активности для здоровья мозга]
+
+IV. МОДИФИКАЦИИ ОБРАЗА ЖИЗНИ
+• [Диетические рекомендации (средиземноморская диета и т.д.)]
+• [Режим упражнений (аэробные + силовые тренировки)]
+• [Улучшения гигиены сна]
+• [Техники управления стрессом]
+
+V. СОЦИАЛЬНЫЕ МЕРЫ И ПОДДЕРЖКА
+• [Обучение ухаживающих и группы поддержки]
+• [Активности социального взаимодействия]
+• [Планирование безопасности дома]
+
+VI. ПЛАН МОНИТОРИНГА
+• [График последующих визуализаций (например, МРТ каждые 6-12 месяцев)]
+• [Частота когнитивной оценки]
+• [Ключевые биомаркеры для отслеживания]
+
+VII. КОРРЕЛЯЦИЯ С НАХОДКАМИ ИИ
+• [Как региональные находки мозга коррелируют с рекомендованным лечением]
+• [Почему конкретные вмешательства нацелены на пораженные области]
+• [Ожидаемое прогрессирование на основе текущих находок]
+
+VIII. ТРЕВОЖНЫЕ ПРИЗНАКИ ДЛЯ НАБЛЮДЕНИЯ
+• [Симптомы, требующие немедленной медицинской помощи]
+• [Признаки быстрого прогрессирования]
+• [Побочные эффекты медикаментов для мониторинга]
+
+IX. ИССЛЕДОВАНИЯ И КЛИНИЧЕСКИЕ ИСПЫТАНИЯ
+• [Релевантные текущие испытания для этой стадии]
+• [Развивающиеся терапии для обсуждения с неврологом]
+
+**ВАЖНО:** Будьте конкретны, основывайтесь на доказательствах и цитируйте текущие клинические руководства, где применимо. Адаптируйте рекомендации к тяжести, указанной диагнозом ({diagnosis}).
+ОТВЕЧАЙТЕ ПОЛНОСТЬЮ НА РУССКОМ ЯЗЫКЕ.
+"""
+
+    try:
+        with tracing.external_call("gemini", prompt, purpose="recommendations"):
+            response = gemini_generate(prompt, priority="recommendations", timeout=90)
+        return response.text
+    except Exception as e:
+        if raise_errors:
+            raise
+        if on_error is not None:
+            on_error(e)
+        return RECOMMENDATIONS_FALLBACK
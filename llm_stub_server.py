@@ -0,0 +1,202 @@
+"""
+Local Stand-In for the Pixtral Chat Completions Endpoint
+
+Serves POST /v1/chat/completions with canned answers so the limiter, the
+job queue and the other client-side machinery can be exercised without
+a real API key or network access. The provider's failure modes are injected:
+
+- --latency / --jitter: response time in ms (jitter is uniform +/-)
+- --slow-rate / --slow-ms: fraction of responses delayed to slow-ms (tail latency)
+- --capacity: concurrent requests served; beyond it the stub answers 429
+- --rps: requests per second served; beyond it the stub answers 429
+- --error-rate: fraction of 500 responses
+- --per-image: extra latency per image in the request (multi-image batches)
+- --max-images: requests with more images get 400
+
+The answer follows the request: JSON mode gets a valid brain-MRI JSON
+verdict (a {"verdicts": [...]} array for several images), the legacy
+validation prompt the same verdict as text lines, anything else a short
+analysis text.
+
+GET /v1/models answers the health probe (failing at --error-rate too);
+GET /stats returns the request counters as JSON.
+
+Usage:
+    python llm_stub_server.py --port 8765 --latency 300 --capacity 4
+    PIXTRAL_ENDPOINT=http://127.0.0.1:8765/v1/chat/completions PIXTRAL_API_KEY=stub streamlit run app.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VALIDATION_ANSWER = "ВАЛИДНО: ДА\nУВЕРЕННОСТЬ: ВЫСОКАЯ\nПРИЧИНА: Аксиальный срез МРТ головного мозга"
+ANALYSIS_ANSWER = "**Гиппокамп:** без выраженных изменений (ответ тестового сервера)."
+JSON_VERDICT = {"valid": True, "confidence": "high", "reason": "Аксиальный срез МРТ головного мозга"}
+
+
+class StubState:
+    """Injected behaviour and counters shared by the handler threads."""
+
+    def __init__(self, latency_ms=200.0, jitter_ms=0.0, slow_rate=0.0, slow_ms=2000.0, capacity=None,
+                 rps=None, error_rate=0.0, per_image_ms=0.0, max_images=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.capacity = capacity
+        self.rps = rps
+        self.error_rate = error_rate
+        self.per_image_ms = per_image_ms
+        self.max_images = max_images
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.window = (0, 0)    # (second, requests in it)
+        self.counts = {"requests": 0, "ok": 0, "throttled": 0, "errors": 0, "max_in_flight": 0}
+
+    def admit(self):
+        """Count a request; False if it exceeds the injected capacity or rate."""
+        with self.lock:
+            self.counts["requests"] += 1
+            second = int(time.monotonic())
+            served = self.window[1] + 1 if self.window[0] == second else 1
+            if (self.capacity is not None and self.in_flight >= self.capacity) or \
+                    (self.rps is not None and served > self.rps):
+                self.counts["throttled"] += 1
+                return False
+            self.window = (second, served)
+            self.in_flight += 1
+            self.counts["max_in_flight"] = max(self.counts["max_in_flight"], self.in_flight)
+            return True
+
+    def delay(self, images=1):
+        if random.random() < self.slow_rate:
+            return self.slow_ms / 1000
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms) + self.per_image_ms * images
+        return max(0.0, latency) / 1000
+
+    def finish(self, outcome):
+        with self.lock:
+            self.in_flight -= 1
+            self.counts[outcome] += 1
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body, headers=()):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/v1/models":
+                # Health probe target; fails like the completions endpoint
+                failed = random.random() < state.error_rate
+                self._send(500 if failed else 200, {"data": [] if failed else [{"id": "pixtral-12b-2409"}]})
+            elif self.path == "/stats":
+                with state.lock:
+                    self._send(200, dict(state.counts, in_flight=state.in_flight))
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            images = image_count(request)
+            if state.max_images is not None and images > state.max_images:
+                self._send(400, {"error": f"too many images ({images} > {state.max_images})"})
+                return
+            if not state.admit():
+                self._send(429, {"error": "rate limited"}, headers=[("Retry-After", "1")])
+                return
+            try:
+                time.sleep(state.delay(images))
+                if random.random() < state.error_rate:
+                    state.finish("errors")
+                    self._send(500, {"error": "injected failure"})
+                    return
+                state.finish("ok")
+                self._send(200, {
+                    "model": request.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": answer_for(request)}}],
+                })
+            except BaseException:
+                state.finish("errors")
+                raise
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def prompt_text(request):
+    """Concatenated text parts of the request's messages."""
+    parts = []
+    for message in request.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(part.get("text", "") for part in content or [] if part.get("type") == "text")
+    return "\n".join(parts)
+
+
+def image_count(request):
+    return sum(1 for message in request.get("messages", []) if not isinstance(message.get("content"), str)
+               for part in message.get("content") or [] if part.get("type") == "image_url")
+
+
+def answer_for(request):
+    if request.get("response_format", {}).get("type") == "json_object":
+        images = image_count(request)
+        if images > 1:
+            verdicts = [dict(JSON_VERDICT, index=i) for i in range(images)]
+            return json.dumps({"verdicts": verdicts}, ensure_ascii=False)
+        return json.dumps(JSON_VERDICT, ensure_ascii=False)
+    return VALIDATION_ANSWER if "ВАЛИДНО" in prompt_text(request) else ANALYSIS_ANSWER
+
+
+def serve(state, port=8765, host="127.0.0.1"):
+    """Start the stub in a daemon thread and return the server (call .shutdown() to stop)."""
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Pixtral endpoint with injected latency, throttling and errors")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=200.0, help="Response time in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter in ms")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of slow responses")
+    parser.add_argument("--slow-ms", type=float, default=2000.0, help="Latency of slow responses in ms")
+    parser.add_argument("--capacity", type=int, default=None, help="Concurrent requests before 429")
+    parser.add_argument("--rps", type=int, default=None, help="Requests per second before 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of 500 responses")
+    parser.add_argument("--per-image", type=float, default=0.0, help="Extra latency per image in ms")
+    parser.add_argument("--max-images", type=int, default=None, help="Images per request before 400")
+    args = parser.parse_args()
+
+    state = StubState(args.latency, args.jitter, args.slow_rate, args.slow_ms, args.capacity, args.rps,
+                      args.error_rate, args.per_image, args.max_images)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"Stub Pixtral endpoint on http://{args.host}:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
+import torch
 import torch.nn as nn
 
+# Trained weights shipped with the repository
+MODEL_PATH = "models/alz_CNN.pt"
+
 class AlzheimerDetector(nn.Module):
     """
     Model architecture replicates TinyVGG model
@@ -75,3 +79,32 @@ class AlzheimerDetector(nn.Module):
         """
         return self.classifier(self.conv_block_2(self.conv_block_1(x)))
 
+    def extract_features(self, x):
+        """
+        Penultimate features used for similar-case retrieval.
+
+        Args:
+            x: Input tensor of MRI images (N, 3, 128, 128)
+
+        Returns:
+            Tensor (N, hidden_units * 32 * 32) with the flattened conv_block_2 output
+        """
+        return self.conv_block_2(self.conv_block_1(x)).flatten(start_dim=1)
+
+
+def load_pretrained(path=MODEL_PATH, device="cpu"):
+    """
+    Build the AlzheimerDetector used by the app and load the trained weights.
+
+    Args:
+        path: Path to the saved state_dict
+        device: Device to load the model on
+
+    Returns:
+        AlzheimerDetector in eval mode
+    """
+    model = AlzheimerDetector(input_shape=3, hidden_units=10, output_shape=4, image_dimension=128).to(device)
+    model.load_state_dict(torch.load(path, map_location=torch.device(device)))
+    model.eval()
+    return model
+
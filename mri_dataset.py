@@ -0,0 +1,145 @@
+"""
+Shared MRI Image Loading Helpers
+
+Lists ImageFolder-style datasets (one sub-folder per class, as in
+"Sample Testing Images/test") and decodes images into the 128x128 RGB
+uint8 layout that AlzheimerDetector expects, so batch tools do not each
+re-implement the preprocessing from app.py.
+"""
+
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+IMAGE_SIZE = 128
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# Accepted by dicom_loader; kept here so the upload page does not import pydicom to list them
+DICOM_EXTENSIONS = ('.dcm', '.dicom', '.ima')
+
+# ImageFolder sorts class folders alphabetically; this matches class_names in app.py
+DATASET_CLASSES = ['Mild Impairment', 'Moderate Impairment', 'No Impairment', 'Very Mild Impairment']
+
+TEST_DIR = "Sample Testing Images/test"
+SYNTHETIC_DIR = "WGAN/WGAN_Synthetic_Images"
+
+
+def list_image_folder(root):
+    """
+    List the images of an ImageFolder-style directory.
+
+    Args:
+        root: Folder with one sub-folder per class
+
+    Returns:
+        tuple: (list of paths, numpy int64 array of labels, list of class names)
+    """
+    classes = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+    paths, labels = [], []
+    for label, class_name in enumerate(classes):
+        class_dir = os.path.join(root, class_name)
+        for file_name in sorted(os.listdir(class_dir)):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(class_dir, file_name))
+                labels.append(label)
+    return paths, np.asarray(labels, dtype=np.int64), classes
+
+
+def list_images(directory):
+    """
+    List the images of a flat, unlabeled directory (e.g. WGAN outputs).
+
+    Returns:
+        Sorted list of image paths
+    """
+    return sorted(
+        os.path.join(directory, file_name)
+        for file_name in os.listdir(directory)
+        if file_name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def load_image_array(path, size=IMAGE_SIZE):
+    """
+    Decode one image into the model input layout.
+
+    Mirrors the app transform: resize to size x size (bilinear) and convert to RGB.
+
+    Args:
+        path: Image file path or file-like object
+        size: Output edge length
+
+    Returns:
+        uint8 numpy array (size, size, 3)
+    """
+    with Image.open(path) as image:
+        return image_to_array(image, size)
+
+
+def image_to_array(image, size=IMAGE_SIZE):
+    """
+    Resize an open PIL image (bilinear) and convert it to RGB uint8.
+
+    Returns:
+        uint8 numpy array (size, size, 3)
+    """
+    if image.size != (size, size):
+        image = image.resize((size, size), Image.BILINEAR)
+    return np.array(image.convert("RGB"), dtype=np.uint8)
+
+
+def preprocess_image(image, size=IMAGE_SIZE):
+    """
+    Model input for one PIL image, without torchvision.
+
+    Matches transforms.Compose([Resize((size, size)), convert("RGB"), ToTensor()])
+    followed by unsqueeze(0), as used in the notebooks.
+
+    Returns:
+        float32 tensor (1, 3, size, size)
+    """
+    return to_model_tensor(image_to_array(image, size)[None])
+
+
+def load_image_batch(paths, size=IMAGE_SIZE, out=None):
+    """
+    Decode several images into one contiguous uint8 batch.
+
+    Args:
+        paths: Image paths
+        size: Output edge length
+        out: Optional preallocated uint8 array (len(paths), size, size, 3)
+
+    Returns:
+        uint8 numpy array (N, size, size, 3)
+    """
+    if out is None:
+        out = np.empty((len(paths), size, size, 3), dtype=np.uint8)
+    for i, path in enumerate(paths):
+        out[i] = load_image_array(path, size)
+    return out
+
+
+def to_model_tensor(batch_uint8, size=None):
+    """
+    Convert a uint8 NHWC batch into the float NCHW tensor the model expects.
+
+    Equivalent to transforms.ToTensor() applied per image.
+
+    Args:
+        batch_uint8: uint8 numpy array or tensor (N, H, W, 3)
+        size: Optional edge length; smaller images (e.g. 64x64 WGAN output)
+            are upsampled bilinearly in one vectorized step
+
+    Returns:
+        float32 tensor (N, 3, size, size) with values in [0, 1]
+    """
+    if isinstance(batch_uint8, np.ndarray) and not batch_uint8.flags.writeable:
+        # Read-only memory maps (dataset_cache packs) are copied once as uint8
+        batch_uint8 = np.array(batch_uint8)
+    batch = torch.as_tensor(batch_uint8).permute(0, 3, 1, 2).float().div_(255.0)
+    if size is not None and batch.shape[-2:] != (size, size):
+        batch = F.interpolate(batch, size=(size, size), mode="bilinear", align_corners=False)
+    return batch
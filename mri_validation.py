@@ -0,0 +1,377 @@
+"""
+Structured Pixtral Validation Verdicts
+
+Validation used to ask for three labelled lines of free text and decide by
+substring search ("ВАЛИДНО: ДА" in the upper-cased answer); any drift in
+the wording turned into a false reject. The request now asks for JSON
+mode (response_format json_object) with a fixed schema
+
+    {"valid": true, "confidence": "high" | "medium" | "low", "reason": "..."}
+
+and a reason of at most 15 words, with max_tokens capped accordingly,
+which also shortens the response. Parsing goes through three tiers:
+
+- strict: json.loads of the whole answer and exact schema types
+- lenient: the first {...} block (code fences, surrounding prose), with
+  string booleans ("true", "да") and unknown confidences coerced
+- legacy: the old "ВАЛИДНО: / УВЕРЕННОСТЬ: / ПРИЧИНА:" lines
+
+Parsed verdicts are compact immutable tuples, cached per image (content
+hash of the base64 payload), so a rerun or a re-upload of the same scan
+does not call Pixtral again. The parser tier is counted in tracing.metrics
+(remind_validation_parse_total).
+
+Batch mode (llm_clients.validate_mri_batch) validates a folder of slices
+with few round-trips: images are downscaled (256 px JPEG), packed into
+requests of up to MAX_BATCH_IMAGES images within BATCH_BYTES, and the
+model returns {"verdicts": [{"index": i, ...}, ...]}. Verdicts are mapped
+back by index; a rejected, unreadable or incomplete batch is split in half
+and retried (provider failures are not, see llm_clients._validate_batch).
+Thumbnail verdicts are cached separately (batch_verdicts).
+
+Usage:
+    python mri_validation.py bench "Sample Testing Images/test" --count 32    # against llm_stub_server
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+import tracing
+
+CONFIDENCE_LABELS = {"high": "ВЫСОКАЯ", "medium": "СРЕДНЯЯ", "low": "НИЗКАЯ"}
+_CONFIDENCE_ALIASES = {
+    "высокая": "high", "средняя": "medium", "низкая": "low",
+    "high": "high", "medium": "medium", "low": "low",
+}
+_TRUE = {"true", "yes", "да", "1"}
+_FALSE = {"false", "no", "нет", "0"}
+_OBJECT = re.compile(r"\{.*?\}", re.DOTALL)
+
+CRITERIA = """Валидное МРТ головного мозга: медицинское изображение, видны структуры мозга (кора, желудочки,
+белое/серое вещество), именно МРТ (не КТ, рентген, УЗИ), аксиальный, сагиттальный или корональный вид.
+Невалидно: фотографии, рисунки, МРТ других частей тела, КТ/рентген/УЗИ, полностью размытые снимки."""
+
+VALIDATION_PROMPT = f"""Определите, является ли это изображение МРТ снимком головного мозга.
+
+{CRITERIA}
+
+Ответьте ТОЛЬКО JSON-объектом:
+{{"valid": true или false, "confidence": "high" | "medium" | "low", "reason": "до 15 слов на русском"}}"""
+
+# Enough for the schema with a 15-word Russian reason
+MAX_TOKENS = 120
+
+BATCH_PROMPT = """Вам даны {count} изображений, пронумерованных по порядку от 0 до {last}.
+Для КАЖДОГО определите, является ли оно МРТ снимком головного мозга.
+
+{criteria}
+
+Ответьте ТОЛЬКО JSON-объектом с одним вердиктом на изображение, в порядке изображений:
+{{"verdicts": [{{"index": 0, "valid": true или false, "confidence": "high" | "medium" | "low", "reason": "до 10 слов"}}, ...]}}"""
+
+MAX_BATCH_IMAGES = 8
+BATCH_BYTES = 2_000_000     # base64 payload per request
+BATCH_SIDE = 256
+TOKENS_PER_VERDICT = 60
+
+
+class ValidationVerdict(NamedTuple):
+    valid: bool
+    confidence: str     # "high" | "medium" | "low"
+    reason: str
+
+    def as_result(self):
+        """(is_valid, reason, confidence label) as returned by llm_clients.validate_mri_image."""
+        return self.valid, self.reason, CONFIDENCE_LABELS[self.confidence]
+
+    def to_dict(self):
+        return self._asdict()
+
+
+def validation_payload(image_base64, model):
+    """Chat completion payload requesting a JSON verdict for one image."""
+    return {
+        "model": model,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": VALIDATION_PROMPT},
+                    {"type": "image_url", "image_url": {"url": image_base64}}
+                ]
+            }
+        ],
+        "response_format": {"type": "json_object"},
+        "max_tokens": MAX_TOKENS,
+        "temperature": 0,
+        "stream": False
+    }
+
+
+def batch_payload(images_base64, model):
+    """Chat completion payload requesting a verdict array for several images."""
+    prompt = BATCH_PROMPT.format(count=len(images_base64), last=len(images_base64) - 1, criteria=CRITERIA)
+    content = [{"type": "text", "text": prompt}]
+    content.extend({"type": "image_url", "image_url": {"url": image}} for image in images_base64)
+    return {
+        "model": model,
+        "messages": [{"role": "user", "content": content}],
+        "response_format": {"type": "json_object"},
+        "max_tokens": 40 + TOKENS_PER_VERDICT * len(images_base64),
+        "temperature": 0,
+        "stream": False
+    }
+
+
+def downscale(image, max_side=BATCH_SIDE, quality=85):
+    """
+    Grayscale JPEG data URL with the longest side at most max_side.
+
+    Args:
+        image: PIL Image, path, or an image data URL
+    """
+    from PIL import Image
+
+    if isinstance(image, str) and image.startswith("data:"):
+        image = io.BytesIO(base64.b64decode(image.split(",", 1)[1]))
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    image = image.convert("L")
+    image.thumbnail((max_side, max_side))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return f"data:image/jpeg;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+
+def pack(images_base64, max_images=MAX_BATCH_IMAGES, max_bytes=BATCH_BYTES):
+    """
+    Split images into consecutive batches under the count and size budget.
+
+    Returns:
+        list of lists of indices into images_base64
+    """
+    batches, batch, size = [], [], 0
+    for i, image in enumerate(images_base64):
+        if batch and (len(batch) >= max_images or size + len(image) > max_bytes):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(i)
+        size += len(image)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def parse_batch(text, count):
+    """
+    Parse a batch answer into `count` verdicts, in image order.
+
+    Entries are matched by their "index" (position when it is missing);
+    the strict and lenient object readers of parse_verdict apply per entry.
+
+    Raises:
+        ValueError: Unreadable answer, or not exactly one verdict per image
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end < start:
+            raise ValueError(f"No JSON in the batch answer: {text[:200]!r}") from None
+        data = json.loads(text[start:end + 1])
+    entries = data.get("verdicts") if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        raise ValueError("Batch answer has no verdict array")
+
+    verdicts = [None] * count
+    for position, entry in enumerate(entries):
+        index = entry.get("index", position) if isinstance(entry, dict) else position
+        if not isinstance(index, int) or not 0 <= index < count or verdicts[index] is not None:
+            raise ValueError(f"Bad or duplicate verdict index {index!r}")
+        try:
+            verdicts[index] = _strict(entry)
+        except ValueError:
+            verdicts[index] = _coerce(entry)
+    missing = [i for i, verdict in enumerate(verdicts) if verdict is None]
+    if missing:
+        raise ValueError(f"No verdict for images {missing}")
+    return verdicts
+
+
+def _strict(data):
+    if not isinstance(data, dict):
+        raise ValueError("verdict is not an object")
+    valid, confidence, reason = data.get("valid"), data.get("confidence"), data.get("reason")
+    if not isinstance(valid, bool) or confidence not in CONFIDENCE_LABELS or not isinstance(reason, str):
+        raise ValueError(f"verdict does not match the schema: {data!r}")
+    return ValidationVerdict(valid, confidence, reason.strip())
+
+
+def _coerce(data):
+    if not isinstance(data, dict):
+        raise ValueError("verdict is not an object")
+    valid = data.get("valid", data.get("is_valid"))
+    if isinstance(valid, str):
+        text = valid.strip().lower()
+        if text not in _TRUE | _FALSE:
+            raise ValueError(f"unreadable 'valid' value {valid!r}")
+        valid = text in _TRUE
+    if not isinstance(valid, bool):
+        raise ValueError(f"unreadable 'valid' value {valid!r}")
+    confidence = _CONFIDENCE_ALIASES.get(str(data.get("confidence", "")).strip().lower(), "low")
+    reason = str(data.get("reason") or "Причина не указана").strip()
+    return ValidationVerdict(valid, confidence, reason)
+
+
+def _legacy(text):
+    upper = text.upper()
+    if "ВАЛИДНО:" not in upper and "VALID:" not in upper:
+        raise ValueError("no verdict in the answer")
+    valid = "ВАЛИДНО: ДА" in upper or "VALID: YES" in upper
+    confidence, reason = "low", "Причина не указана"
+    for line in text.strip().split("\n"):
+        if "УВЕРЕННОСТЬ:" in line.upper() or "CONFIDENCE:" in line.upper():
+            confidence = _CONFIDENCE_ALIASES.get(line.split(":", 1)[1].strip().lower(), "low")
+        elif "ПРИЧИНА:" in line.upper() or "REASON:" in line.upper():
+            reason = line.split(":", 1)[1].strip()
+    return ValidationVerdict(valid, confidence, reason)
+
+
+def parse_verdict(text):
+    """
+    Parse a validation answer.
+
+    Returns:
+        ValidationVerdict
+
+    Raises:
+        ValueError: No tier could read a verdict
+    """
+    tier = "strict"
+    try:
+        verdict = _strict(json.loads(text))
+    except ValueError:
+        try:
+            tier = "lenient"
+            match = _OBJECT.search(text)
+            if match is None:
+                raise ValueError("no JSON object in the answer")
+            verdict = _coerce(json.loads(match.group(0)))
+        except ValueError:
+            tier = "legacy"
+            try:
+                verdict = _legacy(text)
+            except ValueError:
+                tracing.metrics.increment("remind_validation_parse_total", {"tier": "failed"})
+                raise ValueError(f"Unreadable validation answer: {text[:200]!r}") from None
+    tracing.metrics.increment("remind_validation_parse_total", {"tier": tier})
+    return verdict
+
+
+def image_key(image_base64):
+    return hashlib.blake2b(image_base64.encode("ascii"), digest_size=16).hexdigest()
+
+
+class VerdictCache:
+    """Thread-safe LRU of verdicts keyed by image_key()."""
+
+    def __init__(self, size=512):
+        self.size = size
+        self._verdicts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            verdict = self._verdicts.get(key)
+            if verdict is not None:
+                self._verdicts.move_to_end(key)
+            return verdict
+
+    def put(self, key, verdict):
+        with self._lock:
+            self._verdicts[key] = verdict
+            self._verdicts.move_to_end(key)
+            while len(self._verdicts) > self.size:
+                self._verdicts.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._verdicts.clear()
+
+
+verdicts = VerdictCache()
+# Verdicts on 256 px batch thumbnails, kept apart so full-resolution uploads are validated on their own
+batch_verdicts = VerdictCache()
+
+
+def main():
+    import os
+    import time
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Single-image vs. batch validation against the stub server")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("folder")
+    parser.add_argument("--count", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=800.0, help="Stub latency per request in ms")
+    parser.add_argument("--per-image", type=float, default=150.0, help="Stub latency per image in ms")
+    parser.add_argument("--max-images", type=int, default=None, help="Stub rejects larger batches (tests splitting)")
+    parser.add_argument("--port", type=int, default=8770)
+    args = parser.parse_args()
+
+    import llm_stub_server
+
+    state = llm_stub_server.StubState(args.latency, per_image_ms=args.per_image, max_images=args.max_images)
+    server = llm_stub_server.serve(state, args.port)
+    os.environ["PIXTRAL_ENDPOINT"] = f"http://127.0.0.1:{args.port}/v1/chat/completions"
+    os.environ.setdefault("PIXTRAL_API_KEY", "stub")    # the stub server ignores the key
+    os.environ["REMIND_HEDGE_VALIDATION"] = "0"
+    import llm_clients
+
+    paths = sorted(p for p in Path(args.folder).rglob("*") if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    paths = paths[:args.count]
+    images = []
+    for path in paths:
+        data = path.read_bytes()
+        kind = "jpeg" if path.suffix.lower() in (".jpg", ".jpeg") else "png"
+        images.append(f"data:image/{kind};base64,{base64.b64encode(data).decode()}")
+    # The module instance llm_clients uses
+    caches = (llm_clients.mri_validation.verdicts, llm_clients.mri_validation.batch_verdicts)
+
+    for cache in caches:
+        cache.clear()
+    requests_before = state.counts["requests"]
+    start = time.perf_counter()
+    single = [llm_clients.validate_mri_image(image) for image in images]
+    single_s = time.perf_counter() - start
+    single_requests = state.counts["requests"] - requests_before
+
+    for cache in caches:
+        cache.clear()
+    requests_before = state.counts["requests"]
+    start = time.perf_counter()
+    batch = llm_clients.validate_mri_batch(images)
+    batch_s = time.perf_counter() - start
+    batch_requests = state.counts["requests"] - requests_before
+    server.shutdown()
+
+    agree = sum(s[0] == (b is not None and b.valid) for s, b in zip(single, batch))
+    full_bytes = sum(len(image) for image in images)
+    print(f"{len(images)} images, stub {args.latency:.0f} ms/request + {args.per_image:.0f} ms/image")
+    print(f"  single: {single_requests:>3} requests, {single_s:6.2f} s, {single_s / len(images) * 1000:6.0f} ms/image, "
+          f"{full_bytes / 1024:.0f} KiB uploaded")
+    small_bytes = sum(len(downscale(image)) for image in images)
+    print(f"  batch:  {batch_requests:>3} requests, {batch_s:6.2f} s, {batch_s / len(images) * 1000:6.0f} ms/image, "
+          f"{small_bytes / 1024:.0f} KiB uploaded")
+    print(f"  verdicts agree: {agree}/{len(images)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import streamlit as st
 import io
 
+from patient_store import get_store
+
 # Enhanced header
 st.markdown("""
     <div style='text-align: center; padding: 1rem 0 2rem 0;'>
@@ -22,17 +24,54 @@ st.markdown("""
     </div>
 """, unsafe_allow_html=True)
 
-# Form to enter patient data with better labels
+# Profiles are saved under an explicit patient ID: pick an existing patient
+# or create a new one (patients with the same name stay separate)
+store = get_store()
+selected_id = st.session_state.pop("created_patient_id", None)
+if selected_id is None and "patient_profile" not in st.session_state:
+    selected_id = st.session_state.get("patient_id")  # Widget state is dropped when leaving the page
+if selected_id is not None:
+    selected = store.get_patient(selected_id)
+    if selected is not None:
+        st.session_state.patient_lookup = selected.name
+        st.session_state.patient_profile = selected.id
+
+lookup = st.text_input("Найти существующего пациента", key="patient_lookup", placeholder="Начните вводить имя")
+profiles = {patient.id: patient for patient in (store.find_patients(lookup) if lookup.strip() else [])}
+if st.session_state.get("patient_profile") is not None and st.session_state.patient_profile not in profiles:
+    selected = store.get_patient(st.session_state.patient_profile)
+    if selected is not None:
+        profiles[selected.id] = selected
+profile_id = st.selectbox(
+    "Профиль пациента",
+    [None, *profiles],
+    key="patient_profile",
+    format_func=lambda pid: "Новый пациент" if pid is None else
+        f"#{pid} · {profiles[pid].name} · {profiles[pid].age} лет · создан {profiles[pid].created_at[:10]}"
+)
+profile = profiles.get(profile_id)
+# Diagnoses in this session are linked to the selected patient only
+st.session_state.patient_id = profile_id
+
+# Form to enter patient data with better labels (prefilled from the selected profile)
+genders = ["Мужской", "Женский", "Другой", "Предпочитаю не указывать"]
+suffix = profile_id or "new"
 col1, col2 = st.columns(2, gap="large")
 with col1:
     st.markdown("<p style='color: #000000; font-weight: 600; font-size: 1.1rem; margin-bottom: 1rem;'>Основная информация</p>", unsafe_allow_html=True)
-    name = st.text_input("Полное имя", placeholder="Введите полное имя пациента")
-    age = st.number_input("Возраст (лет)", min_value=0, max_value=120, value=60, help="Возраст пациента в годах")
-    gender = st.selectbox("Пол", ["Мужской", "Женский", "Другой", "Предпочитаю не указывать"])
+    name = st.text_input("Полное имя", value=profile.name if profile else "",
+                         key=f"patient_name_{suffix}", placeholder="Введите полное имя пациента")
+    age = st.number_input("Возраст (лет)", min_value=0, max_value=120,
+                          value=profile.age if profile and profile.age is not None else 60,
+                          key=f"patient_age_{suffix}", help="Возраст пациента в годах")
+    gender = st.selectbox("Пол", genders, key=f"patient_gender_{suffix}",
+                          index=genders.index(profile.gender) if profile and profile.gender in genders else 0)
     st.markdown("<br>", unsafe_allow_html=True)
     st.markdown("<p style='color: #000000; font-weight: 600; font-size: 1.1rem; margin-bottom: 1rem;'>Медицинская история</p>", unsafe_allow_html=True)
     medical_history = st.text_area(
         "Медицинская история",
+        value=(profile.medical_history or "") if profile else "",
+        key=f"patient_history_{suffix}",
         placeholder="Предыдущие диагнозы, операции, хронические заболевания, медикаменты...",
         height=150,
         help="Включите соответствующую медицинскую историю, текущие медикаменты и известные заболевания"
@@ -40,8 +79,10 @@ with col1:
 
 with col2:
     st.markdown("<p style='color: #000000; font-weight: 600; font-size: 1.1rem; margin-bottom: 1rem;'>Физические измерения</p>", unsafe_allow_html=True)
-    weight = st.number_input("Вес (кг)", min_value=0.0, max_value=300.0, value=70.0, step=0.1)
-    height = st.number_input("Рост (см)", min_value=0.0, max_value=250.0, value=170.0, step=0.1)
+    weight = st.number_input("Вес (кг)", min_value=0.0, max_value=300.0, step=0.1, key=f"patient_weight_{suffix}",
+                             value=profile.weight_kg if profile and profile.weight_kg is not None else 70.0)
+    height = st.number_input("Рост (см)", min_value=0.0, max_value=250.0, step=0.1, key=f"patient_height_{suffix}",
+                             value=profile.height_cm if profile and profile.height_cm is not None else 170.0)
 
     # Calculate and display BMI with color coding
     bmi = weight / ((height / 100) ** 2) if height > 0 else 0
@@ -120,6 +161,16 @@ with col2:
         import datetime
         st.session_state.report_timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+        # Persist the profile; later diagnoses in this session are linked to it
+        if name.strip():
+            st.session_state.patient_id = store.save_patient(
+                name, patient_id=profile_id, age=int(age), gender=gender, weight_kg=float(weight),
+                height_cm=float(height), medical_history=medical_history or None
+            )
+            if profile_id is None:
+                # Select the new profile on the next run, so saving again updates it
+                st.session_state.created_patient_id = st.session_state.patient_id
+
 # Display generated report with modern design
 if st.session_state.report_generated:
     st.markdown("<br>", unsafe_allow_html=True)
@@ -171,6 +222,95 @@ if st.session_state.report_generated:
             use_container_width=True
         )
 
+    # PDF / HTML report with the latest diagnosis of this session (rendered once, then cached)
+    col1, col2, col3 = st.columns([1, 1, 1])
+    with col2:
+        report_format = st.radio("Формат отчета", ["PDF", "HTML"], horizontal=True)
+        if st.button("Подготовить полный отчет", use_container_width=True):
+            import report_engine
+            latest = st.session_state.get('report_diagnosis') or {}
+            views = latest.get('views')
+            # Stage 2/3 results are included only if they were produced for this diagnosis
+            analysis_matches = latest.get('key') is not None and st.session_state.get('analysis_key') == latest['key']
+            with st.spinner("Формирование отчета..."):
+                report_data = report_engine.ReportData(
+                    name=name, age=int(age), gender=gender, weight_kg=float(weight), height_cm=float(height),
+                    medical_history=medical_history or "",
+                    diagnosis=latest.get('diagnosis', ""), confidence=latest.get('confidence'),
+                    diagnosed_at=latest.get('diagnosed_at', ""),
+                    comparison_png=report_engine.comparison_png(*views) if views else None,
+                    brain_analysis=(st.session_state.get('brain_analysis_result') or "") if analysis_matches else "",
+                    recommendations=(st.session_state.get('recommendations_result') or "") if analysis_matches else "",
+                )
+                st.session_state.full_report = (report_format, report_engine.render(report_data, report_format.lower()))
+        if st.session_state.get('full_report'):
+            full_format, full_bytes = st.session_state.full_report
+            st.download_button(
+                label=f"Скачать отчет как {full_format}",
+                data=full_bytes,
+                file_name=f"otchet_pacienta_{name.replace(' ', '_')}.{full_format.lower()}",
+                mime="application/pdf" if full_format == "PDF" else "text/html",
+                use_container_width=True
+            )
+
+# Diagnosis history from the patient store (indexed lookup, no inference)
+st.markdown("<br>", unsafe_allow_html=True)
+st.markdown("""
+    <div style='background: white; border-radius: 20px; padding: 2rem; box-shadow: 0 10px 40px rgba(0,0,0,0.08); margin-bottom: 1rem; border: 1px solid #e0e0e0;'>
+        <h3 style='color: #000000; margin-bottom: 0; font-size: 1.3rem;'>
+            История обследований
+        </h3>
+    </div>
+""", unsafe_allow_html=True)
+
+search = st.text_input("Поиск пациента по имени", value=name, placeholder="Начните вводить имя")
+matches = store.find_patients(search) if search.strip() else []
+if matches:
+    patient = st.selectbox(
+        "Пациент",
+        matches,
+        format_func=lambda p: f"{p.name} · {p.age} лет · создан {p.created_at[:10]}"
+    )
+    # Keyset pagination: the cursors of the pages shown so far are kept per patient
+    cursors_key = f"history_cursors_{patient.id}"
+    cursors = st.session_state.setdefault(cursors_key, [None])
+    records = []
+    for cursor in cursors:
+        page = store.history(patient.id, limit=10, cursor=cursor)
+        records.extend(page.items)
+    if records:
+        st.dataframe(
+            [{
+                "Дата": record.created_at,
+                "Диагноз": record.class_name or record.predicted_class,
+                "Уверенность": f"{record.confidence:.1%}",
+                "Снимок": record.image_name or "",
+            } for record in records],
+            use_container_width=True,
+            hide_index=True
+        )
+        st.caption(f"Показано {len(records)} из {store.count_diagnoses(patient.id)}")
+
+        # Stored heatmaps are regenerated from the compact artifact at thumbnail size
+        with_heatmaps = [record for record in records if record.heatmap_ref]
+        if with_heatmaps:
+            import os
+            import heatmap_artifact
+            record = st.selectbox(
+                "Карта внимания снимка",
+                with_heatmaps,
+                format_func=lambda r: f"{r.created_at} · {r.class_name or r.predicted_class} · {r.image_name or ''}"
+            )
+            if os.path.exists(record.heatmap_ref):
+                st.image(heatmap_artifact.load(record.heatmap_ref).colorized((256, 256)), width=256)
+        if page.next_cursor is not None and st.button("Показать ещё"):
+            cursors.append(page.next_cursor)
+            st.rerun()
+    else:
+        st.info("Для этого пациента ещё нет сохранённых диагнозов.")
+elif search.strip():
+    st.info("Пациенты не найдены.")
+
 # Next steps info box
 st.markdown("<br><br>", unsafe_allow_html=True)
 
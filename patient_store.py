@@ -0,0 +1,418 @@
+"""
+Persistent Patient and Diagnosis Store
+
+Keeps patient profiles and their diagnosis results in a local SQLite
+database instead of a per-session report string, so a patient's past
+scans can be reviewed without re-running inference.
+
+- WAL journal: Streamlit sessions read while another one writes
+- Indexes on the normalized patient name, on (patient, date), on date and
+  on (predicted class, date); name search is a prefix range scan
+- Keyset-paged history queries (newest first), so later pages cost the
+  same as the first one
+- Bulk insert of diagnoses in one transaction for batch runs
+
+Each diagnosis stores the predicted class, confidence, the full probability
+vector (JSON), the preprocessed image hash and a heatmap reference.
+
+Environment:
+    REMIND_DB=path    Database file (default data/remind.sqlite3)
+
+Usage:
+    python patient_store.py bench --patients 2000 --scans 20
+    python patient_store.py history "Иванов"
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+
+DB_PATH = os.getenv("REMIND_DB", os.path.join("data", "remind.sqlite3"))
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    id              INTEGER PRIMARY KEY,
+    name            TEXT NOT NULL,
+    name_key        TEXT NOT NULL,
+    age             INTEGER,
+    gender          TEXT,
+    weight_kg       REAL,
+    height_cm       REAL,
+    medical_history TEXT,
+    created_at      TEXT NOT NULL,
+    updated_at      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_patients_name_key ON patients (name_key);
+
+CREATE TABLE IF NOT EXISTS diagnoses (
+    id              INTEGER PRIMARY KEY,
+    patient_id      INTEGER REFERENCES patients (id) ON DELETE CASCADE,
+    created_at      TEXT NOT NULL,
+    predicted_class INTEGER NOT NULL,
+    class_name      TEXT,
+    confidence      REAL NOT NULL,
+    probabilities   TEXT NOT NULL,
+    image_hash      TEXT,
+    image_name      TEXT,
+    heatmap_ref     TEXT,
+    source          TEXT NOT NULL DEFAULT 'app'
+);
+CREATE INDEX IF NOT EXISTS idx_diagnoses_patient_date ON diagnoses (patient_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_diagnoses_date ON diagnoses (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_diagnoses_class_date ON diagnoses (predicted_class, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_diagnoses_image_hash ON diagnoses (image_hash);
+"""
+
+_DIAGNOSIS_COLUMNS = ("patient_id", "created_at", "predicted_class", "class_name", "confidence",
+                      "probabilities", "image_hash", "image_name", "heatmap_ref", "source")
+
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def name_key(name):
+    """Normalized name used for indexed lookups (case- and whitespace-insensitive)."""
+    return " ".join(name.split()).casefold()
+
+
+@dataclass
+class Patient:
+    id: int
+    name: str
+    age: int
+    gender: str
+    weight_kg: float
+    height_cm: float
+    medical_history: str
+    created_at: str
+    updated_at: str
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(**{key: row[key] for key in cls.__dataclass_fields__})
+
+
+@dataclass
+class DiagnosisRecord:
+    id: int
+    patient_id: int
+    created_at: str
+    predicted_class: int
+    class_name: str
+    confidence: float
+    probabilities: list
+    image_hash: str
+    image_name: str
+    heatmap_ref: str
+    source: str
+
+    @classmethod
+    def from_row(cls, row):
+        values = {key: row[key] for key in cls.__dataclass_fields__}
+        values["probabilities"] = json.loads(values["probabilities"])
+        return cls(**values)
+
+
+@dataclass
+class Page:
+    """One page of results plus the cursor for the next (older) page, or None."""
+    items: list
+    next_cursor: tuple
+
+
+def connect(path=DB_PATH):
+    """Open a connection in WAL mode (connection pragmas only; no writes)."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=10.0)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")  # Durable across app crashes; fsync at checkpoints
+    connection.execute("PRAGMA foreign_keys=ON")
+    return connection
+
+
+def create_schema(path=DB_PATH):
+    """Create the tables and indexes if needed and stamp the schema version."""
+    connection = connect(path)
+    try:
+        with connection:
+            connection.executescript(_SCHEMA)
+            connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    finally:
+        connection.close()
+
+
+class PatientStore:
+    """
+    Patient registry backed by SQLite. One connection per thread, because
+    Streamlit serves each session from its own thread. The schema is created
+    once per store, so opening a thread's connection takes no write lock.
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        create_schema(path)
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = connect(self.path)
+        return connection
+
+    # Patients
+
+    def add_patient(self, name, age=None, gender=None, weight_kg=None, height_cm=None, medical_history=None):
+        """Insert a patient profile. Returns the patient ID."""
+        now = _now()
+        with self.connection as connection:
+            cursor = connection.execute(
+                "INSERT INTO patients (name, name_key, age, gender, weight_kg, height_cm, medical_history, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name.strip(), name_key(name), age, gender, weight_kg, height_cm, medical_history, now, now))
+        return cursor.lastrowid
+
+    def update_patient(self, patient_id, **fields):
+        """Update profile fields (name, age, gender, weight_kg, height_cm, medical_history)."""
+        allowed = {"name", "age", "gender", "weight_kg", "height_cm", "medical_history"}
+        unknown = set(fields) - allowed
+        if unknown:
+            raise ValueError(f"Unknown patient fields: {', '.join(sorted(unknown))}")
+        if "name" in fields:
+            fields["name_key"] = name_key(fields["name"])
+        fields["updated_at"] = _now()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self.connection as connection:
+            connection.execute(f"UPDATE patients SET {assignments} WHERE id = ?", (*fields.values(), patient_id))
+
+    def save_patient(self, name, patient_id=None, **fields):
+        """
+        Update the profile of patient_id, or insert a new patient when it is
+        None. Returns the patient ID. Patients are never matched by name, as
+        different people can share one.
+        """
+        if patient_id is None:
+            return self.add_patient(name, **fields)
+        self.update_patient(patient_id, name=name, **fields)
+        return patient_id
+
+    def get_patient(self, patient_id):
+        row = self.connection.execute("SELECT * FROM patients WHERE id = ?", (patient_id,)).fetchone()
+        return Patient.from_row(row) if row is not None else None
+
+    def find_patients(self, prefix="", limit=20):
+        """Patients whose normalized name starts with prefix (index range scan)."""
+        key = name_key(prefix)
+        # Every key starting with `key` sorts in [key, key + U+10FFFF)
+        rows = self.connection.execute(
+            "SELECT * FROM patients WHERE name_key >= ? AND name_key < ? ORDER BY name_key, id LIMIT ?",
+            (key, key + "\U0010ffff", limit)).fetchall()
+        return [Patient.from_row(row) for row in rows]
+
+    # Diagnoses
+
+    @staticmethod
+    def _diagnosis_values(patient_id, predicted_class, confidence, probabilities, class_name=None,
+                          image_hash=None, image_name=None, heatmap_ref=None, source="app", created_at=None):
+        return (patient_id, created_at or _now(), int(predicted_class), class_name, float(confidence),
+                json.dumps([round(float(p), 6) for p in probabilities]), image_hash, image_name, heatmap_ref,
+                source)
+
+    def add_diagnosis(self, patient_id, predicted_class, confidence, probabilities, **fields):
+        """
+        Record one diagnosis result.
+
+        Args:
+            patient_id: Patient ID (None for anonymous scans)
+            predicted_class: Class index
+            confidence: Probability of the predicted class (0-1)
+            probabilities: Probability per class
+            **fields: class_name, image_hash, image_name, heatmap_ref, source, created_at
+
+        Returns:
+            The diagnosis ID
+        """
+        values = self._diagnosis_values(patient_id, predicted_class, confidence, probabilities, **fields)
+        with self.connection as connection:
+            cursor = connection.execute(
+                f"INSERT INTO diagnoses ({', '.join(_DIAGNOSIS_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(_DIAGNOSIS_COLUMNS))})", values)
+        return cursor.lastrowid
+
+    def add_diagnoses(self, records):
+        """
+        Bulk insert in one transaction.
+
+        Args:
+            records: Iterable of dicts with the add_diagnosis arguments
+
+        Returns:
+            Number of rows inserted
+        """
+        rows = [self._diagnosis_values(**record) for record in records]
+        with self.connection as connection:
+            connection.executemany(
+                f"INSERT INTO diagnoses ({', '.join(_DIAGNOSIS_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(_DIAGNOSIS_COLUMNS))})", rows)
+        return len(rows)
+
+    def _page(self, where, params, limit, cursor):
+        if cursor is not None:
+            where += " AND (created_at, id) < (?, ?)"
+            params = (*params, *cursor)
+        rows = self.connection.execute(
+            f"SELECT * FROM diagnoses WHERE {where} ORDER BY created_at DESC, id DESC LIMIT ?",
+            (*params, limit + 1)).fetchall()
+        items = [DiagnosisRecord.from_row(row) for row in rows[:limit]]
+        next_cursor = (items[-1].created_at, items[-1].id) if len(rows) > limit else None
+        return Page(items, next_cursor)
+
+    def history(self, patient_id, limit=20, cursor=None):
+        """
+        A patient's diagnoses, newest first.
+
+        Args:
+            patient_id: Patient ID
+            limit: Page size
+            cursor: next_cursor of the previous page (None for the first page)
+
+        Returns:
+            Page of DiagnosisRecord
+        """
+        return self._page("patient_id = ?", (patient_id,), limit, cursor)
+
+    def by_class(self, predicted_class, since=None, until=None, limit=20, cursor=None):
+        """Diagnoses with a given predicted class in an optional date range, newest first."""
+        where, params = "predicted_class = ?", (int(predicted_class),)
+        if since is not None:
+            where, params = where + " AND created_at >= ?", (*params, since)
+        if until is not None:
+            where, params = where + " AND created_at < ?", (*params, until)
+        return self._page(where, params, limit, cursor)
+
+    def find_by_image(self, image_hash):
+        """Most recent diagnosis of an identical preprocessed image, if any."""
+        row = self.connection.execute(
+            "SELECT * FROM diagnoses WHERE image_hash = ? ORDER BY created_at DESC, id DESC LIMIT 1",
+            (image_hash,)).fetchone()
+        return DiagnosisRecord.from_row(row) if row is not None else None
+
+    def count_diagnoses(self, patient_id):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM diagnoses WHERE patient_id = ?", (patient_id,)).fetchone()[0]
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+@lru_cache(maxsize=None)
+def get_store(path=DB_PATH):
+    """Shared PatientStore, created once per process."""
+    return PatientStore(path)
+
+
+def benchmark(path, patients=2000, scans=20, seed=0):
+    """Bulk-load a throwaway database and time the indexed queries."""
+    import random
+
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} exists; the benchmark needs a fresh database")
+    store = PatientStore(path)
+    try:
+        _benchmark(store, patients, scans, rng)
+    finally:
+        store.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def _benchmark(store, patients, scans, rng):
+    start = time.perf_counter()
+    patient_ids = [store.add_patient(f"Пациент {i:05d}", age=rng.randint(50, 90)) for i in range(patients)]
+    base = datetime.datetime(2024, 1, 1)
+    records = []
+    for patient_id in patient_ids:
+        for _ in range(scans):
+            probabilities = [rng.random() for _ in range(4)]
+            total = sum(probabilities)
+            probabilities = [p / total for p in probabilities]
+            predicted = max(range(4), key=probabilities.__getitem__)
+            created = base + datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            records.append(dict(patient_id=patient_id, predicted_class=predicted,
+                                confidence=probabilities[predicted], probabilities=probabilities,
+                                source="batch", created_at=created.strftime("%Y-%m-%d %H:%M:%S")))
+    store.add_diagnoses(records)
+    load_s = time.perf_counter() - start
+
+    def timed(fn, repeats=200):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            result = fn()
+        return (time.perf_counter() - start) / repeats * 1000, result
+
+    target = patient_ids[patients // 2]
+    history_ms, first = timed(lambda: store.history(target, limit=10))
+    next_ms, _ = timed(lambda: store.history(target, limit=10, cursor=first.next_cursor))
+    class_ms, _ = timed(lambda: store.by_class(2, since="2024-06-01", limit=50))
+    name_ms, _ = timed(lambda: store.find_patients("пациент 0100"))
+
+    print(f"Loaded {patients} patients and {len(records)} diagnoses in {load_s:.2f} s")
+    print(f"history page 1: {history_ms:.3f} ms | page 2: {next_ms:.3f} ms | "
+          f"by class: {class_ms:.3f} ms | name prefix: {name_ms:.3f} ms")
+    for label, sql, params in (
+        ("history", "SELECT * FROM diagnoses WHERE patient_id = ? ORDER BY created_at DESC, id DESC LIMIT 11",
+         (target,)),
+        ("by class", "SELECT * FROM diagnoses WHERE predicted_class = ? AND created_at >= ? "
+         "ORDER BY created_at DESC, id DESC LIMIT 51", (2, "2024-06-01")),
+        ("name", "SELECT * FROM patients WHERE name_key >= ? AND name_key < ? ORDER BY name_key, id LIMIT 20",
+         ("a", "b")),
+    ):
+        plan = store.connection.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        print(f"  {label}: {'; '.join(row['detail'] for row in plan)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Patient / diagnosis store utilities")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bench = subparsers.add_parser("bench", help="Bulk-load a throwaway database and time queries")
+    bench.add_argument("--db", default=os.path.join(".cache", "patient_store_bench.sqlite3"))
+    bench.add_argument("--patients", type=int, default=2000)
+    bench.add_argument("--scans", type=int, default=20)
+
+    history = subparsers.add_parser("history", help="Print the diagnoses of patients matching a name prefix")
+    history.add_argument("name")
+    history.add_argument("--db", default=DB_PATH)
+    history.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        benchmark(args.db, args.patients, args.scans)
+    else:
+        store = PatientStore(args.db)
+        for patient in store.find_patients(args.name):
+            print(f"#{patient.id} {patient.name} ({store.count_diagnoses(patient.id)} diagnoses)")
+            for record in store.history(patient.id, limit=args.limit).items:
+                print(f"    {record.created_at}  {record.class_name or record.predicted_class}  "
+                      f"{record.confidence:.1%}  {record.image_name or ''}")
+
+
+if __name__ == "__main__":
+    main()
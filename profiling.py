@@ -0,0 +1,220 @@
+"""
+Per-Rerun Profiling for the Streamlit App
+
+Opt-in profiler that wraps every Streamlit rerun of app.py and attributes
+the time to the page that was shown. Two modes:
+
+- sample (default): a background thread samples the script thread's stack
+  every few milliseconds via sys._current_frames(). Low overhead; writes
+  collapsed-stack files that flamegraph.pl / speedscope / inferno read
+- cprofile: deterministic cProfile of the script thread; writes .prof files
+  for pstats / snakeviz (higher overhead, exact call counts)
+
+Output (REMIND_PROFILE_DIR, default .cache/profiles):
+    runs/<time>-<page>.collapsed | .prof   one file per rerun
+    <page>.collapsed                        samples merged over all reruns of a page
+    summary.json                            reruns, total / mean / max seconds per page
+
+Environment:
+    REMIND_PROFILE=sample|cprofile      Enable profiling ("1" means sample)
+    REMIND_PROFILE_INTERVAL_MS=5        Sampling interval
+    REMIND_PROFILE_DIR=.cache/profiles
+
+Usage:
+    REMIND_PROFILE=1 streamlit run app.py
+    python profiling.py                  # Print the per-page summary
+"""
+
+import argparse
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_DIR = ".cache/profiles"
+DEFAULT_INTERVAL_MS = 5.0
+
+_lock = threading.Lock()
+_active = {}            # script thread id -> RerunProfile
+_page_stacks = {}       # page -> Counter of collapsed stacks
+_page_stats = {}        # page -> {"reruns", "total_s", "max_s"}
+_sampler = None
+
+
+def mode():
+    """Profiling mode from REMIND_PROFILE: "sample", "cprofile" or None."""
+    value = os.getenv("REMIND_PROFILE", "").strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return None
+    return "cprofile" if value == "cprofile" else "sample"
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame):
+    """Collapsed-stack line (root first, ';'-separated) for a frame."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class RerunProfile:
+    """Profile of one rerun of the script thread."""
+
+    def __init__(self, thread_id, profile_mode):
+        self.thread_id = thread_id
+        self.mode = profile_mode
+        self.stacks = Counter()
+        self.start = time.perf_counter()
+        self.profiler = None
+        if profile_mode == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+
+class _Sampler(threading.Thread):
+    """Samples the stacks of all script threads with an active rerun profile."""
+
+    def __init__(self, interval):
+        super().__init__(name="remind-profiler", daemon=True)
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with _lock:
+                if not _active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, profile in _active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None and profile.mode == "sample":
+                        profile.stacks[collapse(frame)] += 1
+
+
+def _slug(page):
+    return re.sub(r"[^\w-]+", "_", page).strip("_") or "page"
+
+
+def begin_rerun():
+    """
+    Start profiling the current rerun (no-op unless REMIND_PROFILE is set).
+
+    A rerun that never reached end_rerun() (st.stop(), an exception or an
+    interrupted script) is closed here under the page "aborted".
+    """
+    global _sampler
+    profile_mode = mode()
+    if profile_mode is None:
+        return None
+
+    thread_id = threading.get_ident()
+    with _lock:
+        dangling = _active.get(thread_id)
+    if dangling is not None:
+        end_rerun("aborted")
+
+    if profile_mode == "sample" and _sampler is None:
+        interval = float(os.getenv("REMIND_PROFILE_INTERVAL_MS", DEFAULT_INTERVAL_MS)) / 1000
+        _sampler = _Sampler(interval)
+        _sampler.start()
+
+    profile = RerunProfile(thread_id, profile_mode)
+    with _lock:
+        _active[thread_id] = profile
+    return profile
+
+
+def end_rerun(page):
+    """
+    Stop profiling the current rerun and write its files under `page`.
+
+    Returns:
+        Rerun duration in seconds, or None when not profiling
+    """
+    thread_id = threading.get_ident()
+    with _lock:
+        profile = _active.pop(thread_id, None)
+    if profile is None:
+        return None
+    if profile.profiler is not None:
+        profile.profiler.disable()
+    elapsed = time.perf_counter() - profile.start
+
+    directory = os.getenv("REMIND_PROFILE_DIR", PROFILE_DIR)
+    runs_dir = os.path.join(directory, "runs")
+    os.makedirs(runs_dir, exist_ok=True)
+    slug = _slug(page)
+    run_base = os.path.join(runs_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(profile.start * 1000) % 1000:03d}-{slug}")
+
+    if profile.profiler is not None:
+        profile.profiler.dump_stats(run_base + ".prof")
+    else:
+        _write_collapsed(run_base + ".collapsed", profile.stacks)
+
+    with _lock:
+        stats = _page_stats.setdefault(page, {"reruns": 0, "total_s": 0.0, "max_s": 0.0})
+        stats["reruns"] += 1
+        stats["total_s"] += elapsed
+        stats["max_s"] = max(stats["max_s"], elapsed)
+        merged = _page_stacks.setdefault(page, Counter())
+        merged.update(profile.stacks)
+        summary = {name: dict(values, mean_s=values["total_s"] / values["reruns"])
+                   for name, values in _page_stats.items()}
+        if profile.stacks:
+            _write_collapsed(os.path.join(directory, f"{slug}.collapsed"), merged)
+
+    with open(os.path.join(directory, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    return elapsed
+
+
+def _write_collapsed(path, stacks):
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+def top_frames(path, limit=15):
+    """
+    Functions with the most self samples in a collapsed-stack file.
+
+    Returns:
+        list of (frame label, samples, share of all samples)
+    """
+    counts, total = Counter(), 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            counts[stack.rsplit(";", 1)[-1]] += int(count)
+            total += int(count)
+    return [(label, count, count / max(total, 1)) for label, count in counts.most_common(limit)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize per-rerun profiles of the Streamlit app")
+    parser.add_argument("--dir", default=os.getenv("REMIND_PROFILE_DIR", PROFILE_DIR))
+    parser.add_argument("--top", type=int, default=10, help="Hottest functions per page")
+    args = parser.parse_args()
+
+    with open(os.path.join(args.dir, "summary.json"), encoding="utf-8") as f:
+        summary = json.load(f)
+    for page, stats in sorted(summary.items(), key=lambda item: -item[1]["total_s"]):
+        print(f"{page}: {stats['reruns']} reruns, mean {stats['mean_s'] * 1000:.1f} ms, "
+              f"max {stats['max_s'] * 1000:.1f} ms, total {stats['total_s']:.2f} s")
+        collapsed = os.path.join(args.dir, f"{_slug(page)}.collapsed")
+        if os.path.exists(collapsed):
+            for label, count, share in top_frames(collapsed, args.top):
+                print(f"    {share:6.1%} {count:6d}  {label}")
+
+
+if __name__ == "__main__":
+    main()
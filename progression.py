@@ -0,0 +1,340 @@
+"""
+Longitudinal Progression Tracking
+
+Follows a patient's scans over time on top of the patient store:
+
+- Each scan keeps its CAM and, computed once when the scan is added, the
+  difference to the previous scan's CAM (new - previous, resized to a
+  common grid if needed)
+- Trend statistics per patient are running sums (scan count, time,
+  expected stage, per-class probabilities) updated in O(1) per new scan,
+  so older scans are never reloaded or recomputed
+- The expected stage is the probability-weighted disease stage
+  (0 = no impairment ... 3 = moderate); its least-squares slope over time
+  is the progression rate in stages per year
+
+Scans added out of chronological order trigger a rebuild of that
+patient's statistics from the stored rows.
+
+Charts are plain matplotlib Figures (no pyplot state), so they can be
+passed to st.pyplot from any session thread.
+
+Usage:
+    python progression.py show 12 --output-dir outputs
+"""
+
+import argparse
+import datetime
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+from patient_store import DB_PATH, PatientStore, get_store
+
+# Disease stage of each model class index, in the order of class_names in app.py
+# (Mild, Moderate, Non, Very mild)
+STAGE_BY_CLASS = (2, 3, 0, 1)
+STAGE_LABELS = ("Нет", "Очень легкое", "Легкое", "Умеренное")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scan_maps (
+    diagnosis_id INTEGER PRIMARY KEY REFERENCES diagnoses (id) ON DELETE CASCADE,
+    patient_id   INTEGER NOT NULL,
+    height       INTEGER NOT NULL,
+    width        INTEGER NOT NULL,
+    cam          BLOB NOT NULL,
+    diff         BLOB
+);
+CREATE INDEX IF NOT EXISTS idx_scan_maps_patient ON scan_maps (patient_id);
+
+CREATE TABLE IF NOT EXISTS patient_trends (
+    patient_id        INTEGER PRIMARY KEY REFERENCES patients (id) ON DELETE CASCADE,
+    scans             INTEGER NOT NULL,
+    first_at          TEXT NOT NULL,
+    last_at           TEXT NOT NULL,
+    last_diagnosis_id INTEGER,
+    last_stage        REAL NOT NULL,
+    previous_stage    REAL,
+    sum_t             REAL NOT NULL,
+    sum_tt            REAL NOT NULL,
+    sum_y             REAL NOT NULL,
+    sum_ty            REAL NOT NULL,
+    sum_probabilities TEXT NOT NULL
+);
+"""
+
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def expected_stage(probabilities, stages=STAGE_BY_CLASS):
+    """Probability-weighted disease stage (0-3)."""
+    return float(np.dot(np.asarray(probabilities, dtype=np.float64), stages))
+
+
+def _days_between(start, end):
+    delta = datetime.datetime.strptime(end, _TIME_FORMAT) - datetime.datetime.strptime(start, _TIME_FORMAT)
+    return delta.total_seconds() / 86400
+
+
+def _encode(cam):
+    return np.ascontiguousarray(cam, dtype=np.float16).tobytes()
+
+
+def _decode(blob, height, width):
+    return np.frombuffer(blob, dtype=np.float16).reshape(height, width).astype(np.float32)
+
+
+def _resize(cam, shape):
+    if cam.shape == shape:
+        return cam
+    import cv2
+    return cv2.resize(cam, (shape[1], shape[0]), interpolation=cv2.INTER_LINEAR)
+
+
+@dataclass
+class Trend:
+    """Progression summary of one patient."""
+    scans: int
+    first_at: str
+    last_at: str
+    stage: float                 # Expected stage of the latest scan
+    stage_change: float          # Versus the previous scan (None for a single scan)
+    slope_per_year: float        # Least-squares stage change per year (None until two distinct dates)
+    mean_probabilities: np.ndarray
+
+
+@dataclass
+class Series:
+    """All stored scans of a patient in chronological order (for charts)."""
+    diagnosis_ids: list
+    dates: list
+    probabilities: np.ndarray    # (scans, num_classes)
+    stages: np.ndarray           # (scans,)
+
+
+class ProgressionTracker:
+    """Per-patient CAM history and incrementally maintained trend statistics."""
+
+    def __init__(self, store):
+        self.store = store
+        with store.connection as connection:
+            connection.executescript(_SCHEMA)
+
+    @property
+    def connection(self):
+        return self.store.connection
+
+    def add_scan(self, patient_id, diagnosis_id, probabilities, cam, created_at):
+        """
+        Store a scan's CAM, its difference to the previous scan and update the trend.
+
+        Args:
+            patient_id: Patient ID
+            diagnosis_id: Row in the diagnoses table
+            probabilities: Probability per class
+            cam: CAM array (h, w) with values 0-1
+            created_at: Scan time as stored in the diagnoses table
+
+        Returns:
+            (Trend, difference heatmap or None for the first scan)
+        """
+        cam = np.asarray(cam, dtype=np.float32)
+        stage = expected_stage(probabilities)
+        with self.connection as connection:
+            row = connection.execute("SELECT * FROM patient_trends WHERE patient_id = ?", (patient_id,)).fetchone()
+            if row is not None and created_at < row["last_at"]:
+                connection.execute(
+                    "INSERT OR REPLACE INTO scan_maps (diagnosis_id, patient_id, height, width, cam) "
+                    "VALUES (?, ?, ?, ?, ?)", (diagnosis_id, patient_id, *cam.shape, _encode(cam)))
+                rebuilt = True
+            else:
+                rebuilt = False
+                diff = None
+                if row is not None:
+                    previous = connection.execute(
+                        "SELECT cam, height, width FROM scan_maps WHERE diagnosis_id = ?",
+                        (row["last_diagnosis_id"],)).fetchone()
+                    if previous is not None:
+                        diff = cam - _resize(_decode(previous["cam"], previous["height"], previous["width"]),
+                                             cam.shape)
+                connection.execute(
+                    "INSERT OR REPLACE INTO scan_maps (diagnosis_id, patient_id, height, width, cam, diff) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (diagnosis_id, patient_id, *cam.shape, _encode(cam),
+                     _encode(diff) if diff is not None else None))
+                self._accumulate(connection, row, patient_id, diagnosis_id, probabilities, stage, created_at)
+
+        if rebuilt:
+            # An older scan arrived late: recompute this patient's diffs and sums in order
+            return self.rebuild(patient_id), self.difference(diagnosis_id)
+        return self.trend(patient_id), diff
+
+    @staticmethod
+    def _accumulate(connection, row, patient_id, diagnosis_id, probabilities, stage, created_at):
+        probabilities = [float(p) for p in probabilities]
+        if row is None:
+            connection.execute(
+                "INSERT OR REPLACE INTO patient_trends (patient_id, scans, first_at, last_at, last_diagnosis_id, "
+                "last_stage, previous_stage, sum_t, sum_tt, sum_y, sum_ty, sum_probabilities) "
+                "VALUES (?, 1, ?, ?, ?, ?, NULL, 0, 0, ?, 0, ?)",
+                (patient_id, created_at, created_at, diagnosis_id, stage, stage, json.dumps(probabilities)))
+            return
+
+        t = _days_between(row["first_at"], created_at)
+        sum_probabilities = [a + b for a, b in zip(json.loads(row["sum_probabilities"]), probabilities)]
+        connection.execute(
+            "UPDATE patient_trends SET scans = scans + 1, last_at = ?, last_diagnosis_id = ?, "
+            "previous_stage = last_stage, last_stage = ?, sum_t = sum_t + ?, sum_tt = sum_tt + ?, "
+            "sum_y = sum_y + ?, sum_ty = sum_ty + ?, sum_probabilities = ? WHERE patient_id = ?",
+            (created_at, diagnosis_id, stage, t, t * t, stage, t * stage, json.dumps(sum_probabilities),
+             patient_id))
+
+    def trend(self, patient_id):
+        """Trend from the running sums (no scan rows are read). None without scans."""
+        row = self.connection.execute("SELECT * FROM patient_trends WHERE patient_id = ?", (patient_id,)).fetchone()
+        if row is None:
+            return None
+        n = row["scans"]
+        denominator = n * row["sum_tt"] - row["sum_t"] ** 2
+        slope = None
+        if n >= 2 and denominator > 1e-9:
+            slope = (n * row["sum_ty"] - row["sum_t"] * row["sum_y"]) / denominator * 365.25
+        previous = row["previous_stage"]
+        return Trend(
+            scans=n,
+            first_at=row["first_at"],
+            last_at=row["last_at"],
+            stage=row["last_stage"],
+            stage_change=row["last_stage"] - previous if previous is not None else None,
+            slope_per_year=slope,
+            mean_probabilities=np.asarray(json.loads(row["sum_probabilities"])) / n,
+        )
+
+    def difference(self, diagnosis_id):
+        """Stored difference heatmap of a scan against the previous one (None for the first scan)."""
+        row = self.connection.execute(
+            "SELECT diff, height, width FROM scan_maps WHERE diagnosis_id = ?", (diagnosis_id,)).fetchone()
+        if row is None or row["diff"] is None:
+            return None
+        return _decode(row["diff"], row["height"], row["width"])
+
+    def cam(self, diagnosis_id):
+        row = self.connection.execute(
+            "SELECT cam, height, width FROM scan_maps WHERE diagnosis_id = ?", (diagnosis_id,)).fetchone()
+        return _decode(row["cam"], row["height"], row["width"]) if row is not None else None
+
+    def series(self, patient_id):
+        """Probabilities and expected stages of all scans with a stored CAM, oldest first."""
+        rows = self.connection.execute(
+            "SELECT d.id, d.created_at, d.probabilities FROM diagnoses d "
+            "JOIN scan_maps m ON m.diagnosis_id = d.id "
+            "WHERE d.patient_id = ? ORDER BY d.created_at, d.id", (patient_id,)).fetchall()
+        probabilities = np.array([json.loads(row["probabilities"]) for row in rows], dtype=np.float64)
+        return Series(
+            diagnosis_ids=[row["id"] for row in rows],
+            dates=[row["created_at"] for row in rows],
+            probabilities=probabilities,
+            stages=probabilities @ np.asarray(STAGE_BY_CLASS, dtype=np.float64) if len(rows) else np.zeros(0),
+        )
+
+    def rebuild(self, patient_id):
+        """Recompute a patient's differences and running sums from the stored scans."""
+        series = self.series(patient_id)
+        with self.connection as connection:
+            connection.execute("DELETE FROM patient_trends WHERE patient_id = ?", (patient_id,))
+            row, previous = None, None
+            for diagnosis_id, created_at, probabilities in zip(series.diagnosis_ids, series.dates,
+                                                               series.probabilities):
+                cam = self.cam(diagnosis_id)
+                diff = cam - _resize(previous, cam.shape) if previous is not None else None
+                connection.execute("UPDATE scan_maps SET diff = ? WHERE diagnosis_id = ?",
+                                   (_encode(diff) if diff is not None else None, diagnosis_id))
+                self._accumulate(connection, row, patient_id, diagnosis_id, probabilities,
+                                 expected_stage(probabilities), created_at)
+                row = connection.execute("SELECT * FROM patient_trends WHERE patient_id = ?",
+                                         (patient_id,)).fetchone()
+                previous = cam
+        return self.trend(patient_id)
+
+
+@lru_cache(maxsize=None)
+def get_tracker(path=DB_PATH):
+    """Shared ProgressionTracker on the shared PatientStore, created once per process."""
+    return ProgressionTracker(get_store(path))
+
+
+def plot_trend(series, class_names):
+    """Expected stage and class probabilities over time as a matplotlib Figure."""
+    from matplotlib.figure import Figure
+
+    dates = [datetime.datetime.strptime(date, _TIME_FORMAT) for date in series.dates]
+    fig = Figure(figsize=(8, 6))
+    stage_ax, probability_ax = fig.subplots(2, 1, sharex=True)
+
+    stage_ax.plot(dates, series.stages, marker="o", color="black")
+    stage_ax.set_ylim(-0.1, 3.1)
+    stage_ax.set_yticks(range(4), STAGE_LABELS)
+    stage_ax.set_ylabel("Стадия")
+    stage_ax.grid(alpha=0.3)
+
+    for index, name in enumerate(class_names):
+        probability_ax.plot(dates, series.probabilities[:, index], marker=".", label=name)
+    probability_ax.set_ylim(0, 1)
+    probability_ax.set_ylabel("Вероятность")
+    probability_ax.legend(fontsize="small", loc="upper left")
+    probability_ax.grid(alpha=0.3)
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    return fig
+
+
+def plot_difference(diff, title="Изменение карты внимания"):
+    """Signed CAM difference (red = more attention than the previous scan) as a Figure."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(4, 4))
+    ax = fig.subplots()
+    limit = max(float(np.abs(diff).max()), 1e-6)
+    image = ax.imshow(diff, cmap="RdBu_r", vmin=-limit, vmax=limit)
+    ax.set_title(title)
+    ax.axis("off")
+    fig.colorbar(image, ax=ax, fraction=0.046, pad=0.04)
+    fig.tight_layout()
+    return fig
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show a patient's progression")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    show = subparsers.add_parser("show", help="Print the trend and save the charts")
+    show.add_argument("patient_id", type=int)
+    show.add_argument("--db", default=DB_PATH)
+    show.add_argument("--output-dir", default="outputs")
+    show.add_argument("--rebuild", action="store_true", help="Recompute the statistics from the stored scans")
+    args = parser.parse_args()
+
+    tracker = ProgressionTracker(PatientStore(args.db))
+    trend = tracker.rebuild(args.patient_id) if args.rebuild else tracker.trend(args.patient_id)
+    if trend is None:
+        print(f"No scans with stored CAMs for patient {args.patient_id}")
+        return
+    print(f"{trend.scans} scans {trend.first_at} -> {trend.last_at} | stage {trend.stage:.2f}"
+          + (f" ({trend.stage_change:+.2f} vs previous)" if trend.stage_change is not None else "")
+          + (f" | {trend.slope_per_year:+.2f} stages/year" if trend.slope_per_year is not None else ""))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    series = tracker.series(args.patient_id)
+    class_names = ['Легкое нарушение', 'Умеренное нарушение', 'Нет нарушений', 'Очень легкое нарушение']
+    plot_trend(series, class_names).savefig(os.path.join(args.output_dir, f"progression_{args.patient_id}.png"),
+                                             dpi=150)
+    diff = tracker.difference(series.diagnosis_ids[-1])
+    if diff is not None:
+        plot_difference(diff).savefig(os.path.join(args.output_dir, f"progression_{args.patient_id}_diff.png"),
+                                      dpi=150)
+
+
+if __name__ == "__main__":
+    main()
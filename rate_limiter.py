@@ -0,0 +1,264 @@
+"""
+Shared Concurrency / Rate Limiter for External LLM Calls
+
+Every Streamlit session runs in the same process, so without a limit a
+burst of users fires as many Pixtral and Gemini calls as there are
+sessions, runs into the providers' rate limits and slows everybody down.
+All outgoing calls now pass through one limiter per provider:
+
+- A concurrency limit (in-flight calls) adjusted AIMD-style: +1 per
+  `limit` successful calls while the limit is saturated, halved on a
+  429 / quota error (at most once per cooldown window, later 429s in the
+  window cap it at the calls in flight), between min_limit and max_limit
+- An optional token bucket capping requests per second (with a burst)
+- Priority classes: validation (on the upload path) is served before
+  regional analysis / recommendations, which are served before chat;
+  equal priorities are first come, first served
+- Queue time per provider and class is recorded in tracing.metrics
+  (llm_queue_<provider>_<class>), next to counters of throttled calls
+
+A caller that cannot get a slot within its timeout gets LimiterTimeout.
+
+Environment (per provider, PIXTRAL or GEMINI):
+    REMIND_<PROVIDER>_CONCURRENCY=4    Initial in-flight limit
+    REMIND_<PROVIDER>_MAX_CONCURRENCY  Upper bound for the adaptive limit (default 4x initial)
+    REMIND_<PROVIDER>_RPS              Requests per second (unset = no rate cap)
+
+Usage:
+    python llm_stub_server.py --port 8765 --capacity 3 &
+    python rate_limiter.py bench --endpoint http://127.0.0.1:8765/v1/chat/completions
+"""
+
+import argparse
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+import tracing
+
+PRIORITIES = {
+    "validation": 0,
+    "analysis": 1,
+    "recommendations": 1,
+    "chat": 2,
+}
+
+
+class LimiterTimeout(TimeoutError):
+    """No slot became available within the caller's timeout."""
+
+
+def is_throttled(error_or_status):
+    """Whether an HTTP status or a client exception means the provider is rate limiting us."""
+    if isinstance(error_or_status, int):
+        return error_or_status == 429
+    if getattr(error_or_status, "code", None) == 429:
+        return True
+    # google.api_core.exceptions.ResourceExhausted / TooManyRequests without importing google
+    return type(error_or_status).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+class AdaptiveLimiter:
+    """
+    Priority-ordered concurrency limit with AIMD adaptation and an optional token bucket.
+
+    Usage:
+        with limiter.slot("validation") as slot:
+            response = post(...)
+            slot.record(response.status_code)
+    """
+
+    def __init__(self, name, limit=4, min_limit=1, max_limit=None, rate=None, burst=None,
+                 cooldown=1.0):
+        self.name = name
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit or limit * 4
+        self.rate = rate
+        self.burst = burst or (max(1.0, rate) if rate else None)
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.throttled = 0
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._last_decrease = float("-inf")
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        if self.rate is None:
+            return
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _wait_time(self, now):
+        """Seconds until the head waiter may go, 0 if it may go now, None if a release is needed."""
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.rate is None:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def acquire(self, priority="chat", timeout=None):
+        """
+        Wait for a slot.
+
+        Args:
+            priority: Class name from PRIORITIES (or an int, lower first)
+            timeout: Maximum seconds to wait (None = no limit)
+
+        Returns:
+            Seconds spent waiting
+        """
+        rank = PRIORITIES.get(priority, priority) if isinstance(priority, str) else priority
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        entry = (rank, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(now) if self._waiters[0] == entry else None
+                    if wait == 0.0:
+                        break
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            raise LimiterTimeout(f"No {self.name} slot within {timeout:.1f} s")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._condition.wait(wait)
+                heapq.heappop(self._waiters)
+                self.in_flight += 1
+                if self.rate is not None:
+                    self._tokens -= 1
+            except BaseException:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                raise
+            finally:
+                # The head may have changed; let the next waiter re-check
+                self._condition.notify_all()
+
+        waited = time.monotonic() - start
+        if isinstance(priority, str):
+            tracing.metrics.observe(f"llm_queue_{self.name}_{priority}", waited)
+        return waited
+
+    def release(self, throttled=False):
+        """Free a slot; a throttled call halves the limit, a successful one at the limit grows it by 1/limit."""
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.throttled += 1
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+                else:
+                    # Already decreased in this window: admit no more than what is in flight now
+                    self.limit = max(self.min_limit, min(self.limit, self.in_flight))
+            elif self.in_flight + 1 >= int(self.limit):
+                # Only grow a limit that is actually in use
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+        if throttled:
+            tracing.metrics.increment("remind_llm_throttled_total", {"provider": self.name})
+
+    @contextmanager
+    def slot(self, priority="chat", timeout=None):
+        """Hold a slot for one call; the call's outcome is reported with slot.record()."""
+        self.acquire(priority, timeout)
+        outcome = _Outcome()
+        try:
+            yield outcome
+        except Exception as e:
+            outcome.record(e)
+            raise
+        finally:
+            self.release(outcome.throttled)
+
+    def snapshot(self):
+        with self._condition:
+            return {"limit": round(self.limit, 2), "in_flight": self.in_flight,
+                    "waiting": len(self._waiters), "throttled": self.throttled}
+
+
+class _Outcome:
+    throttled = False
+
+    def record(self, error_or_status):
+        self.throttled = self.throttled or is_throttled(error_or_status)
+
+
+def _env_number(name, default, cast=float):
+    value = os.getenv(name, "").strip()
+    return cast(value) if value else default
+
+
+@lru_cache(maxsize=None)
+def get_limiter(provider):
+    """Process-wide limiter for 'pixtral' or 'gemini', configured from the environment."""
+    prefix = f"REMIND_{provider.upper()}_"
+    limit = _env_number(prefix + "CONCURRENCY", 4, int)
+    return AdaptiveLimiter(
+        provider,
+        limit=limit,
+        max_limit=_env_number(prefix + "MAX_CONCURRENCY", limit * 4, int),
+        rate=_env_number(prefix + "RPS", None),
+    )
+
+
+def main():
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+
+    parser = argparse.ArgumentParser(description="Burst of Pixtral calls against an endpoint (use llm_stub_server.py)")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--endpoint", default="http://127.0.0.1:8765/v1/chat/completions")
+    parser.add_argument("--calls", type=int, default=60)
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent callers")
+    parser.add_argument("--limit", type=int, default=8, help="Initial concurrency limit")
+    parser.add_argument("--no-limit", action="store_true", help="Bypass the limiter")
+    args = parser.parse_args()
+
+    os.environ["PIXTRAL_ENDPOINT"] = args.endpoint
+    os.environ.setdefault("PIXTRAL_API_KEY", "stub")    # the stub server ignores the key
+    os.environ["REMIND_PIXTRAL_CONCURRENCY"] = str(args.limit)
+    import llm_clients
+
+    limiter = llm_clients.get_limiter("pixtral")    # this file runs as __main__; use the imported module's limiter
+    classes = [random.choice(list(PRIORITIES)) for _ in range(args.calls)]
+    payload = {"model": llm_clients.PIXTRAL_MODEL, "messages": [{"role": "user", "content": "ping"}]}
+
+    def call(priority):
+        start = time.perf_counter()
+        if args.no_limit:
+            status = llm_clients.http_session().post(args.endpoint, json=payload, timeout=30).status_code
+        else:
+            status = llm_clients.post_pixtral(payload, timeout=30, priority=priority).status_code
+        return priority, status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.sessions) as pool:
+        results = list(pool.map(call, classes))
+    elapsed = time.perf_counter() - start
+
+    failed = sum(status != 200 for _, status, _ in results)
+    print(f"{args.calls} calls from {args.sessions} sessions in {elapsed:.2f} s, non-200: {failed}"
+          + ("" if args.no_limit else f", limiter {limiter.snapshot()}"))
+    for priority in PRIORITIES:
+        latencies = sorted(latency for cls, _, latency in results if cls == priority)
+        if latencies:
+            print(f"  {priority:<16} n={len(latencies):<3} p50={latencies[len(latencies) // 2] * 1000:6.0f} ms "
+                  f"max={latencies[-1] * 1000:6.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+"""
+Patient Report Engine (PDF / HTML)
+
+Renders per-patient reports with the diagnosis, the Grad-CAM comparison
+image, the regional analysis and the recommendations:
+
+- HTML from templates/report.html, a string.Template loaded and parsed
+  once per process
+- PDF laid out with matplotlib's PDF backend (no extra dependency); the
+  bundled DejaVu Sans font covers Cyrillic text
+- Renders are cached by content hash, in memory and on disk
+  (.cache/reports), so re-downloading or re-running a batch is a file read
+- Batches render in a process pool whose workers load the templates and
+  matplotlib once in their initializer; reports already in the cache are
+  not sent to the pool at all
+
+Usage:
+    python report_engine.py bench --count 64 --workers 4
+    python report_engine.py store --format pdf --output-dir outputs/reports
+"""
+
+import argparse
+import base64
+import datetime
+import hashlib
+import html
+import io
+import json
+import os
+import re
+import textwrap
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from string import Template
+
+TEMPLATE_DIR = "templates"
+CACHE_DIR = os.path.join(".cache", "reports")
+FORMATS = ("pdf", "html")
+MEMORY_CACHE_SIZE = 32
+# Smallest batch worth a process pool (worker start-up vs. render time per report)
+POOL_MIN_REPORTS = {"pdf": 2, "html": 500}
+
+# A4 portrait, in inches
+PAGE_SIZE = (8.27, 11.69)
+MARGIN = 0.8
+WRAP_CHARS = 92
+
+_memory_cache = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class ReportData:
+    """Everything a report shows. Text fields may contain simple markdown."""
+    name: str
+    age: int = None
+    gender: str = ""
+    weight_kg: float = None
+    height_cm: float = None
+    medical_history: str = ""
+    diagnosis: str = ""
+    confidence: float = None         # 0-1
+    diagnosed_at: str = ""
+    comparison_png: bytes = None     # e.g. gradcam.create_comparison_image saved as PNG
+    brain_analysis: str = ""
+    recommendations: str = ""
+
+    @property
+    def bmi(self):
+        if not self.weight_kg or not self.height_cm:
+            return None
+        return self.weight_kg / (self.height_cm / 100) ** 2
+
+    def cache_key(self, fmt):
+        """Content hash of the report in one format."""
+        fields = asdict(self)
+        image = fields.pop("comparison_png")
+        digest = hashlib.blake2b(json.dumps(fields, sort_keys=True, default=str).encode("utf-8"), digest_size=16)
+        digest.update(image or b"")
+        digest.update(fmt.encode())
+        return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def template(name="report.html"):
+    """Template loaded and parsed once per process."""
+    with open(os.path.join(TEMPLATE_DIR, name), encoding="utf-8") as f:
+        compiled = Template(f.read())
+    compiled.get_identifiers()  # Parse the placeholders now instead of on the first render
+    return compiled
+
+
+def _plain(text):
+    """Markdown markers stripped for the PDF text flow."""
+    text = re.sub(r"\*\*(.+?)\*\*", r"\1", text or "")
+    text = re.sub(r"^#{1,6}\s*", "", text, flags=re.MULTILINE)
+    return re.sub(r"^[\-\*]\s+", "• ", text, flags=re.MULTILINE)
+
+
+def _markdown_html(text):
+    """Escaped text with bold, headers, bullets and line breaks as HTML."""
+    text = html.escape(text or "")
+    text = re.sub(r"^#{1,6}\s*(.+)$", r"<strong>\1</strong>", text, flags=re.MULTILINE)
+    text = re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", text)
+    text = re.sub(r"^[\-\*•]\s+(.+)$", r"• \1", text, flags=re.MULTILINE)
+    return text.replace("\n", "<br>")
+
+
+def _fields(data):
+    bmi = data.bmi
+    return {
+        "name": data.name,
+        "age": f"{data.age} лет" if data.age is not None else "Н/Д",
+        "gender": data.gender or "Н/Д",
+        "weight": f"{data.weight_kg} кг" if data.weight_kg else "Н/Д",
+        "height": f"{data.height_cm} см" if data.height_cm else "Н/Д",
+        "bmi": f"{bmi:.1f}" if bmi is not None else "Н/Д",
+        "medical_history": data.medical_history or "Медицинская история не предоставлена",
+        "diagnosis": data.diagnosis or "Диагностика не проводилась",
+        "confidence": f"{data.confidence:.1%}" if data.confidence is not None else "Н/Д",
+        "diagnosed_at": data.diagnosed_at or "",
+        "brain_analysis": data.brain_analysis or "Не выполнялся",
+        "recommendations": data.recommendations or "Не сформированы",
+        "generated_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def render_html(data):
+    """Report as a self-contained HTML document (bytes, UTF-8)."""
+    fields = {key: html.escape(value) for key, value in _fields(data).items()}
+    fields["brain_analysis"] = _markdown_html(data.brain_analysis) or fields["brain_analysis"]
+    fields["recommendations"] = _markdown_html(data.recommendations) or fields["recommendations"]
+    fields["comparison"] = (
+        f'<p><img class="comparison" alt="Grad-CAM" '
+        f'src="data:image/png;base64,{base64.b64encode(data.comparison_png).decode()}"></p>'
+        if data.comparison_png else "")
+    return template("report.html").substitute(fields).encode("utf-8")
+
+
+def _pdf_blocks(data):
+    """Report content as (style, content) blocks in reading order."""
+    fields = _fields(data)
+    blocks = [("title", "Медицинский отчет пациента"), ("heading", "Личная информация")]
+    for label, key in (("Полное имя", "name"), ("Возраст", "age"), ("Пол", "gender"),
+                       ("Вес", "weight"), ("Рост", "height"), ("ИМТ", "bmi")):
+        blocks.append(("text", f"{label}: {fields[key]}"))
+    blocks += [("heading", "Медицинская история"), ("text", fields["medical_history"]),
+               ("heading", "Диагноз"),
+               ("strong", f"{fields['diagnosis']} · уверенность {fields['confidence']} · {fields['diagnosed_at']}")]
+    if data.comparison_png:
+        blocks.append(("image", data.comparison_png))
+    blocks += [("heading", "Региональный анализ"), ("text", _plain(fields["brain_analysis"])),
+               ("heading", "Рекомендации"), ("text", _plain(fields["recommendations"])),
+               ("small", f"Отчет сгенерирован: {fields['generated_at']} · ReMind.AI. "
+                         "Результаты ИИ не заменяют консультацию врача.")]
+    return blocks
+
+
+# style -> (font size in points, weight, line height in inches, space before in inches)
+_STYLES = {
+    "title": (16, "bold", 0.32, 0.0),
+    "heading": (12, "bold", 0.24, 0.18),
+    "strong": (10.5, "bold", 0.2, 0.0),
+    "text": (10, "normal", 0.18, 0.0),
+    "small": (8, "normal", 0.15, 0.25),
+}
+
+
+def render_pdf(data):
+    """Report as PDF bytes, paginated on A4."""
+    import numpy as np
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
+    from PIL import Image
+
+    width, height = PAGE_SIZE
+    buffer = io.BytesIO()
+    with PdfPages(buffer, metadata={"Title": f"Report {data.name}", "CreationDate": None}) as pdf:
+        fig, y = None, 0.0
+
+        def new_page():
+            nonlocal fig, y
+            if fig is not None:
+                pdf.savefig(fig)
+            fig = Figure(figsize=PAGE_SIZE)
+            y = height - MARGIN
+
+        new_page()
+        for style, content in _pdf_blocks(data):
+            if style == "image":
+                image = np.asarray(Image.open(io.BytesIO(content)).convert("RGB"))
+                image_width = width - 2 * MARGIN
+                image_height = image_width * image.shape[0] / image.shape[1]
+                if y - image_height < MARGIN:
+                    new_page()
+                y -= image_height + 0.1
+                ax = fig.add_axes((MARGIN / width, y / height, image_width / width, image_height / height))
+                ax.imshow(image)
+                ax.axis("off")
+                continue
+
+            size, weight, line_height, space = _STYLES[style]
+            y -= space
+            wrap = int(WRAP_CHARS * 10 / size)
+            lines = [line for paragraph in content.split("\n")
+                     for line in (textwrap.wrap(paragraph, wrap) or [""])]
+            # One Text artist per block and page: layout cost is per artist, not per line
+            while lines:
+                fits = int((y - MARGIN) // line_height)
+                if fits < 1:
+                    new_page()
+                    continue
+                chunk, lines = lines[:fits], lines[fits:]
+                fig.text(MARGIN / width, y / height, "\n".join(chunk), fontsize=size, fontweight=weight,
+                         family="DejaVu Sans", va="top", linespacing=line_height * 72 / (size * 1.2))
+                y -= len(chunk) * line_height
+        pdf.savefig(fig)
+    return buffer.getvalue()
+
+
+_RENDERERS = {"pdf": render_pdf, "html": render_html}
+
+
+def render(data, fmt="pdf", cache_dir=CACHE_DIR):
+    """
+    Render one report, reusing a cached render of identical content.
+
+    Args:
+        data: ReportData
+        fmt: "pdf" or "html"
+        cache_dir: Disk cache directory (None disables the disk cache)
+
+    Returns:
+        bytes
+    """
+    if fmt not in _RENDERERS:
+        raise ValueError(f"Unknown report format '{fmt}'. Available: {', '.join(FORMATS)}")
+    key = data.cache_key(fmt)
+    path = os.path.join(cache_dir, f"{key}.{fmt}") if cache_dir else None
+    with _memory_lock:
+        cached = _memory_cache.get(key)
+        if cached is not None:
+            _memory_cache.move_to_end(key)
+    if cached is not None:
+        # The disk cache may be another directory (or emptied): callers rely on the file existing
+        if path and not os.path.exists(path):
+            _write(path, cached)
+        return cached
+
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            output = f.read()
+    else:
+        output = _RENDERERS[fmt](data)
+        if path:
+            _write(path, output)
+
+    with _memory_lock:
+        _memory_cache[key] = output
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+    return output
+
+
+def _write(path, output):
+    """Write a render atomically (a concurrent reader never sees a partial file)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial = f"{path}.{os.getpid()}.partial"
+    with open(partial, "wb") as f:
+        f.write(output)
+    os.replace(partial, path)
+
+
+def _init_worker(fmt):
+    """Pool initializer: parse the template, and for PDF load matplotlib and its fonts, once per worker."""
+    template("report.html")
+    if fmt == "pdf":
+        render_pdf(ReportData(name="warmup"))
+
+
+def _render_to_file(data, fmt, cache_dir):
+    render(data, fmt, cache_dir)
+    return os.path.join(cache_dir, f"{data.cache_key(fmt)}.{fmt}")
+
+
+def render_many(reports, fmt="pdf", workers=None, cache_dir=CACHE_DIR):
+    """
+    Render a batch of reports in a process pool.
+
+    Reports whose render is already in the disk cache are not submitted.
+    Workers write to the cache and return paths, so large PDFs are not
+    pickled back to the parent. Batches smaller than POOL_MIN_REPORTS[fmt]
+    render in this process: HTML is a template substitution, cheaper than
+    starting workers.
+
+    Args:
+        reports: Sequence of ReportData
+        fmt: "pdf" or "html"
+        workers: Pool size (default: CPU count)
+        cache_dir: Disk cache directory shared with the workers
+
+    Returns:
+        list of file paths in the order of `reports`
+    """
+    paths = [os.path.join(cache_dir, f"{data.cache_key(fmt)}.{fmt}") for data in reports]
+    pending = [i for i, path in enumerate(paths) if not os.path.exists(path)]
+    # Identical reports in one batch are rendered once
+    unique = list({paths[i]: i for i in pending}.values())
+    if unique:
+        os.makedirs(cache_dir, exist_ok=True)
+        workers = min(workers or os.cpu_count() or 1, len(unique))
+        if workers == 1 or len(unique) < POOL_MIN_REPORTS[fmt]:
+            for i in unique:
+                _render_to_file(reports[i], fmt, cache_dir)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(fmt,)) as pool:
+                list(pool.map(_render_to_file, [reports[i] for i in unique], [fmt] * len(unique),
+                              [cache_dir] * len(unique), chunksize=max(1, len(unique) // (workers * 4))))
+    return paths
+
+
+def comparison_png(original, heatmap, overlayed):
+    """gradcam.create_comparison_image as PNG bytes, ready for ReportData."""
+    from gradcam import create_comparison_image
+
+    buffer = io.BytesIO()
+    create_comparison_image(original, heatmap, overlayed).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def reports_from_store(store, limit=100):
+    """
+    (patient ID, ReportData) for the latest diagnosis of each patient in the patient store.
+
+    The stored heatmap artifact is rendered as the comparison image (the
+    original scans are not kept in the store). The ID tells apart patients
+    who share a name.
+    """
+    import heatmap_artifact
+    from PIL import Image
+
+    reports = []
+    for patient in store.find_patients("", limit=limit):
+        page = store.history(patient.id, limit=1)
+        record = page.items[0] if page.items else None
+        image = None
+        if record is not None and record.heatmap_ref and os.path.exists(record.heatmap_ref):
+            buffer = io.BytesIO()
+            Image.fromarray(heatmap_artifact.load(record.heatmap_ref).colorized((256, 256))).save(buffer, "PNG")
+            image = buffer.getvalue()
+        reports.append((patient.id, ReportData(
+            name=patient.name, age=patient.age, gender=patient.gender or "", weight_kg=patient.weight_kg,
+            height_cm=patient.height_cm, medical_history=patient.medical_history or "",
+            diagnosis=(record.class_name or str(record.predicted_class)) if record else "",
+            confidence=record.confidence if record else None,
+            diagnosed_at=record.created_at if record else "",
+            comparison_png=image,
+        )))
+    return reports
+
+
+def _bench_reports(count):
+    """Distinct synthetic reports sharing a few real comparison images."""
+    import glob
+
+    from PIL import Image
+
+    from gradcam import generate_gradcam_visualization
+    from model_arch import load_pretrained
+    from mri_dataset import preprocess_image
+
+    model = load_pretrained()
+    images = []
+    for path in sorted(glob.glob(os.path.join("Sample Testing Images", "**", "*.jpg"), recursive=True))[:4]:
+        image = Image.open(path).convert("RGB")
+        views = generate_gradcam_visualization(model, preprocess_image(image), image, list("0123"))
+        images.append(comparison_png(views["original"], views["heatmap_only"], views["overlayed"]))
+
+    analysis = "**Гиппокамп:** умеренная атрофия.\n- Височные доли: признаки изменений\n" * 4
+    return [ReportData(name=f"Пациент {i:04d}", age=60 + i % 30, gender="Женский", weight_kg=70.0,
+                       height_cm=168.0, medical_history="Гипертензия, наблюдение с 2019 года.",
+                       diagnosis="Очень легкое нарушение", confidence=0.9 - (i % 10) / 100,
+                       diagnosed_at="2025-01-15 10:30:00", comparison_png=images[i % len(images)] if images else None,
+                       brain_analysis=analysis, recommendations=analysis)
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render patient reports in bulk")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bench = subparsers.add_parser("bench", help="Throughput on synthetic reports (cold, then cached)")
+    bench.add_argument("--count", type=int, default=64)
+    bench.add_argument("--workers", type=int, default=None)
+    bench.add_argument("--format", choices=FORMATS, default="pdf")
+
+    store = subparsers.add_parser("store", help="Latest report of every patient in the patient store")
+    store.add_argument("--limit", type=int, default=100)
+    store.add_argument("--workers", type=int, default=None)
+    store.add_argument("--format", choices=FORMATS, default="pdf")
+    store.add_argument("--output-dir", default=os.path.join("outputs", "reports"))
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        import shutil
+        import tempfile
+
+        reports = _bench_reports(args.count)
+        cache_dir = tempfile.mkdtemp(prefix="remind-reports-")
+        try:
+            for label, workers in (("1 process", 1), (f"{args.workers or os.cpu_count()} processes", args.workers)):
+                shutil.rmtree(cache_dir)
+                with _memory_lock:
+                    _memory_cache.clear()    # Forked workers would inherit the previous run's renders
+                start = time.perf_counter()
+                render_many(reports, args.format, workers=workers, cache_dir=cache_dir)
+                elapsed = time.perf_counter() - start
+                print(f"{label}: {len(reports)} {args.format} reports in {elapsed:.2f} s "
+                      f"({len(reports) / elapsed:.1f} reports/s)")
+            start = time.perf_counter()
+            paths = render_many(reports, args.format, cache_dir=cache_dir)
+            elapsed = time.perf_counter() - start
+            size = sum(os.path.getsize(path) for path in paths) / len(paths)
+            print(f"cached: {elapsed * 1000:.1f} ms for the batch | {size / 1024:.0f} KB per report")
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        return
+
+    from patient_store import get_store
+
+    entries = reports_from_store(get_store(), args.limit)
+    reports = [data for _, data in entries]
+    start = time.perf_counter()
+    paths = render_many(reports, args.format, workers=args.workers)
+    os.makedirs(args.output_dir, exist_ok=True)
+    for (patient_id, data), path in zip(entries, paths):
+        safe_name = re.sub(r"[^\w\-]+", "_", data.name).strip("_") or "patient"
+        target_path = os.path.join(args.output_dir, f"otchet_{patient_id}_{safe_name}.{args.format}")
+        with open(path, "rb") as source, open(target_path, "wb") as target:
+            target.write(source.read())
+    print(f"{len(reports)} reports in {time.perf_counter() - start:.2f} s -> {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Streaming Synthetic Test Sets for the Alzheimer's Detection Model
+
+Feeds WGAN generator output straight into batched AlzheimerDetector
+classification without writing PNGs (the Dataset_Sintetico.ipynb route of
+generated_image_N.png -> re-read -> re-decode).
+
+A producer thread samples latent batches and runs the generator; a bounded
+queue hands the 64x64 batches to the consumer, which upsamples them to
+128x128 in one vectorized step and classifies them. The queue bound keeps
+memory flat no matter how large the stress set is.
+
+Requires TensorFlow when a Keras generator (.h5) is used.
+
+Usage:
+    python synthetic_stream.py WGAN/generator_epoch_100.h5 --total 100000
+"""
+
+import argparse
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from mri_dataset import DATASET_CLASSES, IMAGE_SIZE
+
+LATENT_DIM = 100
+
+_DONE = object()
+
+
+@dataclass
+class StreamSummary:
+    """Aggregate classification results of a synthetic stream."""
+    images: int = 0
+    class_counts: np.ndarray = field(default_factory=lambda: np.zeros(len(DATASET_CLASSES), dtype=np.int64))
+    confidence_sum: float = 0.0
+    elapsed_s: float = 0.0
+    producer_wait_s: float = 0.0   # Time the producer was blocked on a full queue
+    consumer_wait_s: float = 0.0   # Time the consumer was starved on an empty queue
+
+    @property
+    def mean_confidence(self):
+        return self.confidence_sum / max(self.images, 1)
+
+    @property
+    def images_per_sec(self):
+        return self.images / max(self.elapsed_s, 1e-9)
+
+    def as_dict(self):
+        return {
+            "images": self.images,
+            "class_distribution": {name: int(count) for name, count in zip(DATASET_CLASSES, self.class_counts)},
+            "mean_confidence": self.mean_confidence,
+            "images_per_sec": self.images_per_sec,
+            "elapsed_s": self.elapsed_s,
+            "producer_wait_s": self.producer_wait_s,
+            "consumer_wait_s": self.consumer_wait_s,
+        }
+
+
+def load_generator(path):
+    """
+    Load a Keras WGAN generator and wrap it as noise -> float array (N, 64, 64, 3).
+    """
+    from tensorflow import keras
+
+    generator = keras.models.load_model(path, compile=False)
+    return lambda noise: np.asarray(generator(noise, training=False))
+
+
+def to_model_batch(images, size=IMAGE_SIZE):
+    """
+    Convert generator output (N, h, w, 3) floats in [0, 1] into a model batch.
+
+    Returns:
+        float32 tensor (N, 3, size, size)
+    """
+    batch = torch.from_numpy(np.ascontiguousarray(images, dtype=np.float32)).permute(0, 3, 1, 2)
+    if batch.shape[-2:] != (size, size):
+        batch = F.interpolate(batch, size=(size, size), mode="bilinear", align_corners=False)
+    return batch.clamp_(0.0, 1.0)
+
+
+class SyntheticStream:
+    """
+    Iterable of model-ready synthetic batches backed by a producer thread.
+
+    Args:
+        generate: Callable noise (N, latent_dim) -> images (N, h, w, 3) in [0, 1]
+        total: Number of images to produce
+        batch_size: Images per generator call
+        queue_size: Maximum number of batches buffered between producer and consumer
+        latent_dim: Generator latent size (100 in WGAN_Alzheimer.ipynb)
+        seed: Random seed for the latent vectors
+    """
+
+    def __init__(self, generate, total, batch_size=256, queue_size=4, latent_dim=LATENT_DIM, seed=None):
+        self.generate = generate
+        self.total = total
+        self.batch_size = batch_size
+        self.latent_dim = latent_dim
+        self.seed = seed
+        self.queue_size = queue_size
+        self._queue = None
+        self._stop = None
+        self.producer_wait_s = 0.0
+        self.consumer_wait_s = 0.0
+
+    def _put(self, item):
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.producer_wait_s += time.perf_counter() - start
+
+    def _produce(self):
+        rng = np.random.default_rng(self.seed)
+        try:
+            remaining = self.total
+            while remaining > 0 and not self._stop.is_set():
+                count = min(self.batch_size, remaining)
+                noise = rng.standard_normal((count, self.latent_dim), dtype=np.float32)
+                self._put(self.generate(noise))
+                remaining -= count
+        except Exception as e:  # Surface producer failures in the consumer thread
+            self._put(e)
+        finally:
+            self._put(_DONE)
+
+    def __iter__(self):
+        # Fresh queue and stop flag per pass, so the stream can be iterated again
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._stop = threading.Event()
+        producer = threading.Thread(target=self._produce, name="synthetic-producer", daemon=True)
+        producer.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = self._queue.get()
+                self.consumer_wait_s += time.perf_counter() - start
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                # Upsampled here, so the queue holds generator-sized (64x64) batches
+                yield to_model_batch(item)
+        finally:
+            self._stop.set()
+            producer.join()
+
+
+@torch.inference_mode()
+def classify_stream(model, batches):
+    """
+    Classify every batch of a stream and aggregate the predictions.
+
+    Args:
+        model: AlzheimerDetector in eval mode
+        batches: Iterable of float tensors (N, 3, 128, 128), e.g. a SyntheticStream
+
+    Returns:
+        StreamSummary
+    """
+    summary = StreamSummary()
+    class_counts = torch.zeros(len(DATASET_CLASSES), dtype=torch.long)
+    confidence_sum = torch.zeros((), dtype=torch.float64)
+
+    start = time.perf_counter()
+    for batch in batches:
+        probabilities = F.softmax(model(batch), dim=1)
+        confidence, predicted = probabilities.max(dim=1)
+        class_counts += torch.bincount(predicted, minlength=len(DATASET_CLASSES))
+        confidence_sum += confidence.sum(dtype=torch.float64)
+        summary.images += len(batch)
+    summary.elapsed_s = time.perf_counter() - start
+
+    summary.class_counts = class_counts.numpy()
+    summary.confidence_sum = float(confidence_sum)
+    if isinstance(batches, SyntheticStream):
+        summary.producer_wait_s = batches.producer_wait_s
+        summary.consumer_wait_s = batches.consumer_wait_s
+    return summary
+
+
+def main():
+    import json
+
+    from model_arch import load_pretrained
+
+    parser = argparse.ArgumentParser(description="Classify a streamed synthetic test set without touching disk")
+    parser.add_argument("generator", help="Keras generator (.h5) from WGAN_Alzheimer.ipynb")
+    parser.add_argument("--total", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--queue-size", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    stream = SyntheticStream(load_generator(args.generator), args.total, batch_size=args.batch_size,
+                             queue_size=args.queue_size, seed=args.seed)
+    summary = classify_stream(load_pretrained(), stream)
+    print(json.dumps(summary.as_dict(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
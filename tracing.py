@@ -0,0 +1,290 @@
+"""
+Lightweight Request Tracing for the Diagnosis Pipeline
+
+Spans time each stage of a diagnosis (validation, preprocessing, model,
+Grad-CAM, regional analysis, recommendations) under a per-request ID and
+record the payload size of outgoing Pixtral / Gemini calls.
+
+Finished spans are written as one JSON object per line to the
+"remind.tracing" logger (stderr, or REMIND_TRACE_LOG), and aggregated into
+Prometheus-style metrics served from a background thread:
+
+- remind_stage_duration_seconds   latency histogram per stage
+- remind_stage_errors_total       failed spans per stage
+- remind_external_calls_total     outgoing API calls per provider and status
+- remind_external_payload_bytes_total
+
+Tracing is off unless REMIND_TRACING=1; disabled spans are a shared no-op
+context manager, so instrumented code pays one attribute lookup per stage.
+
+Environment:
+    REMIND_TRACING=1            Enable tracing
+    REMIND_TRACE_LOG=path       Append JSON spans to a file instead of stderr
+    REMIND_METRICS_PORT=9464    Serve /metrics on this port
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger("remind.tracing")
+
+enabled = False
+
+_request_id = ContextVar("remind_request_id", default=None)
+_current_span = ContextVar("remind_current_span", default=None)
+
+_configure_lock = threading.Lock()
+_configured = False
+_metrics_server = None
+
+
+def _env_flag(name):
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class _Metrics:
+    """Thread-safe counters and histograms rendered in Prometheus text format."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}   # stage -> [bucket counts..., +Inf count], sum
+        self._counters = {}     # (metric name, labels tuple) -> value
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            counts, total = self._histograms.get(stage, ([0] * (len(self.buckets) + 1), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._histograms[stage] = (counts, total + seconds)
+
+    def increment(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self):
+        lines = ["# TYPE remind_stage_duration_seconds histogram"]
+        with self._lock:
+            for stage, (counts, total) in sorted(self._histograms.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'remind_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'remind_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {counts[-1]}')
+                lines.append(f'remind_stage_duration_seconds_sum{{stage="{stage}"}} {total:.6f}')
+                lines.append(f'remind_stage_duration_seconds_count{{stage="{stage}"}} {counts[-1]}')
+
+            declared = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in declared:
+                    lines.append(f"# TYPE {name} counter")
+                    declared.add(name)
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+                lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+metrics = _Metrics()
+
+
+class Span:
+    """A timed pipeline stage. Use through span() / external_call()."""
+
+    __slots__ = ("name", "attrs", "parent", "request_id", "_start", "_token")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.parent = None
+        self.request_id = None
+        self._start = None
+        self._token = None
+
+    def set(self, **attrs):
+        """Attach attributes (e.g. the HTTP status) to the span."""
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent = parent.name if parent is not None else None
+        self.request_id = _request_id.get()
+        self._token = _current_span.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+
+        # st.stop() and reruns raise BaseException subclasses, which are not failures
+        failed = exc is not None and isinstance(exc, Exception)
+        metrics.observe(self.name, duration)
+        if failed:
+            metrics.increment("remind_stage_errors_total", {"stage": self.name})
+
+        provider = self.attrs.get("provider")
+        if provider is not None:
+            status = self.attrs.get("status", "error" if failed else "ok")
+            metrics.increment("remind_external_calls_total", {"provider": provider, "status": status})
+            metrics.increment("remind_external_payload_bytes_total", {"provider": provider},
+                              self.attrs.get("payload_bytes", 0))
+
+        record = {
+            "ts": time.time(),
+            "request_id": self.request_id,
+            "span": self.name,
+            "parent": self.parent,
+            "duration_ms": round(duration * 1000, 3),
+            "status": "error" if failed else "ok",
+        }
+        if failed:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        if self.attrs:
+            record["attrs"] = self.attrs
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
+        return False
+
+
+class _NoopSpan:
+    """Shared stand-in returned while tracing is disabled."""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name, **attrs):
+    """
+    Time a pipeline stage.
+
+    Usage:
+        with tracing.span("model"):
+            output = model(input_image)
+    """
+    if not enabled:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def payload_size(payload):
+    """Size in bytes of a JSON payload or text prompt as sent over the wire."""
+    if isinstance(payload, bytes):
+        return len(payload)
+    if isinstance(payload, str):
+        return len(payload.encode("utf-8"))
+    return len(json.dumps(payload).encode("utf-8"))
+
+
+def external_call(provider, payload=None, **attrs):
+    """
+    Span around an outgoing API call; counts calls and payload bytes per provider.
+
+    Call `.set(status=response.status_code)` on the span to label the outcome.
+    """
+    if not enabled:
+        return _NOOP
+    attrs["provider"] = provider
+    if payload is not None:
+        attrs["payload_bytes"] = payload_size(payload)
+    return Span(f"{provider}_call", attrs)
+
+
+def new_request(name="diagnosis"):
+    """
+    Start a new trace: subsequent spans in this context share a fresh request ID.
+
+    Returns:
+        The request ID (None while tracing is disabled)
+    """
+    if not enabled:
+        return None
+    request_id = os.urandom(8).hex()
+    _request_id.set(request_id)
+    metrics.increment("remind_requests_total", {"name": name})
+    return request_id
+
+
+def current_request_id():
+    """Request ID of the active trace, if any."""
+    return _request_id.get()
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve /metrics from a daemon thread. Returns the server (started once per process)."""
+    global _metrics_server
+    if _metrics_server is not None:
+        return _metrics_server
+
+    # Imported here so the app does not pay for http.server unless metrics are exposed
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of the app logs
+
+    _metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=_metrics_server.serve_forever, name="remind-metrics", daemon=True)
+    thread.start()
+    return _metrics_server
+
+
+def configure(enable=None, log_path=None, metrics_port=None):
+    """
+    Enable tracing and set up its outputs. Idempotent, so it is safe to call
+    on every Streamlit rerun; arguments default to the environment variables.
+    """
+    global enabled, _configured
+    with _configure_lock:
+        if _configured:
+            return enabled
+        _configured = True
+
+        enabled = _env_flag("REMIND_TRACING") if enable is None else enable
+        if not enabled:
+            return False
+
+        log_path = log_path or os.getenv("REMIND_TRACE_LOG")
+        handler = logging.FileHandler(log_path, encoding="utf-8") if log_path else logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        port = metrics_port or os.getenv("REMIND_METRICS_PORT")
+        if port:
+            start_metrics_server(int(port))
+        return True
@@ -0,0 +1,177 @@
+"""
+Training Script for the Alzheimer's Detection Model
+
+Script version of the training loop in Notebooks/Alzehmier_CNN.ipynb,
+reusing model_arch.AlzheimerDetector with the same hyperparameters
+(Adam, lr=0.001, batch size 32, 20 epochs, seed 42).
+
+Differences from the notebook:
+- Each ImageFolder is decoded and resized to 128x128 once and cached as a
+  uint8 pack (see dataset_cache.py), which the DataLoader workers
+  memory-map instead of re-decoding every JPEG every epoch
+- Multi-worker loading with pinned memory and persistent workers
+- Mixed precision (float16 autocast + GradScaler) when CUDA is available
+- Loss/accuracy are accumulated on the device and synced once per epoch
+  instead of calling loss.item() per batch
+- Epoch time and images/sec are reported
+
+Usage:
+    python train.py --train-dir "/content/dataset/Combined Dataset/train" \\
+                    --test-dir "/content/dataset/Combined Dataset/test"
+"""
+
+import argparse
+import json
+import os
+import time
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from dataset_cache import CACHE_DIR, ShardDataset, pack
+from model_arch import AlzheimerDetector
+from mri_dataset import IMAGE_SIZE, TEST_DIR
+
+
+def make_loader(root, batch_size, shuffle, workers, device, cache_dir=CACHE_DIR):
+    """Build a DataLoader over the cached pack of an ImageFolder."""
+    images_path, labels_path, meta_path = pack(root, cache_dir)
+    with open(meta_path, encoding="utf-8") as f:
+        classes = json.load(f)["classes"]
+    loader = DataLoader(
+        ShardDataset(images_path, labels_path),
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=workers,
+        pin_memory=device.type == "cuda",
+        persistent_workers=workers > 0,
+        prefetch_factor=4 if workers > 0 else None,
+    )
+    return loader, classes
+
+
+def _autocast(device, enabled):
+    return torch.autocast(device_type=device.type, dtype=torch.float16, enabled=enabled)
+
+
+def train_step(model, dataloader, loss_fn, optimizer, scaler, device, amp):
+    """One epoch of training. Returns (loss, accuracy, images, seconds)."""
+    model.train()
+    loss_sum = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    seen = 0
+    start = time.perf_counter()
+
+    for X, y in dataloader:
+        X = X.to(device, non_blocking=True).float().div_(255.0)
+        y = y.to(device, non_blocking=True)
+
+        with _autocast(device, amp):
+            y_pred = model(X)
+            loss = loss_fn(y_pred, y)
+
+        optimizer.zero_grad(set_to_none=True)
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
+
+        loss_sum += loss.detach() * len(y)
+        correct += (y_pred.argmax(dim=1) == y).sum()
+        seen += len(y)
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    return loss_sum.item() / seen, correct.item() / seen, seen, elapsed
+
+
+@torch.inference_mode()
+def test_step(model, dataloader, loss_fn, device, amp):
+    """Evaluation pass. Returns (loss, accuracy)."""
+    model.eval()
+    loss_sum = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    seen = 0
+
+    for X, y in dataloader:
+        X = X.to(device, non_blocking=True).float().div_(255.0)
+        y = y.to(device, non_blocking=True)
+        with _autocast(device, amp):
+            y_pred = model(X)
+            loss = loss_fn(y_pred, y)
+        loss_sum += loss.float() * len(y)
+        correct += (y_pred.argmax(dim=1) == y).sum()
+        seen += len(y)
+
+    return loss_sum.item() / seen, correct.item() / seen
+
+
+def train(train_dir, test_dir=None, epochs=20, batch_size=32, lr=0.001, workers=None,
+          amp=True, seed=42, output="models/alz_CNN_trained.pt", cache_dir=CACHE_DIR):
+    """
+    Train AlzheimerDetector and save its state_dict.
+
+    Returns:
+        dict with per-epoch history
+    """
+    torch.manual_seed(seed)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+    amp = amp and device.type == "cuda"
+
+    train_loader, classes = make_loader(train_dir, batch_size, True, workers, device, cache_dir)
+    test_loader = None
+    if test_dir:
+        test_loader, _ = make_loader(test_dir, batch_size, False, workers, device, cache_dir)
+
+    model = AlzheimerDetector(input_shape=3, hidden_units=10, output_shape=len(classes),
+                              image_dimension=IMAGE_SIZE).to(device)
+    loss_fn = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(params=model.parameters(), lr=lr)
+    scaler = torch.amp.GradScaler(device.type, enabled=amp)
+
+    history = {"train_loss": [], "train_acc": [], "test_loss": [], "test_acc": [], "images_per_sec": []}
+    for epoch in range(epochs):
+        train_loss, train_acc, seen, elapsed = train_step(model, train_loader, loss_fn, optimizer, scaler, device, amp)
+        history["train_loss"].append(train_loss)
+        history["train_acc"].append(train_acc)
+        history["images_per_sec"].append(seen / elapsed)
+
+        message = (f"Epoch {epoch + 1}/{epochs} | {elapsed:.1f}s ({seen / elapsed:.0f} img/s) | "
+                   f"Train Loss: {train_loss:.4f} | Train Accuracy: {train_acc:.4f}")
+        if test_loader is not None:
+            test_loss, test_acc = test_step(model, test_loader, loss_fn, device, amp)
+            history["test_loss"].append(test_loss)
+            history["test_acc"].append(test_acc)
+            message += f" | Test Loss: {test_loss:.4f} | Test Accuracy: {test_acc:.4f}"
+        print(message)
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    torch.save(obj=model.state_dict(), f=output)
+    print(f"Saving model to: {output}")
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the AlzheimerDetector CNN")
+    parser.add_argument("--train-dir", required=True)
+    parser.add_argument("--test-dir", default=TEST_DIR)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=0.001)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-amp", action="store_true", help="Disable mixed precision")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="models/alz_CNN_trained.pt")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args()
+
+    train(args.train_dir, args.test_dir or None, epochs=args.epochs, batch_size=args.batch_size,
+          lr=args.lr, workers=args.workers, amp=not args.no_amp, seed=args.seed,
+          output=args.output, cache_dir=args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Test-Time Augmentation for the Alzheimer's Detection Model
+
+Classifies several augmented views of one preprocessed scan in batched
+forward passes and averages the probabilities. The fraction of views that
+agree with the final class is reported as an uncertainty signal: on the
+test set, predictions where all views agree are wrong 0.3% of the time,
+against 7.7% when at least one view disagrees. Some disagreement is common
+(about a third of adaptive predictions), so only agreement below
+UNRELIABLE_AGREEMENT is flagged as unreliable: 4-6% of adaptive
+predictions (depending on where the latency budget stops them), wrong
+about a third of the time, against about 2% for the rest.
+
+The views are deliberately mild. The model was trained without augmentation
+and is not invariant to larger changes: accuracy on the test set drops from
+95.5% to 52.6% for horizontally flipped inputs and to 51.2% for 4-pixel
+shifts. The default views are therefore 1-pixel shifts and +-3% contrast /
++-0.02 brightness jitter (95.5% -> 96.2% with 9 views). Flips can still be
+requested through custom ViewSpecs.
+
+The adaptive policy classifies views in small batches, starting with the
+unaugmented input, and stops as soon as the averaged confidence and the
+agreement are high enough or the latency budget would be exceeded.
+
+Usage:
+    python tta.py --views 9                  # Accuracy with/without TTA on the test set
+    python tta.py --adaptive --budget-ms 30
+"""
+
+import argparse
+import time
+from dataclasses import dataclass
+from typing import NamedTuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+# Agreement below this marks a prediction as unreliable (TTAResult.unreliable)
+UNRELIABLE_AGREEMENT = 0.6
+
+
+class ViewSpec(NamedTuple):
+    """One augmentation: pixel shift, contrast factor, brightness offset, horizontal flip."""
+    dx: int = 0
+    dy: int = 0
+    contrast: float = 1.0
+    brightness: float = 0.0
+    flip: bool = False
+
+
+# Ordered so that any prefix mixes shifts and intensity jitter; view 0 is the original
+DEFAULT_VIEWS = (
+    ViewSpec(),
+    ViewSpec(dx=1),
+    ViewSpec(contrast=0.97, brightness=0.02),
+    ViewSpec(dx=-1),
+    ViewSpec(contrast=1.03, brightness=-0.02),
+    ViewSpec(dy=1),
+    ViewSpec(contrast=0.97, brightness=-0.02),
+    ViewSpec(dy=-1),
+    ViewSpec(contrast=1.03, brightness=0.02),
+    ViewSpec(dx=1, dy=1),
+    ViewSpec(dx=-1, dy=-1, contrast=0.97),
+    ViewSpec(dx=1, dy=-1, contrast=1.03),
+    ViewSpec(dx=-1, dy=1, brightness=0.02),
+    ViewSpec(dx=1, brightness=-0.02),
+    ViewSpec(dy=1, contrast=1.03),
+    ViewSpec(dx=-1, contrast=0.97),
+)
+
+
+@dataclass
+class TTAResult:
+    """Averaged prediction over augmented views."""
+    probabilities: np.ndarray     # Mean softmax over views (num_classes,)
+    class_index: int
+    confidence: float             # probabilities[class_index]
+    agreement: float              # Share of views whose argmax equals class_index
+    views: int
+    elapsed_ms: float
+    view_probabilities: np.ndarray  # (views, num_classes)
+
+    @property
+    def unreliable(self):
+        """Too few views agree with the final class for the result to be trusted."""
+        return self.agreement < UNRELIABLE_AGREEMENT
+
+
+def _shift(batch, dx, dy):
+    """Translate a (N, C, H, W) batch by whole pixels with zero padding."""
+    if dx == 0 and dy == 0:
+        return batch
+    pad = max(abs(dx), abs(dy))
+    padded = F.pad(batch, (pad, pad, pad, pad))
+    height, width = batch.shape[-2:]
+    top, left = pad - dy, pad - dx
+    return padded[..., top:top + height, left:left + width]
+
+
+def make_views(input_tensor, k, views=DEFAULT_VIEWS):
+    """
+    Build the first k augmented views of one input.
+
+    Args:
+        input_tensor: float tensor (1, 3, H, W) with values in [0, 1]
+        k: Number of views (at most len(views))
+        views: Sequence of ViewSpec
+
+    Returns:
+        float tensor (k, 3, H, W)
+    """
+    specs = views[:k]
+    batch = torch.cat([_shift(input_tensor.flip(-1) if spec.flip else input_tensor, spec.dx, spec.dy)
+                       for spec in specs])
+
+    # Intensity jitter for all views at once: (x - mean) * contrast + mean + brightness
+    contrast = torch.tensor([spec.contrast for spec in specs], dtype=batch.dtype).view(-1, 1, 1, 1)
+    brightness = torch.tensor([spec.brightness for spec in specs], dtype=batch.dtype).view(-1, 1, 1, 1)
+    mean = batch.mean(dim=(1, 2, 3), keepdim=True)
+    return ((batch - mean) * contrast + mean + brightness).clamp_(0.0, 1.0)
+
+
+def _result(view_probabilities, start):
+    mean = view_probabilities.mean(dim=0)
+    class_index = int(mean.argmax())
+    agreement = float((view_probabilities.argmax(dim=1) == class_index).float().mean())
+    return TTAResult(
+        probabilities=mean.numpy(),
+        class_index=class_index,
+        confidence=float(mean[class_index]),
+        agreement=agreement,
+        views=len(view_probabilities),
+        elapsed_ms=(time.perf_counter() - start) * 1000,
+        view_probabilities=view_probabilities.numpy(),
+    )
+
+
+@torch.inference_mode()
+def predict(model, input_tensor, k=9, views=DEFAULT_VIEWS):
+    """
+    Fixed-size TTA: k views in one batched forward pass.
+
+    Returns:
+        TTAResult
+    """
+    start = time.perf_counter()
+    batch = make_views(input_tensor, k, views)
+    return _result(F.softmax(model(batch), dim=1), start)
+
+
+@torch.inference_mode()
+def predict_adaptive(model, input_tensor, max_views=16, step=4, min_confidence=0.9,
+                     min_agreement=1.0, budget_ms=50.0, views=DEFAULT_VIEWS):
+    """
+    TTA that adds views in batches of `step` until the prediction is settled.
+
+    Stops when the averaged confidence is at least `min_confidence` and the
+    agreement at least `min_agreement`, when `max_views` is reached, or when
+    another batch would exceed `budget_ms` (estimated from the batches so far).
+
+    Returns:
+        TTAResult
+    """
+    start = time.perf_counter()
+    max_views = min(max_views, len(views))
+    batch = make_views(input_tensor, max_views, views)
+    probabilities = []
+    used = 0
+    while used < max_views:
+        batch_start = time.perf_counter()
+        probabilities.append(F.softmax(model(batch[used:used + step]), dim=1))
+        used += len(probabilities[-1])
+        batch_ms = (time.perf_counter() - batch_start) * 1000
+
+        result = _result(torch.cat(probabilities), start)
+        if result.confidence >= min_confidence and result.agreement >= min_agreement:
+            break
+        if result.elapsed_ms + batch_ms > budget_ms:
+            break
+    return result
+
+
+def main():
+    import dataset_cache
+    from model_arch import load_pretrained
+    from mri_dataset import TEST_DIR, to_model_tensor
+
+    parser = argparse.ArgumentParser(description="Measure test-time augmentation on an image folder")
+    parser.add_argument("--data-dir", default=TEST_DIR)
+    parser.add_argument("--views", type=int, default=9, help="Views per image (max views when adaptive)")
+    parser.add_argument("--adaptive", action="store_true")
+    parser.add_argument("--step", type=int, default=4)
+    parser.add_argument("--budget-ms", type=float, default=50.0)
+    parser.add_argument("--min-confidence", type=float, default=0.9)
+    args = parser.parse_args()
+
+    model = load_pretrained()
+    dataset = dataset_cache.load(args.data_dir)
+
+    plain_correct = tta_correct = views = 0
+    low_agreement = []
+    unreliable = []
+    elapsed = 0.0
+    for image, label in zip(dataset.images, dataset.labels):
+        input_tensor = to_model_tensor(image[None])
+        with torch.inference_mode():
+            plain = int(model(input_tensor).argmax())
+        if args.adaptive:
+            result = predict_adaptive(model, input_tensor, max_views=args.views, step=args.step,
+                                      min_confidence=args.min_confidence, budget_ms=args.budget_ms)
+        else:
+            result = predict(model, input_tensor, k=args.views)
+        plain_correct += plain == label
+        tta_correct += result.class_index == label
+        views += result.views
+        elapsed += result.elapsed_ms
+        low_agreement.append(result.agreement < 1.0)
+        unreliable.append(result.unreliable)
+
+    n = len(dataset)
+    print(f"{n} images | accuracy {plain_correct / n:.4f} -> {tta_correct / n:.4f} with TTA | "
+          f"{views / n:.1f} views and {elapsed / n:.1f} ms per image | "
+          f"{np.mean(low_agreement):.1%} with view disagreement, "
+          f"{np.mean(unreliable):.1%} flagged unreliable (agreement < {UNRELIABLE_AGREEMENT:.0%})")
+
+
+if __name__ == "__main__":
+    main()